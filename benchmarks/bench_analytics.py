@@ -0,0 +1,81 @@
+"""
+Benchmark decode_analytics against converting analytics rows into dicts one by one.
+
+Usage:
+
+    python benchmarks/bench_analytics.py --rows 1000000
+
+pandas / pyarrow engines are skipped when not installed.
+"""
+
+import argparse
+import importlib
+import importlib.util
+import json
+import time
+
+from dhis2 import decode_analytics
+
+
+def analytics_body(rows):
+    headers = [
+        {"name": "dx", "valueType": "TEXT"},
+        {"name": "pe", "valueType": "TEXT"},
+        {"name": "ou", "valueType": "TEXT"},
+        {"name": "value", "valueType": "NUMBER"},
+    ]
+    data = [
+        ["fbfJHSPpUQD", "2021{:02d}".format(i % 12 + 1), "DiszpKrYNg8", "{}.5".format(i)]
+        for i in range(rows)
+    ]
+    return json.dumps({"headers": headers, "rows": data, "metaData": {"items": {}}}).encode("utf-8")
+
+
+def row_dicts(body):
+    """What consumers typically do: a dict per row, values converted by hand"""
+    data = json.loads(body)
+    names = [h["name"] for h in data["headers"]]
+    rows = [dict(zip(names, row)) for row in data["rows"]]
+    for row in rows:
+        row["value"] = float(row["value"])
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=500000)
+    args = parser.parse_args()
+
+    body = analytics_body(args.rows)
+    size_mb = len(body) / 1e6
+    cases = [("row dicts", lambda: row_dicts(body), None)]
+    for engine in ("python", "pandas", "pyarrow"):
+        cases.append(
+            (
+                "columns [{}]".format(engine),
+                lambda engine=engine: len(decode_analytics(body, engine=engine)["value"]),
+                engine if engine != "python" else None,
+            )
+        )
+
+    print("{} rows, {:.1f} MB".format(args.rows, size_mb))
+    print("{:<22} {:>10} {:>14} {:>10}".format("case", "seconds", "rows/s", "MB/s"))
+    for name, run, requirement in cases:
+        if requirement and importlib.util.find_spec(requirement) is None:
+            print("{:<22} {:>10}".format(name, "skipped"))
+            continue
+        if requirement:
+            importlib.import_module(requirement)  # not part of the timing
+        start = time.perf_counter()
+        count = run()
+        elapsed = time.perf_counter() - start
+        assert count == args.rows, (name, count)
+        print(
+            "{:<22} {:>10.3f} {:>14,.0f} {:>10.1f}".format(
+                name, elapsed, count / elapsed, size_mb / elapsed
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
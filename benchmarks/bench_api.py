@@ -0,0 +1,320 @@
+"""
+Benchmark the Api client and utilities against a local stub DHIS2 server (benchmarks/stub_server.py).
+
+Every case runs in a fresh interpreter so that its peak RSS can be measured on its own.
+Throughput is reported as requests/s, objects/s and MB/s. Requests and bytes are counted by the stub server,
+so the client runs without request hooks unless --metrics is given.
+
+Usage:
+
+    python benchmarks/bench_api.py                                  # print results
+    python benchmarks/bench_api.py --latency 0.02                   # emulate a remote server
+    python benchmarks/bench_api.py --save benchmarks/baselines.json     # store new baselines
+    python benchmarks/bench_api.py --compare benchmarks/baselines.json  # exit 1 on regressions
+    python benchmarks/bench_api.py --compare benchmarks/baselines.json --report-only  # CI: print them only
+
+Baselines store throughput relative to a small pure-Python calibration loop,
+so that they can be compared across machines of different speed - but not across Python versions,
+and I/O bound cases vary more than the calibration does. Only compare runs with the same
+--latency / size arguments and the Python version the baselines were recorded with.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_server import StubServer, fake_uid  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# throughput of cases that run shorter than this is within timer noise and not compared
+MIN_SECONDS = 0.05
+
+CASES = ("get_paged", "get_sqlview", "post_partitioned", "clean_obj", "partition_payload", "generate_uid")
+# pure-Python micro-benchmarks without requests: a few runs vary a lot with the machine's load,
+# they run at least MICRO_REPEAT times (the median counts) and are compared with at least MICRO_TOLERANCE
+MICRO_CASES = ("clean_obj", "partition_payload", "generate_uid")
+MICRO_REPEAT = 11
+MICRO_TOLERANCE = 0.5
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def calibrate(seconds=0.3, repeat=3):
+    """:return: iterations per second of a fixed pure-Python workload (best of `repeat`)"""
+    return max(_calibrate_once(seconds) for _ in range(repeat))
+
+
+def _calibrate_once(seconds):
+    obj = {"id": "abcdefghijk", "values": list(range(50)), "nested": {"a": [1, 2, 3]}}
+    iterations = 0
+    start = time.perf_counter()
+    while True:
+        for _ in range(100):
+            json.loads(json.dumps(obj))
+            sorted(str(i) for i in range(50))
+        iterations += 100
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return iterations / elapsed
+
+
+def metadata_payload(objects):
+    """Nested metadata with sharing keys, like a metadata export"""
+    return {
+        "dataElements": [
+            {
+                "id": fake_uid(i),
+                "name": "Data element {}".format(i),
+                "publicAccess": "rw------",
+                "userGroupAccesses": [{"id": fake_uid(j), "access": "rw------"} for j in range(3)],
+                "attributeValues": [{"value": str(i), "attribute": {"id": fake_uid(0)}}],
+                "user": {"id": fake_uid(1)},
+            }
+            for i in range(objects)
+        ]
+    }
+
+
+def data_values_payload(objects):
+    return {
+        "dataValues": [
+            {
+                "dataElement": fake_uid(i % 1000),
+                "period": "2021{:02d}".format(i % 12 + 1),
+                "orgUnit": fake_uid(i % 5000),
+                "value": str(i),
+            }
+            for i in range(objects)
+        ]
+    }
+
+
+def run_case(name, args):
+    """
+    Run one case `args.repeat` times in this process (micro-benchmarks at least MICRO_REPEAT times)
+    :return: dict of results of the fastest run (the median one for micro-benchmarks),
+    without the requests and bytes counted by the stub server
+    """
+    from dhis2 import Api, RequestMetrics, clean_obj, generate_uid
+    from dhis2.utils import partition_payload
+
+    api = Api(args.url, "admin", "district")
+    if args.metrics:
+        api.add_request_hook(RequestMetrics())
+
+    def once():
+        """:return: (objects, bytes processed without requests, seconds)"""
+        size = 0
+        start = time.perf_counter()
+        if name == "get_paged":
+            objects = 0
+            for page in api.get_paged("organisationUnits", page_size=args.page_size):
+                objects += len(page["organisationUnits"])
+        elif name == "get_sqlview":
+            objects = sum(1 for _ in api.get_sqlview(fake_uid(0)))
+        elif name == "post_partitioned":
+            payload = data_values_payload(args.objects)
+            start = time.perf_counter()
+            for _ in api.post_partitioned("dataValueSets", json=payload, thresh=args.thresh):
+                pass
+            objects = args.objects
+        elif name == "clean_obj":
+            payload = metadata_payload(args.objects // 10)
+            size = len(json.dumps(payload))
+            start = time.perf_counter()
+            clean_obj(payload, ["publicAccess", "userGroupAccesses", "user"])
+            objects = len(payload["dataElements"])
+        elif name == "partition_payload":
+            payload = data_values_payload(args.objects)
+            size = len(json.dumps(payload))
+            start = time.perf_counter()
+            objects = sum(len(p["dataValues"]) for p in partition_payload(payload, "dataValues", 1000))
+        elif name == "generate_uid":
+            objects = args.objects
+            for _ in range(objects):
+                generate_uid()
+        else:
+            raise ValueError("Unknown case: {}".format(name))
+        return objects, size, time.perf_counter() - start
+
+    runs = sorted((once() for _ in range(repeats(name, args.repeat))), key=lambda run: run[2])
+    objects, size, elapsed = runs[len(runs) // 2] if name in MICRO_CASES else runs[0]
+    return {
+        "case": name,
+        "seconds": elapsed,
+        "objects": objects,
+        "bytes": size,
+        "objects_per_sec": objects / elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_isolated(name, args, server):
+    """Run one case in a fresh interpreter and :return: its results"""
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--run-case",
+        name,
+        "--url",
+        args.url,
+        "--objects",
+        str(args.objects),
+        "--page-size",
+        str(args.page_size),
+        "--thresh",
+        str(args.thresh),
+        "--repeat",
+        str(args.repeat),
+    ] + (["--metrics"] if args.metrics else [])
+    requests, size = server.requests, server.bytes
+    out = subprocess.run(command, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    # every run sends the same requests
+    result["requests"] = (server.requests - requests) / repeats(name, args.repeat)
+    result["bytes"] += (server.bytes - size) / repeats(name, args.repeat)
+    result["requests_per_sec"] = result["requests"] / result["seconds"]
+    result["mb_per_sec"] = result["bytes"] / 1e6 / result["seconds"]
+    return result
+
+
+def repeats(name, repeat):
+    """:return: how often a case runs"""
+    return max(repeat, MICRO_REPEAT) if name in MICRO_CASES else repeat
+
+
+def compare(results, calibration, baselines, tolerance):
+    """
+    :return: list of regression messages - throughput (relative to the calibration)
+    lower or peak RSS higher than the baseline by more than `tolerance` (MICRO_TOLERANCE for micro-benchmarks).
+    The throughput of cases that ran shorter than MIN_SECONDS is not compared.
+    """
+    regressions = []
+    for result in results:
+        baseline = baselines["cases"].get(result["case"])
+        if not baseline:
+            continue
+        throughput_tolerance = max(tolerance, MICRO_TOLERANCE) if result["case"] in MICRO_CASES else tolerance
+        for key in ("objects_per_sec", "mb_per_sec"):
+            if result["seconds"] < MIN_SECONDS:
+                break
+            if not baseline.get(key):
+                continue
+            relative = result[key] / calibration
+            expected = baseline[key] / baselines["calibration"]
+            if relative < expected * (1 - throughput_tolerance):
+                regressions.append(
+                    "{} {}: {:.1%} of baseline".format(result["case"], key, relative / expected)
+                )
+        if baseline.get("peak_rss_mb") and result["peak_rss_mb"]:
+            if result["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+                regressions.append(
+                    "{} peak_rss_mb: {:.1f} MB, baseline {:.1f} MB".format(
+                        result["case"], result["peak_rss_mb"], baseline["peak_rss_mb"]
+                    )
+                )
+    return regressions
+
+
+def print_results(results):
+    print(
+        "{:<18} {:>9} {:>10} {:>12} {:>9} {:>10}".format(
+            "case", "seconds", "req/s", "objects/s", "MB/s", "peak RSS"
+        )
+    )
+    for r in results:
+        print(
+            "{:<18} {:>9.3f} {:>10,.0f} {:>12,.0f} {:>9.1f} {:>10}".format(
+                r["case"],
+                r["seconds"],
+                r["requests_per_sec"],
+                r["objects_per_sec"],
+                r["mb_per_sec"],
+                "{:.1f} MB".format(r["peak_rss_mb"]) if r["peak_rss_mb"] else "n/a",
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES))
+    parser.add_argument("--objects", type=int, default=50000, help="objects per collection / payload")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--thresh", type=int, default=1000, help="post_partitioned chunk size")
+    parser.add_argument("--item-bytes", type=int, default=100, help="padding bytes per paged object")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="runs per case, the fastest counts (micro-benchmarks: the median)"
+    )
+    parser.add_argument("--latency", type=float, default=0.0, help="stub server latency per request")
+    parser.add_argument("--save", metavar="PATH", help="write results as new baselines")
+    parser.add_argument("--compare", metavar="PATH", help="compare with baselines, exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed relative regression")
+    parser.add_argument("--report-only", action="store_true", help="print regressions but exit 0")
+    parser.add_argument("--metrics", action="store_true", help="measure with a RequestMetrics hook")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args)))
+        return
+
+    with StubServer(latency=args.latency, items=args.objects, item_bytes=args.item_bytes, csv_rows=args.objects) as server:
+        args.url = server.url
+        calibration = calibrate()
+        results = [run_isolated(name, args, server) for name in args.cases]
+
+    print("calibration: {:,.0f} iterations/s".format(calibration))
+    print_results(results)
+
+    if args.save:
+        baselines = {
+            "calibration": round(calibration, 1),
+            "python": sys.version.split()[0],
+            "cases": {
+                r["case"]: {
+                    k: round(r[k], 1) if r[k] is not None else None
+                    for k in ("objects_per_sec", "mb_per_sec", "peak_rss_mb")
+                }
+                for r in results
+            },
+        }
+        with open(args.save, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("Saved baselines to {}".format(args.save))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baselines = json.load(f)
+        python = ".".join(sys.version.split()[0].split(".")[:2])
+        if not baselines.get("python", "").startswith(python + "."):
+            print("Baselines were recorded with Python {}, this is Python {}".format(baselines.get("python"), python))
+        regressions = compare(results, calibration, baselines, args.tolerance)
+        for message in regressions:
+            print("REGRESSION: {}".format(message))
+        if not regressions:
+            print("No regressions (tolerance {:.0%})".format(args.tolerance))
+        elif args.report_only:
+            print("{} regression(s) (report only)".format(len(regressions)))
+        else:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Measure the startup cost of `import dhis2` with `python -X importtime`.
+
+Usage:
+
+    python benchmarks/bench_import.py --runs 10 --top 15
+
+Prints the median total import time and the slowest modules (cumulative) of the median run.
+The budget for dhis2's own modules is checked by tests/test_import_time.py.
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+
+def importtime(code):
+    """:return: list of (module, nesting level, self microseconds, cumulative microseconds) in import order"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    ).stderr
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((name.strip(), level, int(self_us), int(cumulative_us)))
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--code", default="import dhis2", help="statement to measure")
+    args = parser.parse_args()
+
+    runs = []
+    for _ in range(args.runs):
+        modules = importtime(args.code)
+        total = sum(cumulative for _, level, _, cumulative in modules if level == 0)
+        runs.append((total, modules))
+    runs.sort(key=lambda run: run[0])
+    total, modules = runs[len(runs) // 2]
+
+    own = sum(self_us for name, _, self_us, _ in modules if name.split(".")[0] == "dhis2")
+    print("{}: median {:.1f} ms over {} runs (min {:.1f} ms)".format(
+        args.code, statistics.median(r[0] for r in runs) / 1000, args.runs, runs[0][0] / 1000
+    ))
+    print("dhis2 modules (self): {:.1f} ms".format(own / 1000))
+    print()
+    print("{:>10} {:>10}  module".format("self ms", "cumul. ms"))
+    for name, level, self_us, cumulative in sorted(modules, key=lambda m: -m[3])[: args.top]:
+        print("{:>10.1f} {:>10.1f}  {}{}".format(self_us / 1000, cumulative / 1000, "  " * level, name))
+
+
+if __name__ == "__main__":
+    main()
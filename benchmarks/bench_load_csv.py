@@ -0,0 +1,121 @@
+"""
+Benchmark dhis2.load_csv against the previous (2.3.0) implementation.
+
+Usage:
+
+    python benchmarks/bench_load_csv.py --rows 500000
+
+pandas / pyarrow engines are skipped when not installed.
+"""
+
+import argparse
+import csv
+import importlib.util
+import os
+import tempfile
+import time
+from csv import DictReader
+
+from dhis2 import load_csv
+
+
+def legacy_load_csv(path, delimiter=","):
+    """load_csv as shipped in dhis2.py 2.3.0"""
+    with open(path, "r") as csvfile:
+        reader = DictReader(csvfile, delimiter=delimiter)
+        for row in reader:
+            yield row
+
+
+def write_data_values(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(
+            [
+                "dataElement",
+                "period",
+                "orgUnit",
+                "categoryOptionCombo",
+                "attributeOptionCombo",
+                "value",
+            ]
+        )
+        for i in range(rows):
+            w.writerow(
+                [
+                    "fbfJHSPpUQD",
+                    "2021{:02d}".format(i % 12 + 1),
+                    "DiszpKrYNg8",
+                    "pq2XI5kz2BY",
+                    "HllvX50cXC0",
+                    str(i),
+                ]
+            )
+
+
+def consume(iterable):
+    """Exhaust rows / batches and return the number of rows seen"""
+    count = 0
+    for item in iterable:
+        if isinstance(item, list):  # batch of rows
+            count += len(item)
+        elif isinstance(item.get("value"), list):  # batch of columns
+            count += len(item["value"])
+        else:  # single row
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "dataValues.csv")
+    write_data_values(path, args.rows)
+    size_mb = os.path.getsize(path) / 1e6
+    converters = {"value": int}
+
+    cases = [
+        ("legacy (2.3.0)", lambda: legacy_load_csv(path), None),
+        ("rows", lambda: load_csv(path, encoding="utf-8"), None),
+        ("rows + converters", lambda: load_csv(path, encoding="utf-8", converters=converters), None),
+        ("batched rows", lambda: load_csv(path, encoding="utf-8", batch_size=args.batch_size), None),
+    ]
+    for engine in ("python", "pandas", "pyarrow"):
+        cases.append(
+            (
+                "columnar [{}]".format(engine),
+                lambda engine=engine: load_csv(
+                    path,
+                    encoding="utf-8",
+                    batch_size=args.batch_size,
+                    columnar=True,
+                    converters=converters,
+                    engine=engine,
+                ),
+                engine if engine != "python" else None,
+            )
+        )
+
+    print("{} rows, {:.1f} MB".format(args.rows, size_mb))
+    print("{:<22} {:>10} {:>14} {:>10}".format("case", "seconds", "rows/s", "MB/s"))
+    for name, factory, requirement in cases:
+        if requirement and importlib.util.find_spec(requirement) is None:
+            print("{:<22} {:>10}".format(name, "skipped"))
+            continue
+        start = time.perf_counter()
+        count = consume(factory())
+        elapsed = time.perf_counter() - start
+        assert count == args.rows, (name, count)
+        print(
+            "{:<22} {:>10.3f} {:>14,.0f} {:>10.1f}".format(
+                name, elapsed, count / elapsed, size_mb / elapsed
+            )
+        )
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
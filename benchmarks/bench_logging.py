@@ -0,0 +1,84 @@
+"""
+Benchmark a log-heavy loop with synchronous logging and with setup_logger(queue_size=...).
+
+Usage:
+
+    python benchmarks/bench_logging.py --lines 100000 --threads 4
+
+"loop" is the time the logging threads spend, "total" includes writing out the queue.
+Every line goes to a rotating log file and to the console (redirected to /dev/null).
+--latency adds a delay per line, as writing to a slow disk, network share or terminal would.
+"""
+
+import argparse
+import contextlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from dhis2 import setup_logger
+from dhis2.logger import stop_queue_logging
+
+
+class SlowStorage(logging.Handler):
+    def __init__(self, latency):
+        super(SlowStorage, self).__init__()
+        self.latency = latency
+
+    def emit(self, record):
+        time.sleep(self.latency)
+
+
+def log_loop(logger, lines):
+    for i in range(lines):
+        logger.info("Organisation unit %s (%d) was opened %s", "Ngelehun CHC", i, "AFTER")
+
+
+def run(lines, threads, **options):
+    directory = tempfile.mkdtemp()
+    setup_logger(logfile=os.path.join(directory, "bench.log"), **options)
+    from dhis2 import logger
+
+    workers = [threading.Thread(target=log_loop, args=(logger, lines // threads)) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    loop = time.perf_counter() - start
+    dropped = getattr(logger.handlers[0], "dropped", 0)
+    stop_queue_logging()
+    total = time.perf_counter() - start
+    return loop, total, dropped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=100000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per written line, e.g. 0.0001")
+    args = parser.parse_args()
+
+    cases = [
+        ("synchronous", {}),
+        ("queue, block", {"queue_size": 10000, "block_when_full": True}),
+        ("queue, drop", {"queue_size": 10000}),
+    ]
+    print("{} lines, {} threads, {} s latency".format(args.lines, args.threads, args.latency))
+    print("{:<16} {:>10} {:>10} {:>14} {:>10}".format("case", "loop [s]", "total [s]", "lines/s (loop)", "dropped"))
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stderr(devnull):
+        if args.latency:
+            from dhis2 import logger
+
+            logger.addHandler(SlowStorage(args.latency))  # kept by setup_logger
+        for name, options in cases:
+            loop, total, dropped = run(args.lines, args.threads, **options)
+            print(
+                "{:<16} {:>10.3f} {:>10.3f} {:>14,.0f} {:>10}".format(name, loop, total, args.lines / loop, dropped)
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+A local stub of the DHIS2 Web API for benchmarks.
+
+It serves:
+
+- GET  /api/system/info
+- GET  /api/<collection>          paged, with a `pager`, e.g. /api/organisationUnits.json?page=2&pageSize=50
+- GET  /api/sqlViews/<uid>        type VIEW
+- GET  /api/sqlViews/<uid>/data   CSV with `csv_rows` rows
+- POST /api/<import endpoint>     e.g. metadata, dataValueSets - returns an import summary
+
+with a configurable latency per request and configurable payload sizes.
+Responses are rendered once and cached, so the server is rarely the bottleneck.
+
+Usage (standalone, for manual testing):
+
+    python benchmarks/stub_server.py --port 8080 --latency 0.05
+    # then Api('localhost:8080', 'admin', 'district')
+"""
+
+import argparse
+import json
+import socketserver
+import threading
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SQL_VIEW_COLUMNS = ("dataelement", "period", "orgunit", "categoryoptioncombo", "value")
+IMPORT_SUMMARY = json.dumps(
+    {
+        "responseType": "ImportSummary",
+        "status": "SUCCESS",
+        "importCount": {"imported": 0, "updated": 0, "ignored": 0, "deleted": 0},
+    }
+).encode("utf-8")
+
+
+def fake_uid(i):
+    """A deterministic, valid looking UID"""
+    return "a{:010d}".format(i)
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer only exists from Python 3.7
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class StubServer(object):
+    """
+    Run the stub server in a background thread.
+
+    with StubServer(items=10000, latency=0.01) as server:
+        api = Api(server.url, 'admin', 'district')
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, items=10000, item_bytes=100, csv_rows=100000):
+        """
+        :param host: interface to bind to
+        :param port: port to bind to, 0 picks a free one
+        :param latency: seconds to wait before every response
+        :param items: total objects of every paged collection
+        :param item_bytes: size of the padding field of every object
+        :param csv_rows: rows of every SQL view
+        """
+        self.latency = latency
+        self.items = items
+        self.item_bytes = item_bytes
+        self.csv_rows = csv_rows
+        self.requests = 0
+        self.bytes = 0  # request and response bodies
+        self._lock = threading.Lock()
+        self.httpd = _ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @lru_cache(maxsize=1024)
+    def page(self, collection, page, page_size):
+        page_count = max(1, -(-self.items // page_size))
+        start = (page - 1) * page_size
+        padding = "x" * self.item_bytes
+        objects = [
+            {"id": fake_uid(i), "name": "{} {}".format(collection, i), "padding": padding}
+            for i in range(start, min(start + page_size, self.items))
+        ]
+        body = {
+            "pager": {"page": page, "pageCount": page_count, "total": self.items, "pageSize": page_size},
+            collection: objects,
+        }
+        return json.dumps(body).encode("utf-8")
+
+    @lru_cache(maxsize=1)
+    def sqlview_csv(self):
+        lines = [",".join(SQL_VIEW_COLUMNS)]
+        for i in range(self.csv_rows):
+            lines.append("{},2021{:02d},{},{},{}".format(fake_uid(i % 1000), i % 12 + 1, fake_uid(i % 5000), fake_uid(0), i))
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like a real DHIS2 behind nginx
+            disable_nagle_algorithm = True  # headers and body are written separately
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, body, content_type="application/json", status=200):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with server._lock:
+                    server.bytes += len(body)
+
+            def _route(self):
+                with server._lock:
+                    server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                url = urlparse(self.path)
+                path = url.path.split("/api/", 1)[-1]
+                resource = path.rpartition(".")[0] if "." in path else path
+                return resource, parse_qs(url.query)
+
+            def do_GET(self):
+                resource, query = self._route()
+                parts = resource.split("/")
+                if resource == "system/info":
+                    self._send(json.dumps({"version": "2.36.0", "revision": "stub"}).encode("utf-8"))
+                elif parts[0] == "sqlViews" and len(parts) == 3 and parts[2] == "data":
+                    self._send(server.sqlview_csv(), content_type="text/csv")
+                elif parts[0] == "sqlViews" and len(parts) == 2:
+                    self._send(b'{"type": "VIEW"}')
+                elif len(parts) == 1:
+                    page = int(query.get("page", ["1"])[0])
+                    page_size = int(query.get("pageSize", ["50"])[0])
+                    self._send(server.page(parts[0], page, page_size))
+                else:
+                    self._send(b'{"httpStatusCode": 404}', status=404)
+
+            def do_POST(self):
+                self._route()
+                length = int(self.headers.get("Content-Length") or 0)
+                with server._lock:
+                    server.bytes += length
+                while length > 0:
+                    length -= len(self.rfile.read(min(length, 1 << 16)))
+                self._send(IMPORT_SUMMARY)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per request")
+    parser.add_argument("--items", type=int, default=10000, help="objects per collection")
+    parser.add_argument("--item-bytes", type=int, default=100, help="padding bytes per object")
+    parser.add_argument("--csv-rows", type=int, default=100000, help="rows per SQL view")
+    args = parser.parse_args()
+    server = StubServer(args.host, args.port, args.latency, args.items, args.item_bytes, args.csv_rows)
+    print("Serving a stub DHIS2 API on {}".format(server.url))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -10,11 +10,17 @@ A Python library for DHIS2 wrapping requests (github.com/requests/requests)
 :license: MIT, see LICENSE for more details.
 """
 
+import importlib
+import sys
+from typing import Any
+
 from .api import Api
 from .exceptions import Dhis2PyException, RequestException, ClientException
 from .utils import (
     load_json,
     load_csv,
+    iter_json_file,
+    count_json_collections,
     pretty_json,
     clean_obj,
     generate_uid,
@@ -22,11 +28,13 @@ from .utils import (
     import_response_ok
 )
 from .logger import setup_logger
-from logzero import logger as logger
+from .metrics import RequestHook, RequestMetrics
+from .tracing import InMemorySpanExporter, Tracer
 
 
 __all__ = (
     "Api",
+    "ApiPool",
     "Dhis2PyException",
     "RequestException",
     "ClientException",
@@ -34,11 +42,32 @@ __all__ = (
     "logger",
     "load_json",
     "load_csv",
+    "iter_json_file",
+    "count_json_collections",
     "pretty_json",
     "clean_obj",
     "generate_uid",
     "is_valid_uid",
-    "import_response_ok"
+    "import_response_ok",
+    "ImportReport",
+    "import_data_values_csv",
+    "RequestHook",
+    "RequestMetrics",
+    "Tracer",
+    "InMemorySpanExporter",
+    "Throttle",
+    "EndpointLimit",
+    "AnalyticsResult",
+    "split_analytics_query",
+    "decode_analytics",
+    "Query",
+    "MetadataValidator",
+    "ImportPlan",
+    "plan_metadata_import",
+    "import_metadata_plan",
+    "MetadataDelta",
+    "compute_metadata_delta",
+    "DataValueFingerprints",
 )
 
 
@@ -46,3 +75,50 @@ __all__ = (
 import logging
 
 logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+# `dhis2.logger` resolves to the logzero logger (not the dhis2.logger submodule),
+# logzero is imported on first access to keep `import dhis2` fast (see __getattr__)
+del logger  # type: ignore  # noqa: F821
+
+
+# attributes imported from their submodule on first access (see __getattr__),
+# so that `import dhis2` doesn't load sqlite3, concurrent.futures ... for features that aren't used
+_LAZY_ATTRIBUTES = {
+    "AnalyticsResult": "analytics",
+    "decode_analytics": "analytics",
+    "split_analytics_query": "analytics",
+    "MetadataDelta": "delta",
+    "compute_metadata_delta": "delta",
+    "DataValueFingerprints": "fingerprints",
+    "ImportReport": "importer",
+    "import_data_values_csv": "importer",
+    "ImportPlan": "planner",
+    "import_metadata_plan": "planner",
+    "plan_metadata_import": "planner",
+    "ApiPool": "pool",
+    "Query": "query",
+    "EndpointLimit": "throttle",
+    "Throttle": "throttle",
+    "MetadataValidator": "validation",
+}
+
+
+def __getattr__(name: str) -> Any:
+    """Lazily import attributes with heavy dependencies (PEP 562, Python 3.7+)"""
+    if name == "logger":
+        from logzero import logger
+
+        globals()["logger"] = logger
+        return logger
+    if name in _LAZY_ATTRIBUTES:
+        value = getattr(importlib.import_module("." + _LAZY_ATTRIBUTES[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+if sys.version_info < (3, 7):  # pragma: no cover - no module __getattr__
+    from logzero import logger as logger
+
+    for _name in _LAZY_ATTRIBUTES:
+        __getattr__(_name)
@@ -0,0 +1,474 @@
+# -*- coding: utf-8 -*-
+
+"""
+dhis2.analytics
+~~~~~~~~~~~~~~~
+
+This module implements splitting large analytics queries into sub-queries,
+running them concurrently, merging their results and decoding them into typed columns.
+"""
+
+import codecs
+import itertools
+import json
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from operator import itemgetter
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import requests
+
+from .exceptions import ClientException
+from .utils import _JsonStream, _import_optional
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .api import Api
+
+
+# items that DHIS2 expands on the server, they apply to every org unit of a sub-query and are never split
+FIXED_ITEM_PREFIXES = ("LEVEL-", "OU_GROUP-", "USER_ORGUNIT")
+
+ANALYTICS_ENGINES = ("python", "pandas", "pyarrow")
+
+# header valueType -> kind of column, everything else is text
+VALUE_TYPE_KINDS = {
+    "NUMBER": "float",
+    "UNIT_INTERVAL": "float",
+    "PERCENTAGE": "float",
+    "INTEGER": "int",
+    "INTEGER_POSITIVE": "int",
+    "INTEGER_NEGATIVE": "int",
+    "INTEGER_ZERO_OR_POSITIVE": "int",
+    "BOOLEAN": "bool",
+    "TRUE_ONLY": "bool",
+    "DATE": "date",
+    "DATETIME": "date",
+    "AGE": "date",
+}
+# headers of older DHIS2 versions only have a Java `type`
+JAVA_TYPE_KINDS = {
+    "java.lang.Double": "float",
+    "java.lang.Integer": "int",
+    "java.lang.Long": "int",
+    "java.lang.Boolean": "bool",
+    "java.util.Date": "date",
+}
+
+
+def _param_tuples(params: Union[dict, List[tuple], None]) -> List[Tuple[str, str]]:
+    if params is None:
+        return []
+    if isinstance(params, list):
+        return list(params)
+    if not isinstance(params, dict):
+        raise ClientException("`params` must be a dict or list of tuples")
+    tuples = []
+    for key, value in params.items():
+        for v in value if isinstance(value, (list, tuple)) else [value]:
+            tuples.append((key, v))
+    return tuples
+
+
+class _Dimension(object):
+    __slots__ = ("name", "items", "fixed")
+
+    def __init__(self, value: str) -> None:
+        name, _, items = value.partition(":")
+        self.name = name
+        self.items: List[str] = []
+        self.fixed: List[str] = []
+        for item in (i for i in items.split(";") if i):
+            (self.fixed if item.startswith(FIXED_ITEM_PREFIXES) else self.items).append(item)
+
+    def groups(self, size: int) -> List[str]:
+        """:return: `dimension` values of the items split into groups of `size`"""
+        if not self.items:
+            return [self.value(self.fixed)]
+        return [self.value(self.items[i:i + size] + self.fixed) for i in range(0, len(self.items), size)]
+
+    def value(self, items: List[str]) -> str:
+        return "{}:{}".format(self.name, ";".join(items)) if items else self.name
+
+
+def _cells(dimensions: List[_Dimension], sizes: List[int]) -> int:
+    cells = 1
+    for dimension, size in zip(dimensions, sizes):
+        cells *= max(1, size + len(dimension.fixed))
+    return cells
+
+
+def split_analytics_query(
+    params: Union[dict, List[tuple]], max_cells: int = 10000
+) -> List[List[Tuple[str, str]]]:
+    """
+    Split an analytics query along its `dimension` parameters (e.g. dx, pe, ou) so that no sub-query
+    asks for more than `max_cells` cells (product of the item counts). The dimension with most items is halved
+    until the estimate fits. `filter` parameters and items that expand on the server (e.g. LEVEL-2) are
+    kept in every sub-query, their size is not known in advance and counts as one item.
+    :param params: analytics parameters, e.g. {'dimension': ['dx:uid1;uid2', 'pe:LAST_12_MONTHS', 'ou:uid3']}
+    :param max_cells: estimated cells per sub-query
+    :return: parameters of every sub-query as lists of tuples
+    """
+    if int(max_cells) < 1:
+        raise ClientException("`max_cells` must be > 0")
+    tuples = _param_tuples(params)
+    dimensions = [_Dimension(value) for key, value in tuples if key == "dimension"]
+    if not dimensions:
+        raise ClientException("Analytics query needs at least one `dimension` parameter")
+    others = [(key, value) for key, value in tuples if key != "dimension"]
+
+    sizes = [len(d.items) for d in dimensions]
+    while _cells(dimensions, sizes) > max_cells:
+        largest = max(range(len(sizes)), key=lambda i: sizes[i])
+        if sizes[largest] <= 1:
+            break  # cannot be split further
+        sizes[largest] = -(-sizes[largest] // 2)
+
+    groups = [d.groups(size) for d, size in zip(dimensions, sizes)]
+    return [[("dimension", value) for value in combination] + others for combination in itertools.product(*groups)]
+
+
+def _union(merged: list, values: list) -> None:
+    seen = set(merged)
+    for value in values:
+        if value not in seen:
+            seen.add(value)
+            merged.append(value)
+
+
+def _merge_meta_data(merged: dict, meta_data: dict) -> None:
+    for key, value in meta_data.items():
+        if key == "dimensions" and isinstance(value, dict):
+            dimensions = merged.setdefault("dimensions", {})
+            for name, items in value.items():
+                _union(dimensions.setdefault(name, []), items)
+        elif isinstance(value, dict):
+            merged.setdefault(key, {}).update(value)
+        elif isinstance(value, list):
+            _union(merged.setdefault(key, []), value)
+        else:
+            merged.setdefault(key, value)
+
+
+class AnalyticsResult(object):
+    """
+    Merged result of the sub-queries of an analytics query. Sub-query responses are consumed as rows are
+    iterated: headers and metaData are complete once all rows were read. Rows can be iterated only once.
+
+    result = api.get_analytics(params)
+    for row in result.iter_rows():
+        print(row)
+    print(result.meta_data['items'])
+    """
+
+    def __init__(self, responses: Iterable[dict], queries: int = None) -> None:
+        """
+        :param responses: analytics responses (decoded JSON) of the sub-queries
+        :param queries: number of sub-queries
+        """
+        self.queries = queries
+        self.headers: List[dict] = []
+        self.meta_data: dict = {}
+        self.row_count = 0
+        self._responses = iter(responses)
+        self._consumed = False
+
+    @property
+    def names(self) -> List[str]:
+        """Column names"""
+        return [h["name"] for h in self.headers]
+
+    def _merge(self, data: dict) -> List[list]:
+        """Merge headers and metaData of a response, return its rows in the column order of the first response"""
+        headers = data.get("headers") or []
+        rows = data.get("rows") or []
+        _merge_meta_data(self.meta_data, data.get("metaData") or {})
+        if not self.headers:
+            self.headers = headers
+        elif [h["name"] for h in headers] != self.names:
+            positions = {h["name"]: i for i, h in enumerate(headers)}
+            if set(positions) != set(self.names):
+                raise ClientException(
+                    "Sub-queries returned different columns: {} vs. {}".format(self.names, list(positions))
+                )
+            order = [positions[name] for name in self.names]
+            rows = [[row[i] for i in order] for row in rows]
+        self.row_count += len(rows)
+        return rows
+
+    def _iter_responses_rows(self) -> Iterator[List[list]]:
+        if self._consumed:
+            raise ClientException("Rows of an AnalyticsResult can only be iterated once")
+        self._consumed = True
+        for data in self._responses:
+            yield self._merge(data)
+
+    def iter_rows(self) -> Iterator[list]:
+        """Stream the rows of all sub-queries"""
+        for rows in self._iter_responses_rows():
+            for row in rows:
+                yield row
+
+    def _raw_columns(self) -> List[list]:
+        """Transpose all rows into one list per column, response by response"""
+        values: List[list] = []
+        for rows in self._iter_responses_rows():
+            if not values:
+                values = [[] for _ in self.headers]
+            for i, column in enumerate(values):
+                column.extend(map(itemgetter(i), rows))
+        return values or [[] for _ in self.headers]
+
+    def columns(self) -> Dict[str, list]:
+        """:return: dict of column name -> list of values as returned by the server (strings)"""
+        raw = self._raw_columns()  # headers are known once the rows were read
+        return dict(zip(self.names, raw))
+
+    def decode(self, engine: str = "python") -> Any:
+        """
+        Decode all rows into typed columns, converted according to the `valueType` of the headers:
+        numbers to float, integers to int, booleans to bool and (pandas / pyarrow only) dates to timestamps.
+        Empty values become None / NaN / null.
+        :param engine: 'python' (dict of column name -> list), 'pandas' (DataFrame) or 'pyarrow' (Table)
+        :return: the decoded columns
+        """
+        if engine not in ANALYTICS_ENGINES:
+            raise ClientException("`engine` must be one of {}, not '{}'".format(ANALYTICS_ENGINES, engine))
+        if engine != "python":
+            _import_optional(engine)  # fail before any request is sent
+        raw = self._raw_columns()
+        kinds = [_column_kind(header) for header in self.headers]
+        return _DECODERS[engine](self.names, kinds, raw)
+
+    def to_dict(self) -> dict:
+        """:return: the merged result in the format of an analytics response"""
+        rows = list(self.iter_rows())
+        return {
+            "headers": self.headers,
+            "metaData": self.meta_data,
+            "rows": rows,
+            "width": len(self.headers),
+            "height": len(rows),
+            "headerWidth": len(self.headers),
+        }
+
+    def __repr__(self) -> str:
+        return "AnalyticsResult(queries={}, rows={})".format(self.queries, self.row_count)
+
+
+def _column_kind(header: dict) -> str:
+    """:return: 'float', 'int', 'bool', 'date' or 'text'"""
+    if header.get("valueType"):
+        return VALUE_TYPE_KINDS.get(header["valueType"], "text")
+    return JAVA_TYPE_KINDS.get(header.get("type", ""), "text")
+
+
+def _missing(value: Any) -> bool:
+    return value is None or value == ""
+
+
+def _to_float(value: Any) -> Optional[float]:
+    return None if _missing(value) else float(value)
+
+
+def _to_int(value: Any) -> Union[int, float, None]:
+    if _missing(value):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        number = float(value)  # e.g. '5.0'
+        return int(number) if number.is_integer() else number
+
+
+def _to_bool(value: Any) -> Optional[bool]:
+    if _missing(value):
+        return None
+    return str(value).lower() in ("true", "1")
+
+
+_PYTHON_CONVERTERS: Dict[str, Callable[[Any], Any]] = {"float": _to_float, "int": _to_int, "bool": _to_bool}
+
+
+def _decode_python(names: List[str], kinds: List[str], raw: List[list]) -> Dict[str, list]:
+    columns = {}
+    for name, kind, values in zip(names, kinds, raw):
+        converter = _PYTHON_CONVERTERS.get(kind)
+        columns[name] = list(map(converter, values)) if converter else list(values)
+    return columns
+
+
+def _pandas_column(pd: Any, kind: str, values: list) -> Any:
+    series = pd.Series(values, dtype=object)
+    if kind == "text":
+        return series
+    series = series.mask(series == "")  # empty -> NaN
+    if kind == "float":
+        return pd.to_numeric(series).astype("float64")
+    if kind == "int":
+        numbers = pd.to_numeric(series)
+        try:
+            return numbers.astype("Int64")
+        except (TypeError, ValueError):  # not all integral
+            return numbers.astype("float64")
+    if kind == "bool":
+        return series.map(_to_bool, na_action="ignore").astype("boolean")
+    for options in ({"format": "ISO8601"}, {}):  # the ISO8601 format is new in pandas 2.0
+        try:
+            return pd.to_datetime(series, **options)
+        except (TypeError, ValueError):
+            continue
+    return series  # keep dates the server formatted unusually as text
+
+
+def _decode_pandas(names: List[str], kinds: List[str], raw: List[list]) -> Any:
+    pd = _import_optional("pandas")
+    return pd.DataFrame(
+        {name: _pandas_column(pd, kind, values) for name, kind, values in zip(names, kinds, raw)},
+        columns=names,
+    )
+
+
+def _arrow_column(pa: Any, kind: str, values: list) -> Any:
+    strings = pa.array([None if _missing(v) else str(v) for v in values], pa.string())
+    casts = {
+        "float": [pa.float64()],
+        "int": [pa.int64(), pa.float64()],
+        "bool": [pa.bool_()],
+        "date": [pa.timestamp("ms")],
+    }.get(kind, [])
+    for target in casts:
+        try:
+            return strings.cast(target)
+        except (ValueError, NotImplementedError):  # ArrowInvalid / ArrowNotImplementedError
+            continue
+    return strings
+
+
+def _decode_pyarrow(names: List[str], kinds: List[str], raw: List[list]) -> Any:
+    pa = _import_optional("pyarrow")
+    return pa.Table.from_arrays([_arrow_column(pa, kind, values) for kind, values in zip(kinds, raw)], names=names)
+
+
+_DECODERS: Dict[str, Callable[[List[str], List[str], List[list]], Any]] = {
+    "python": _decode_python,
+    "pandas": _decode_pandas,
+    "pyarrow": _decode_pyarrow,
+}
+
+
+class _ResponseReader(object):
+    """Read the body of a streamed response as text, block by block"""
+
+    def __init__(self, response: requests.Response, block_size: int = 1 << 20) -> None:
+        self._blocks = response.iter_content(chunk_size=block_size)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+
+    def read(self, size: int = -1) -> str:
+        for block in self._blocks:
+            text = self._decoder.decode(block)
+            if text:
+                return text
+        return self._decoder.decode(b"", final=True)
+
+
+def _read_json_stream(response: requests.Response) -> dict:
+    """Read an analytics response, decoding `rows` row by row so the raw body is never held in memory"""
+    stream = _JsonStream(_ResponseReader(response), response.url)  # type: ignore
+    data = {}
+    for key in stream.items():
+        data[key] = list(stream.array()) if key == "rows" and stream.peek() == "[" else stream.value()
+    stream.expect("}")
+    if stream.peek():
+        raise stream.error("the end of the response")
+    return data
+
+
+AnalyticsSource = Union[dict, bytes, str, requests.Response]
+
+
+def _load_response(source: AnalyticsSource) -> dict:
+    if isinstance(source, dict):
+        return source
+    if isinstance(source, requests.Response):
+        if not getattr(source, "_content_consumed", True):
+            return _read_json_stream(source)  # requested with stream=True: decode while the body is read
+        source = source.content
+    try:
+        data = json.loads(source)
+    except ValueError as e:
+        raise ClientException("Not a JSON analytics response: {}".format(e))
+    if not isinstance(data, dict):
+        raise ClientException("Not an analytics response: {}".format(type(data).__name__))
+    return data
+
+
+def decode_analytics(
+    source: Union[AnalyticsSource, Iterable[AnalyticsSource], AnalyticsResult], engine: str = "python"
+) -> Any:
+    """
+    Decode analytics responses into typed columns using the `valueType` of their headers,
+    without building a dict per row. Responses are decoded from their bytes, those requested with
+    stream=True while they are read. The rows of several responses (e.g. pages or sub-queries) are concatenated.
+
+    columns = decode_analytics(api.get('analytics', params=params, stream=True))
+    df = decode_analytics(api.get('analytics', params=params), engine='pandas')
+
+    :param source: a requests.Response, its body (bytes / str), the decoded JSON, an iterable of them
+                   or an AnalyticsResult
+    :param engine: 'python' (dict of column name -> list), 'pandas' (DataFrame) or 'pyarrow' (Table)
+    :return: the decoded columns
+    """
+    if not isinstance(source, AnalyticsResult):
+        sources = [source] if isinstance(source, (dict, bytes, str, requests.Response)) else source
+        source = AnalyticsResult(_load_response(s) for s in sources)  # type: ignore
+    return source.decode(engine)
+
+
+def _fetch_all(
+    api: "Api", endpoint: str, queries: List[List[Tuple[str, str]]], max_workers: int
+) -> Iterator[dict]:
+    """Run the queries with at most `max_workers` in flight, yield responses in query order"""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = iter(queries)
+        in_flight: Deque[Future] = deque()
+
+        def fetch(query: List[Tuple[str, str]]) -> dict:
+            return api._json(api.get(endpoint, params=query))
+
+        def submit() -> None:
+            query: Optional[List[Tuple[str, str]]] = next(pending, None)
+            if query is not None:
+                in_flight.append(executor.submit(fetch, query))
+
+        for _ in range(max_workers):
+            submit()
+        while in_flight:
+            data = in_flight.popleft().result()
+            submit()
+            yield data
+
+
+def get_analytics(
+    api: "Api",
+    params: Union[dict, List[tuple]],
+    max_cells: int = 10000,
+    max_workers: int = 4,
+    endpoint: str = "analytics",
+) -> AnalyticsResult:
+    """
+    Split an analytics query into sub-queries of at most `max_cells` cells (see split_analytics_query),
+    run them with at most `max_workers` requests in flight and merge headers, rows and metaData.
+    Requests start when the rows are iterated, responses are merged in the order of the sub-queries.
+    Only split queries whose cells are independent, i.e. no totals / subtotals or table layouts.
+    :param api: Api instance
+    :param params: analytics parameters with `dimension` parameters
+    :param max_cells: estimated cells per sub-query
+    :param max_workers: maximum concurrent requests
+    :param endpoint: analytics endpoint, e.g. 'analytics' or 'analytics/events/aggregate/<program>'
+    :return: AnalyticsResult
+    """
+    if int(max_workers) < 1:
+        raise ClientException("`max_workers` must be > 0")
+    queries = split_analytics_query(params, max_cells)
+    return AnalyticsResult(_fetch_all(api, endpoint, queries, max_workers), queries=len(queries))
@@ -8,17 +8,36 @@ This module implements DHIS2 API operations via the Api class.
 """
 
 import codecs
+import time
 from contextlib import closing
 from itertools import chain
-from typing import Union, Optional, Generator, List, Any, Iterator
+from typing import TYPE_CHECKING, Union, Optional, Generator, List, Any, Iterator, Dict, Tuple
 
 from urllib.parse import urlparse, urlunparse
 
 import requests
 from csv import DictReader
 
+from .checkpoint import ChunkJournal, PageCheckpoint, fingerprint
 from .exceptions import ClientException, RequestException
-from .utils import load_json, partition_payload, search_auth_file, version_to_int
+from .logger import log_context, new_request_id
+from .metrics import RequestHook, RequestRecord, endpoint_template
+from .tracing import NOOP_TRACER, Tracer, TracingHook
+from .utils import (
+    ImportSummary,
+    load_auth_profiles,
+    partition_payload,
+    search_auth_file,
+    select_auth_profile,
+    version_to_int,
+)
+
+if TYPE_CHECKING:  # pragma: no cover - imported where they are used, to keep `import dhis2` fast
+    from .analytics import AnalyticsResult
+    from .exporter import MetadataSink
+    from .fingerprints import DataValueFingerprints
+    from .importer import ImportReport
+    from .throttle import Throttle
 
 
 class Api(object):
@@ -61,6 +80,10 @@ class Api(object):
         self.api_version = api_version
 
         self.session = requests.Session()
+        self.request_hooks: List[RequestHook] = []
+        self._tracer: Tracer = NOOP_TRACER
+        self._tracing_hook: Optional[TracingHook] = None
+        self._throttle: Optional["Throttle"] = None
         self.username = username
         self.session.auth = (self.username, password)
         if user_agent:
@@ -117,7 +140,7 @@ class Api(object):
 
     def get_info(self) -> dict:
         if not self._info:
-            self._info = self.get("system/info").json()
+            self._info = self._json(self.get("system/info"))
         return self._info
 
     def get_version(self) -> str:
@@ -131,6 +154,30 @@ class Api(object):
             self._version_int = version_to_int(self.version)  # type: ignore
         return self._version_int
 
+    def get_tracer(self) -> Tracer:
+        return self._tracer
+
+    def set_tracer(self, tracer: Optional[Tracer]) -> None:
+        if self._tracing_hook is not None:
+            self.remove_request_hook(self._tracing_hook)
+            self._tracing_hook = None
+        self._tracer = tracer or NOOP_TRACER
+        if self._tracer.enabled:
+            self._tracing_hook = TracingHook(self._tracer)
+            self.add_request_hook(self._tracing_hook)
+
+    def get_throttle(self) -> Optional["Throttle"]:
+        return self._throttle
+
+    def set_throttle(self, throttle: Optional["Throttle"]) -> None:
+        if self._throttle is not None:
+            self.remove_request_hook(self._throttle)
+        self._throttle = throttle
+        if throttle is not None:
+            self.add_request_hook(throttle)
+            # wait for the throttle before other hooks start timing the request
+            self.request_hooks.insert(0, self.request_hooks.pop())
+
     # using property class to allow for type hinting of property (instead of @property)
     base_url = property(get_base_url, set_base_url)
     api_version = property(get_api_version, set_api_version)
@@ -139,6 +186,8 @@ class Api(object):
     version = property(get_version)
     revision = property(get_revision)
     version_int = property(get_version_int)
+    tracer = property(get_tracer, set_tracer)
+    throttle = property(get_throttle, set_throttle)
 
     def __str__(self):
         s = (
@@ -154,36 +203,31 @@ class Api(object):
         location: str = None,
         api_version: Union[int, str] = None,
         user_agent: str = None,
+        profile: str = None,
     ) -> "Api":
         """
         Alternative constructor to load from JSON file.
         If auth_file_path is not specified, it tries to find `dish.json` in:
         - DHIS_HOME
-        - Home folder
+        - the config folder, current folder, ~/.dhis2 and the home folder
+        - folders below the home folder (see utils.search_auth_file)
         :param location: authentication file path
-        :param api_version: see Api
-        :param user_agent: see Api
+        :param api_version: see Api, overrides the profile's "api_version"
+        :param user_agent: see Api, overrides the profile's "user_agent"
+        :param profile: name of the profile in a multi-profile auth file, by default its default profile
         :return: Api instance
         """
         location = search_auth_file() if not location else location
 
-        a = load_json(location)
-        try:
-            section = a["dhis"]
-            baseurl = section["baseurl"]
-            username = section["username"]
-            password = section["password"]
-            assert all([baseurl, username, password])
-        except (KeyError, AssertionError):
-            raise ClientException("Auth file found but not valid: {}".format(location))
-        else:
-            return cls(
-                baseurl,
-                username,
-                password,
-                api_version=api_version,
-                user_agent=user_agent,
-            )
+        profiles, default = load_auth_profiles(location)
+        _, section = select_auth_profile(profiles, default, profile, location)
+        return cls(
+            section["baseurl"],
+            section["username"],
+            section["password"],
+            api_version=api_version or section.get("api_version"),
+            user_agent=user_agent or section.get("user_agent"),
+        )
 
     @staticmethod
     def _validate_response(response: requests.Response) -> requests.Response:
@@ -263,27 +307,127 @@ class Api(object):
         url = "{}/{}".format(self.api_url, endpoint)
         self._validate_request(endpoint, file_type, data, params)
 
+        if method not in ("get", "post", "put", "patch", "delete"):
+            raise ClientException("Non-supported HTTP method: {}".format(method))
+        stream = kwargs.get("stream", False) if method == "get" else False
         if method == "get":
-            stream = kwargs.get("stream", False)
             url = "{}.{}".format(url, file_type)
-            r = self.session.get(url, params=params, stream=stream, timeout=timeout)
 
-        elif method == "post":
-            r = self.session.post(url=url, json=data, params=params, timeout=timeout)
+        with log_context(
+            request_id=new_request_id(), method=method.upper(), endpoint=endpoint_template(endpoint)
+        ):
+            hooks = self.request_hooks
+            if not hooks:
+                r = self._send(method, url, data, params, stream, timeout)
+                return self._validate_response(r)
+            return self._send_with_hooks(hooks, method, endpoint, url, data, params, stream, timeout)
 
-        elif method == "put":
-            r = self.session.put(url=url, json=data, params=params, timeout=timeout)
+    def _send_with_hooks(
+        self,
+        hooks: List[RequestHook],
+        method: str,
+        endpoint: str,
+        url: str,
+        data: Optional[dict],
+        params: Union[dict, List[tuple], None],
+        stream: bool,
+        timeout: Optional[int],
+    ) -> requests.Response:
+        """Send a request, handing its RequestRecord to the request hooks"""
+        record = RequestRecord(method, endpoint, url, params)
+        for i, hook in enumerate(hooks):
+            try:
+                hook.before_request(record)
+            except Exception as e:
+                # let the hooks that already ran clean up (e.g. end a span)
+                record.error = e
+                for started in hooks[:i]:
+                    started.after_request(record)
+                raise
+        now = time.perf_counter()
+        record.queued, record.started = now - record.started, now
+        try:
+            r = self._send(method, url, data, params, stream, timeout)
+        except Exception as e:
+            record.duration = time.perf_counter() - record.started
+            record.error = e
+            for hook in hooks:
+                hook.after_request(record)
+            raise
+        record.duration = time.perf_counter() - record.started
+        self._fill_record(record, r, stream)
+        for hook in hooks:
+            hook.after_request(record)
+        r._dhis2_record = record  # type: ignore
+        return self._validate_response(r)
 
+    def _send(
+        self,
+        method: str,
+        url: str,
+        data: Optional[dict],
+        params: Union[dict, List[tuple], None],
+        stream: bool,
+        timeout: Optional[int],
+    ) -> requests.Response:
+        """Send the request with the session"""
+        if method == "get":
+            return self.session.get(url, params=params, stream=stream, timeout=timeout)
+        elif method == "post":
+            return self.session.post(url=url, json=data, params=params, timeout=timeout)
+        elif method == "put":
+            return self.session.put(url=url, json=data, params=params, timeout=timeout)
         elif method == "patch":
-            r = self.session.patch(url=url, json=data, params=params, timeout=timeout)
-
-        elif method == "delete":
-            r = self.session.delete(url=url, params=params, timeout=timeout)
+            return self.session.patch(url=url, json=data, params=params, timeout=timeout)
+        else:
+            return self.session.delete(url=url, params=params, timeout=timeout)
 
+    @staticmethod
+    def _fill_record(record: RequestRecord, r: requests.Response, stream: bool) -> None:
+        """Add what the response tells about the request to the record"""
+        record.status_code = r.status_code
+        record.headers = r.headers
+        record.elapsed = r.elapsed.total_seconds()
+        body = r.request.body if r.request is not None else None
+        record.bytes_out = len(body) if isinstance(body, (bytes, str)) else 0  # streamed bodies have no length
+        if stream:
+            record.bytes_in = int(r.headers.get("Content-Length", 0) or 0)
         else:
-            raise ClientException("Non-supported HTTP method: {}".format(method))
+            record.bytes_in = len(r.content or b"")
+        retries = getattr(r.raw, "retries", None)
+        record.retries = len(getattr(retries, "history", None) or ())
 
-        return self._validate_response(r)
+    def add_request_hook(self, hook: RequestHook) -> None:
+        """
+        Register a hook that is called before / after every request, e.g. RequestMetrics
+        :param hook: RequestHook instance
+        """
+        if not isinstance(hook, RequestHook):
+            raise ClientException("`hook` must be a RequestHook, not {}".format(hook.__class__.__name__))
+        self.request_hooks.append(hook)
+
+    def remove_request_hook(self, hook: RequestHook) -> None:
+        """
+        Unregister a hook
+        :param hook: RequestHook instance
+        """
+        self.request_hooks.remove(hook)
+
+    def _json(self, response: requests.Response) -> Any:
+        """
+        Decode the JSON body of a response, timed for request hooks
+        :param response: requests.Response
+        :return: the decoded body
+        """
+        record = getattr(response, "_dhis2_record", None)
+        if record is None:
+            return response.json()
+        started = time.perf_counter()
+        data = response.json()
+        record.decode = time.perf_counter() - started
+        for hook in self.request_hooks:
+            hook.after_decode(record)
+        return data
 
     def get(
         self,
@@ -379,6 +523,8 @@ class Api(object):
         params: Union[dict, List[tuple]] = None,
         page_size: Union[int, str] = 50,
         merge: bool = False,
+        start_page: int = None,
+        checkpoint: str = None,
     ) -> Union[Generator[dict, dict, None], dict]:
         """
         GET with paging (for large payloads).
@@ -386,39 +532,64 @@ class Api(object):
         :param endpoint: DHIS2 API endpoint
         :param params: HTTP parameters (dict), defaults to None
         :param merge: If true, return a list containing all pages instead of one page. Defaults to False.
+        :param start_page: page to start with, defaults to 1 (or the page after the checkpoint)
+        :param checkpoint: optional path of a checkpoint file. Every page is recorded after the caller processed it
+        (asked for the next page), a rerun with the same arguments resumes after it. Deleted when all pages are done.
         :return: generator OR a normal DHIS2 response dict, e.g. {"organisationUnits": [...]}
         """
-        try:
-            if not isinstance(page_size, (str, int)) or int(page_size) < 1:
-                raise ValueError
-        except ValueError:
-            raise ClientException("page_size must be > 1")
-
-        params = {} if not params else params
-        if "paging" in params:
-            raise ClientException(
-                "Can't set paging manually in `params` when using `get_paged`"
-            )
-        params["pageSize"] = page_size  # type: ignore
-        params["page"] = 1  # type: ignore
-        params["totalPages"] = True  # type: ignore
+        params, page_checkpoint = self._paging_params(
+            endpoint, params, page_size, merge, start_page, checkpoint
+        )
 
         collection = endpoint.split("/")[
             0
         ]  # only use e.g. events when submitting events/query as endpoint
 
+        tracer = self.tracer
+
+        template = endpoint_template(endpoint)
+
+        def fetch_page() -> dict:
+            with tracer.span("page", page=params["page"]) as span, log_context(page=params["page"]):  # type: ignore
+                page = self._json(
+                    self.get(endpoint=endpoint, file_type="json", params=params)
+                )
+                if tracer.enabled:
+                    span.set_attribute("items", len(page.get(collection) or []))
+            return page
+
         def page_generator() -> Generator[dict, dict, None]:
             """Yield pages"""
-            page = self.get(endpoint=endpoint, file_type="json", params=params).json()
-            page_count = page["pager"]["pageCount"]
-            yield page
-
-            while page["pager"]["page"] < page_count:
-                params["page"] += 1  # type: ignore
-                page = self.get(
-                    endpoint=endpoint, file_type="json", params=params
-                ).json()
-                yield page
+            op = tracer.start_span("get_paged", **{"dhis2.endpoint": template, "page_size": page_size})
+            pages, items, error = 0, 0, None
+            try:
+                page = fetch_page()
+                page_count = page["pager"]["pageCount"]
+                if page_checkpoint:
+                    page_checkpoint.check_pager(page["pager"])
+                while True:
+                    pages += 1
+                    items += len(page.get(collection) or [])
+                    tracer.deactivate(op)  # the caller's spans are not part of the paging
+                    with log_context(endpoint=template, page=params["page"]):  # for the caller's log lines
+                        yield page
+                    tracer.activate(op)
+                    if page_checkpoint:
+                        page_checkpoint.page_done(page["pager"]["page"])
+                    if page["pager"]["page"] >= page_count:
+                        break
+                    params["page"] += 1  # type: ignore
+                    page = fetch_page()
+                if page_checkpoint:
+                    page_checkpoint.delete()
+            except GeneratorExit:
+                raise
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                op.set_attributes(pages=pages, items=items)
+                tracer.end_span(op, error)
 
         if not merge:
             return page_generator()
@@ -428,6 +599,52 @@ class Api(object):
                 data.append(p[collection])
             return {collection: list(chain.from_iterable(data))}
 
+    def _paging_params(
+        self,
+        endpoint: str,
+        params: Union[dict, List[tuple], None],
+        page_size: Union[int, str],
+        merge: bool,
+        start_page: Optional[int],
+        checkpoint: Optional[str],
+    ) -> Tuple[dict, Optional[PageCheckpoint]]:
+        """
+        Validate the arguments of get_paged() and load its checkpoint
+        :return: request parameters incl. paging, the checkpoint (if any)
+        """
+        try:
+            if not isinstance(page_size, (str, int)) or int(page_size) < 1:
+                raise ValueError
+        except ValueError:
+            raise ClientException("page_size must be > 1")
+
+        if isinstance(params, list):  # repeated keys, e.g. [("filter", ...), ("filter", ...)]
+            pairs, params = params, {}
+            for key, value in pairs:
+                params.setdefault(key, []).append(value)
+        params = dict(params) if params else {}  # the caller's dict is left as it is, e.g. for a retry
+        if "paging" in params:
+            raise ClientException(
+                "Can't set paging manually in `params` when using `get_paged`"
+            )
+
+        page_checkpoint = None
+        if checkpoint:
+            if merge:
+                raise ClientException("`checkpoint` can not be used with merge=True")
+            page_checkpoint = PageCheckpoint(
+                checkpoint, fingerprint(self.api_url, endpoint, params, page_size)
+            )
+        if start_page is None:
+            start_page = page_checkpoint.next_page if page_checkpoint else 1
+        if not isinstance(start_page, int) or start_page < 1:
+            raise ClientException("start_page must be an integer of 1 or larger")
+
+        params["pageSize"] = page_size  # type: ignore
+        params["page"] = start_page  # type: ignore
+        params["totalPages"] = True  # type: ignore
+        return params, page_checkpoint
+
     def get_sqlview(
         self,
         uid: str,
@@ -445,12 +662,58 @@ class Api(object):
         :param merge: If true, return a list containing all pages instead of one page. Defaults to False.
         :return: a list OR generator where __next__ is a 'row' of the SQL View
         """
+        tracer = self.tracer
+        with tracer.span("get_sqlview_setup", uid=uid, execute=execute):
+            params = self._sqlview_params(uid, execute, var, criteria)
+
+        def page_generator() -> Generator[dict, dict, None]:
+            op = tracer.start_span("get_sqlview", uid=uid, execute=execute)
+            rows, error = 0, None
+            try:
+                with closing(
+                    self.get(
+                        "sqlViews/{}/data".format(uid),
+                        file_type="csv",
+                        params=params,
+                        stream=True,
+                    )
+                ) as r:
+                    # do not need to use unicodecsv.DictReader as data comes in bytes already
+                    reader = DictReader(
+                        codecs.iterdecode(r.iter_lines(), "utf-8"),
+                        delimiter=",",
+                        quotechar='"',
+                    )
+                    for row in reader:
+                        rows += 1
+                        tracer.deactivate(op)
+                        yield row
+                        tracer.activate(op)
+            except GeneratorExit:
+                raise
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                op.set_attribute("rows", rows)
+                tracer.end_span(op, error)
+
+        if not merge:
+            return page_generator()
+        else:
+            return list(page_generator())
+
+    def _sqlview_params(
+        self, uid: str, execute: bool, var: Optional[dict], criteria: Optional[dict]
+    ) -> dict:
+        """
+        Look up the sqlView type, validate variables / criteria and materialize the view if asked to
+        :return: request parameters for sqlViews/{uid}/data
+        """
         params = {}
-        sqlview_type = (
+        sqlview_type = self._json(
             self.get("sqlViews/{}".format(uid), params={"fields": "type"})
-            .json()
-            .get("type")
-        )
+        ).get("type")
         if sqlview_type == "QUERY":
             if not isinstance(var, dict):
                 raise ClientException(
@@ -474,29 +737,7 @@ class Api(object):
 
             if execute:  # materialize
                 self.post("sqlViews/{}/execute".format(uid))
-
-        def page_generator() -> Generator[dict, dict, None]:
-            with closing(
-                self.get(
-                    "sqlViews/{}/data".format(uid),
-                    file_type="csv",
-                    params=params,
-                    stream=True,
-                )
-            ) as r:
-                # do not need to use unicodecsv.DictReader as data comes in bytes already
-                reader = DictReader(
-                    codecs.iterdecode(r.iter_lines(), "utf-8"),
-                    delimiter=",",
-                    quotechar='"',
-                )
-                for row in reader:
-                    yield row
-
-        if not merge:
-            return page_generator()
-        else:
-            return list(page_generator())
+        return params
 
     def post_partitioned(
         self,
@@ -504,6 +745,8 @@ class Api(object):
         json: dict,
         params: Union[dict, List[tuple]] = None,
         thresh: int = 1000,
+        journal: str = None,
+        fingerprints: Union[str, "DataValueFingerprints"] = None,
     ) -> Iterator[requests.Response]:
         """
         Post a payload in chunks to prevent 'Request Entity Too Large' Timeout errors
@@ -511,9 +754,119 @@ class Api(object):
         :param json: payload dict
         :param params: request parameters
         :param thresh: the maximum amount to partition into
-        :return: generator where __next__ is a requests.Response object
+        :param journal: optional path of a journal file recording the outcome of every chunk.
+        When the same payload is posted again with the same journal, chunks whose import summary reported success
+        without ignored objects are skipped.
+        :param fingerprints: DataValueFingerprints (or the path of its file) of a dataValues payload:
+        only data values that changed since they were last imported are posted, and the data values
+        of a chunk are stored once its import summary confirms that all of them were imported.
+        Nothing is stored with dryRun=true, importStrategy=DELETE posts all data values and removes them from the store.
+        :return: generator where __next__ is a requests.Response object (of the chunks that were posted)
+        """
+
+        key = self._validate_partitioned_payload(json, thresh)
+        store = self._fingerprint_store(fingerprints, key)
+        opened = store is not None and store is not fingerprints  # a path: closed when done
+        if store is not None:
+            json = store.filter(json, params)
+            if not json[key]:
+                if opened:
+                    store.close()
+                return
+        chunk_journal = ChunkJournal(journal) if journal else None
+        job = fingerprint(endpoint, params, key, thresh, json[key]) if chunk_journal else ""
+        completed = chunk_journal.completed(job) if chunk_journal else {}
+
+        tracer = self.tracer
+        template = endpoint_template(endpoint)
+        op = tracer.start_span(
+            "post_partitioned", **{"dhis2.endpoint": template, "collection": key, "thresh": thresh}
+        )
+        chunks, items, skipped, error = 0, 0, 0, None
+        try:
+            for index, data in enumerate(partition_payload(data=json, key=key, thresh=thresh)):
+                chunk_hash = fingerprint(data) if chunk_journal else ""
+                if chunk_journal and completed.get(index) == chunk_hash:
+                    skipped += 1
+                    continue
+                with tracer.span("chunk", chunk=index, items=len(data[key])) as span, log_context(chunk=index):
+                    r = self._post_chunk(endpoint, data, params, chunk_journal, job, index, chunk_hash)
+                    if store is not None:
+                        store.confirm(data, r, params)
+                    if tracer.enabled:
+                        body = getattr(r.request, "body", None)
+                        span.set_attribute("payload_bytes", len(body) if body else 0)
+                chunks += 1
+                items += len(data[key])
+                tracer.deactivate(op)
+                with log_context(endpoint=template, chunk=index):
+                    yield r
+                tracer.activate(op)
+        except GeneratorExit:
+            raise
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            op.set_attributes(chunks=chunks, items=items, skipped=skipped)
+            tracer.end_span(op, error)
+            if chunk_journal:
+                chunk_journal.close()
+            if store is not None and opened:
+                store.close()
+
+    @staticmethod
+    def _fingerprint_store(
+        fingerprints: Union[str, "DataValueFingerprints", None], key: str
+    ) -> Optional["DataValueFingerprints"]:
+        """:return: the DataValueFingerprints of post_partitioned(), opened if it's a path"""
+        if fingerprints is None:
+            return None
+        from .fingerprints import DataValueFingerprints  # loads sqlite3, only needed here
+
+        if key != "dataValues":
+            raise ClientException("`fingerprints` only apply to dataValues payloads, not to '{}'".format(key))
+        if isinstance(fingerprints, DataValueFingerprints):
+            return fingerprints
+        return DataValueFingerprints(fingerprints)
+
+    def _post_chunk(
+        self,
+        endpoint: str,
+        data: dict,
+        params: Union[dict, List[tuple], None],
+        chunk_journal: Optional[ChunkJournal],
+        job: str,
+        index: int,
+        chunk_hash: str,
+    ) -> requests.Response:
         """
+        POST one chunk of post_partitioned() and record its outcome in the journal:
+        the chunk is imported if its import summary reports success without ignored objects
+        """
+        try:
+            r = self.post(endpoint, json=data, params=params)
+        except Exception as e:
+            if chunk_journal:
+                chunk_journal.record(job, index, chunk_hash, ok=False, status=repr(e))
+            raise
+        if chunk_journal:
+            from .importer import _import_confirmed, _response_json
+
+            # a 200 OK can still report an import that failed or ignored objects: post the chunk again on resume
+            summary = _response_json(r)
+            status = summary.get("status") or r.status_code
+            chunk_journal.record(job, index, chunk_hash, ok=_import_confirmed(summary), status=status)
+        return r
 
+    @staticmethod
+    def _validate_partitioned_payload(json: dict, thresh: int) -> str:
+        """
+        Validate a payload to partition
+        :param json: payload dict
+        :param thresh: the maximum amount to partition into
+        :return: the (only) key of the payload
+        """
         if not isinstance(json, dict):
             raise ClientException("Parameter `json` must be a dict")
         if not isinstance(thresh, int) or thresh < 2:
@@ -530,6 +883,135 @@ class Api(object):
                 )
             if not json.get(key):
                 raise ClientException("payload for key '{}' is empty".format(key))
-            else:
-                for data in partition_payload(data=json, key=key, thresh=thresh):
-                    yield self.post(endpoint, json=data, params=params)
+            return key
+
+    def export_metadata(
+        self,
+        types: List[str],
+        directory: str = None,
+        sink: "MetadataSink" = None,
+        workers: int = 4,
+        page_size: int = 1000,
+        fields: str = ":owner",
+        params: dict = None,
+        checkpoint: str = None,
+    ) -> Dict[str, int]:
+        """
+        Export metadata types concurrently with at most `workers` requests in flight, also several pages
+        of one type once its page count is known, streaming every page into <directory>/<type>.jsonl or a sink.
+        An interrupted export resumes from its checkpoint when run again with the same arguments.
+        :param types: metadata collections, e.g. ['dataElements', 'organisationUnits']
+        :param directory: write objects as JSON lines into <directory>/<type>.jsonl
+        :param sink: OR a callable(type, objects) receiving the objects of each page
+        :param workers: maximum concurrent requests (and pages held in memory) across all types
+        :param page_size: objects per page
+        :param fields: fields to export
+        :param params: additional request parameters
+        :param checkpoint: checkpoint file path, defaults to <directory>/.export_metadata.checkpoint.json
+        :return: dict of type -> number of exported objects
+        """
+        from .exporter import export_metadata
+
+        return export_metadata(
+            self,
+            types,
+            directory=directory,
+            sink=sink,
+            workers=workers,
+            page_size=page_size,
+            fields=fields,
+            params=params,
+            checkpoint=checkpoint,
+        )
+
+    def get_analytics(
+        self,
+        params: Union[dict, List[tuple]],
+        max_cells: int = 10000,
+        max_workers: int = 4,
+        endpoint: str = "analytics",
+    ) -> "AnalyticsResult":
+        """
+        Split a large analytics query along its dimensions into sub-queries of at most `max_cells` cells,
+        run them concurrently and merge their headers, rows and metaData.
+        :param params: analytics parameters, e.g. {'dimension': ['dx:uid1;uid2', 'pe:LAST_12_MONTHS', 'ou:uid3']}
+        :param max_cells: estimated cells (dx x pe x ou items) per sub-query
+        :param max_workers: maximum concurrent requests
+        :param endpoint: analytics endpoint
+        :return: AnalyticsResult to iterate rows (iter_rows()), get columns() or the merged response (to_dict())
+        """
+        from .analytics import get_analytics
+
+        return get_analytics(self, params, max_cells=max_cells, max_workers=max_workers, endpoint=endpoint)
+
+    def import_async(
+        self,
+        endpoint: str,
+        json: dict,
+        params: Union[dict, List[tuple]] = None,
+        wait_timeout: float = None,
+        poll_interval: float = 1.0,
+        max_poll_interval: float = 30.0,
+    ) -> ImportSummary:
+        """
+        Import with async=true: the server imports in the background while the job is polled
+        via system/tasks with an increasing interval until it completed.
+        :param endpoint: the import endpoint, e.g. 'dataValueSets', 'metadata', 'events'
+        :param json: payload dict
+        :param params: request parameters
+        :param wait_timeout: seconds to wait for the job to complete, None to wait forever
+        :param poll_interval: seconds until the first poll
+        :param max_poll_interval: maximum seconds between two polls
+        :return: ImportSummary of the job, the full summary is in its `raw` attribute
+        """
+        from .importer import AsyncImportJob, wait_for_async_import
+
+        job = AsyncImportJob.submit(
+            self,
+            endpoint,
+            json,
+            params,
+            poll_interval=poll_interval,
+            max_poll_interval=max_poll_interval,
+        )
+        return ImportSummary.from_import_response(
+            wait_for_async_import(job, timeout=wait_timeout)
+        )
+
+    def import_async_partitioned(
+        self,
+        endpoint: str,
+        json: dict,
+        params: Union[dict, List[tuple]] = None,
+        thresh: int = 1000,
+        max_jobs: int = 4,
+        wait_timeout: float = None,
+        poll_interval: float = 1.0,
+        max_poll_interval: float = 30.0,
+    ) -> "ImportReport":
+        """
+        Partition a payload and import the chunks as async jobs,
+        with at most `max_jobs` jobs running on the server at the same time.
+        :param endpoint: the import endpoint, e.g. 'dataValueSets', 'metadata', 'events'
+        :param json: payload dict with exactly one key
+        :param params: request parameters
+        :param thresh: the maximum amount to partition into
+        :param max_jobs: maximum concurrent jobs
+        :param wait_timeout: seconds to wait for each job to complete, None to wait forever
+        :param poll_interval: seconds until the first poll of a job
+        :param max_poll_interval: maximum seconds between two polls of a job
+        :return: ImportReport of all chunks
+        """
+        from .importer import run_async_imports
+
+        key = self._validate_partitioned_payload(json, thresh)
+        return run_async_imports(
+            self,
+            endpoint,
+            partition_payload(data=json, key=key, thresh=thresh),
+            params=params,
+            max_jobs=max_jobs,
+            timeout=wait_timeout,
+            poll_interval=poll_interval,
+            max_poll_interval=max_poll_interval,
+        )
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+"""
+dhis2.checkpoint
+~~~~~~~~~~~~~~~~
+
+This module implements checkpoint files to resume long-running exports and imports.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import warnings
+from pathlib import Path
+from typing import IO, Any, Dict, Optional, Union
+
+from .exceptions import ClientException
+from .utils import _atomic_write
+
+
+# list items serialized at a time by fingerprint()
+_FINGERPRINT_BATCH = 1000
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, default=str, separators=(",", ":"))
+
+
+def fingerprint(*parts: Any) -> str:
+    """
+    Hash JSON-serializable values, e.g. to tell whether a checkpoint belongs to the same job.
+    Lists are hashed in batches of items, a payload of millions of objects is never serialized into one string
+    :return: hex digest
+    """
+    digest = hashlib.sha256(b"[")
+    for i, part in enumerate(parts):
+        if i:
+            digest.update(b",")
+        if isinstance(part, (list, tuple)):
+            digest.update(b"[")
+            for start in range(0, len(part), _FINGERPRINT_BATCH):
+                if start:
+                    digest.update(b",")
+                digest.update(_dumps(list(part[start : start + _FINGERPRINT_BATCH]))[1:-1].encode("utf-8"))
+            digest.update(b"]")
+        else:
+            digest.update(_dumps(part).encode("utf-8"))
+    digest.update(b"]")
+    return digest.hexdigest()
+
+
+class Checkpoint(object):
+    """
+    A small JSON state file that is rewritten atomically on every save(),
+    so that it is never left half-written when a process dies.
+
+    checkpoint = Checkpoint('export.checkpoint.json')
+    checkpoint.state['page'] = 12
+    checkpoint.save()
+    """
+
+    def __init__(self, path: Union[str, os.PathLike, Path]) -> None:
+        """
+        :param path: file path, loaded if it exists
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self.state: dict = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            raise ClientException(
+                "Checkpoint file is corrupt, delete it to start over: {}".format(self.path)
+            )
+        if not isinstance(state, dict):
+            raise ClientException("Not a checkpoint file: {}".format(self.path))
+        return state
+
+    @property
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def save(self) -> None:
+        with self._lock:
+            _atomic_write(self.path, json.dumps(self.state, sort_keys=True))
+
+    def delete(self) -> None:
+        """Remove the file (e.g. when the job completed) and reset the state"""
+        with self._lock:
+            self.state = {}
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __repr__(self) -> str:
+        return "Checkpoint({})".format(self.path)
+
+
+class ChunkJournal(object):
+    """
+    An append-only JSON lines journal of chunk outcomes, e.g. of post_partitioned().
+    Every line records one attempt: job fingerprint, chunk index, chunk fingerprint and whether it succeeded.
+    The latest attempt of a chunk wins. Lines are flushed to disk before the next chunk is sent,
+    a truncated last line (the process died while writing it) is ignored.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike, Path]) -> None:
+        """
+        :param path: journal file path, appended to if it exists
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[int, dict]] = {}
+        self._file: Optional[IO[str]] = None
+        self._needs_newline = False
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    self._needs_newline = not line.endswith("\n")
+                    try:
+                        entry = json.loads(line)
+                        self._entries.setdefault(entry["job"], {})[entry["chunk"]] = entry
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except FileNotFoundError:
+            pass
+
+    def completed(self, job: str) -> Dict[int, str]:
+        """:return: dict of chunk index -> chunk fingerprint of chunks whose latest attempt succeeded"""
+        return {i: e["hash"] for i, e in self._entries.get(job, {}).items() if e["ok"]}
+
+    def failed(self, job: str) -> Dict[int, dict]:
+        """:return: dict of chunk index -> journal entry of chunks whose latest attempt failed"""
+        return {i: e for i, e in self._entries.get(job, {}).items() if not e["ok"]}
+
+    def record(self, job: str, chunk: int, chunk_hash: str, ok: bool, status: Any = None) -> None:
+        """
+        Append the outcome of a chunk and flush it to disk
+        :param job: job fingerprint
+        :param chunk: chunk index
+        :param chunk_hash: fingerprint of the chunk's payload
+        :param ok: whether the chunk was imported
+        :param status: e.g. the import status or the error
+        """
+        entry = {"job": job, "chunk": chunk, "hash": chunk_hash, "ok": ok, "status": status, "time": time.time()}
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+                if self._needs_newline:  # terminate a truncated last line
+                    self._file.write("\n")
+            self._file.write(json.dumps(entry, default=str) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._entries.setdefault(job, {})[chunk] = entry
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __repr__(self) -> str:
+        return "ChunkJournal({})".format(self.path)
+
+
+class PageCheckpoint(Checkpoint):
+    """
+    Checkpoint of a paged GET (get_paged): the last page the caller completed and the pager seen,
+    to resume with the next page and to notice when the collection changed in between.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike, Path], job: str) -> None:
+        """
+        :param path: checkpoint file path
+        :param job: fingerprint of endpoint, params and page size
+        """
+        super(PageCheckpoint, self).__init__(path)
+        if self.state and self.state.get("job") != job:
+            raise ClientException(
+                "Checkpoint {} belongs to another endpoint / params / page size, delete it to start over".format(path)
+            )
+        self.state["job"] = job
+
+    @property
+    def next_page(self) -> int:
+        return self.state.get("page", 0) + 1
+
+    def check_pager(self, pager: dict) -> None:
+        """
+        Compare the pager of the first page of this run with the one of the previous run,
+        warn if the collection changed (objects were added / removed, so offsets shifted)
+        """
+        previous = self.state.get("pager")
+        current = {"total": pager.get("total"), "pageCount": pager.get("pageCount")}
+        if previous and previous != current:
+            warnings.warn(
+                "Collection changed since the checkpoint ({} -> {} objects, {} -> {} pages): "
+                "resumed pages may skip or repeat objects".format(
+                    previous.get("total"), current["total"], previous.get("pageCount"), current["pageCount"]
+                ),
+                CollectionChangedWarning,
+            )
+        self.state["pager"] = current
+
+    def page_done(self, page: int) -> None:
+        self.state["page"] = page
+        self.save()
+
+
+class CollectionChangedWarning(UserWarning):
+    """A paged collection changed between the runs of a resumed get_paged()"""
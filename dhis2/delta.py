@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+"""
+dhis2.delta
+~~~~~~~~~~~
+
+This module compares a local metadata payload with the objects on the server, so that only created and changed
+objects (and deletions) are imported.
+"""
+
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple, Union
+
+from .exceptions import ClientException
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .api import Api
+
+# fields that differ between servers or change on every import, not compared
+VOLATILE_FIELDS = frozenset(
+    (
+        "lastUpdated",
+        "created",
+        "href",
+        "lastUpdatedBy",
+        "createdBy",
+        "user",
+        "access",
+        "favorite",
+        "favorites",
+        "displayName",
+        "displayShortName",
+        "displayDescription",
+        "displayFormName",
+    )
+)
+# collections the server returns in no particular order, compared as sets: a field name at any depth,
+# a (type, field) pair only for the objects of that type - e.g. the dataElements of a section are ordered
+UNORDERED_FIELDS: FrozenSet[Union[str, Tuple[str, str]]] = frozenset(
+    (
+        "organisationUnits",
+        "dataSetElements",
+        "dataInputPeriods",
+        "attributeValues",
+        "translations",
+        "legendSets",
+        "aggregationLevels",
+        "userGroupAccesses",
+        "userAccesses",
+        "groupSets",
+        ("dataElementGroups", "dataElements"),
+        ("indicatorGroups", "indicators"),
+        ("dataSets", "indicators"),
+    )
+)
+
+
+def _merged_shape(items: list) -> Optional[dict]:
+    """The union of the keys of the dicts of a list, to compare list items field by field"""
+    shape: Dict[str, Any] = {}
+    for item in items:
+        if isinstance(item, dict):
+            for key, value in item.items():
+                shape.setdefault(key, value)
+    return shape or None
+
+
+def _canonical(
+    value: Any, shape: Any, ignore: frozenset, unordered: frozenset, object_type: str = None, sort: bool = False
+) -> Any:
+    """
+    Reduce a value to the fields of `shape` (the local object) without volatile fields,
+    with unordered collections sorted. `object_type` is the type of a metadata object (the top-level dict)
+    """
+    if isinstance(value, dict):
+        keys: Iterable[str] = shape.keys() if isinstance(shape, dict) else value.keys()
+        return {
+            k: _canonical(
+                value.get(k),
+                shape.get(k) if isinstance(shape, dict) else None,
+                ignore,
+                unordered,
+                sort=k in unordered or (object_type, k) in unordered,
+            )
+            for k in keys
+            if k not in ignore
+        }
+    if isinstance(value, list):
+        item_shape = _merged_shape(shape) if isinstance(shape, list) else None
+        items = [_canonical(item, item_shape, ignore, unordered) for item in value]
+        if sort:
+            items.sort(key=lambda item: json.dumps(item, sort_keys=True, default=str))
+        return items
+    return value
+
+
+def canonical_hash(
+    obj: dict,
+    shape: Optional[dict] = None,
+    ignore: Iterable[str] = VOLATILE_FIELDS,
+    unordered: Iterable[Union[str, Tuple[str, str]]] = UNORDERED_FIELDS,
+    object_type: str = None,
+) -> str:
+    """
+    Hash of a metadata object that doesn't depend on key order, volatile fields or the order of unordered collections
+    :param obj: metadata object
+    :param shape: compare only the fields of this object (at any depth), e.g. a local object for its server version
+    :param ignore: fields left out
+    :param unordered: collections compared regardless of their order, field names or (type, field) pairs
+    :param object_type: type of the object, e.g. "dataElementGroups", for the (type, field) pairs of `unordered`
+    :return: hex digest
+    """
+    canonical = _canonical(
+        obj, obj if shape is None else shape, frozenset(ignore), frozenset(unordered), object_type
+    )
+    text = json.dumps(canonical, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class MetadataDelta(object):
+    """
+    Difference between a local metadata payload and the server:
+    `created` and `changed` objects, the number of `unchanged` ones and the `deleted` ones (see compute_metadata_delta)
+    as payloads by type, e.g. {"dataElements": [...]}.
+
+    for payload in delta.payloads():
+        api.post_partitioned('metadata', json=payload)
+    """
+
+    def __init__(
+        self,
+        created: Dict[str, List[dict]],
+        changed: Dict[str, List[dict]],
+        unchanged: Dict[str, int],
+        deleted: Dict[str, List[dict]],
+    ) -> None:
+        self.created = created
+        self.changed = changed
+        self.unchanged = unchanged
+        self.deleted = deleted
+
+    def payloads(self, deletions: bool = False) -> Iterator[dict]:
+        """
+        One payload per type for post_partitioned()
+        :param deletions: the objects to delete (importStrategy=DELETE) instead of the created and changed ones
+        """
+        if deletions:
+            for key, objects in self.deleted.items():
+                if objects:
+                    yield {key: objects}
+            return
+        for key in list(dict.fromkeys(list(self.created) + list(self.changed))):
+            objects = self.created.get(key, []) + self.changed.get(key, [])
+            if objects:
+                yield {key: objects}
+
+    @property
+    def empty(self) -> bool:
+        """True if there is nothing to import or delete"""
+        return not any(self.created.values()) and not any(self.changed.values()) and not any(self.deleted.values())
+
+    def __repr__(self) -> str:
+        return "MetadataDelta(created={}, changed={}, unchanged={}, deleted={})".format(
+            sum(len(v) for v in self.created.values()),
+            sum(len(v) for v in self.changed.values()),
+            sum(self.unchanged.values()),
+            sum(len(v) for v in self.deleted.values()),
+        )
+
+
+def _fetch_objects(
+    api: "Api", key: str, uids: List[str], fields: str, batch_size: int, max_workers: int
+) -> Dict[str, dict]:
+    """:return: the server's objects of a type by UID, requested in batches of `batch_size` UIDs"""
+    batches = [uids[i : i + batch_size] for i in range(0, len(uids), batch_size)]
+
+    def fetch(batch: List[str]) -> List[dict]:
+        params = {"filter": "id:in:[{}]".format(",".join(batch)), "fields": fields, "paging": "false"}
+        return api.get(key, params=params).json().get(key, [])
+
+    found: Dict[str, dict] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for objects in executor.map(fetch, batches):
+            for obj in objects:
+                found[obj["id"]] = obj
+    return found
+
+
+def _fetch_scope(api: "Api", key: str, scope_filter: str) -> List[str]:
+    """:return: UIDs of the server's objects of a type matching a filter"""
+    params = {"filter": scope_filter, "fields": "id"}
+    data = api.get_paged(key, params=params, page_size=1000, merge=True)
+    return [obj["id"] for obj in data[key]]  # type: ignore  # merged: a dict
+
+
+def compute_metadata_delta(
+    api: "Api",
+    payload: dict,
+    fields: str = ":owner",
+    batch_size: int = 100,
+    max_workers: int = 4,
+    scope: Dict[str, str] = None,
+    ignore: Iterable[str] = VOLATILE_FIELDS,
+    unordered: Iterable[Union[str, Tuple[str, str]]] = UNORDERED_FIELDS,
+) -> MetadataDelta:
+    """
+    Compare a metadata payload with the server's objects of the same UIDs.
+    Only the fields of the local objects are compared: fields the server adds (e.g. defaults) don't make a change.
+    :param api: Api instance
+    :param payload: e.g. {"dataElements": [...], "dataSets": [...]}, values that are not lists are left out
+    :param fields: fields to request of the server's objects
+    :param batch_size: UIDs per request
+    :param max_workers: concurrent requests per type
+    :param scope: per type, a filter of the server's objects that belong to the payload, e.g.
+    {"dataElements": "code:$like:MAL_"}. Those that are not in the payload are deleted.
+    :param ignore: fields that are not compared
+    :param unordered: collections compared regardless of their order, field names or (type, field) pairs
+    :return: MetadataDelta
+    """
+    if not isinstance(batch_size, int) or batch_size < 1:
+        raise ClientException("`batch_size` must be a positive integer")
+    if not isinstance(max_workers, int) or max_workers < 1:
+        raise ClientException("`max_workers` must be a positive integer")
+    ignored, unordered_fields = frozenset(ignore), frozenset(unordered)
+
+    created: Dict[str, List[dict]] = {}
+    changed: Dict[str, List[dict]] = {}
+    unchanged: Dict[str, int] = {}
+    deleted: Dict[str, List[dict]] = {}
+    for key, objects in payload.items():
+        if not isinstance(objects, list):
+            continue
+        uids = [obj["id"] for obj in objects if isinstance(obj, dict) and isinstance(obj.get("id"), str)]
+        server = _fetch_objects(api, key, uids, fields, batch_size, max_workers) if uids else {}
+        created[key], changed[key], unchanged[key] = [], [], 0
+        for obj in objects:
+            uid = obj.get("id") if isinstance(obj, dict) else None
+            existing = server.get(uid) if isinstance(uid, str) else None
+            if existing is None:
+                created[key].append(obj)
+            elif canonical_hash(existing, obj, ignored, unordered_fields, key) != canonical_hash(
+                obj, None, ignored, unordered_fields, key
+            ):
+                changed[key].append(obj)
+            else:
+                unchanged[key] += 1
+    for key, scope_filter in (scope or {}).items():
+        local = {obj.get("id") for obj in payload.get(key) or [] if isinstance(obj, dict)}
+        deleted[key] = [{"id": uid} for uid in _fetch_scope(api, key, scope_filter) if uid not in local]
+    return MetadataDelta(created, changed, unchanged, deleted)
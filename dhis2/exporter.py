@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+"""
+dhis2.exporter
+~~~~~~~~~~~~~~
+
+This module implements concurrent, resumable metadata exports.
+"""
+
+import json
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+from .checkpoint import Checkpoint, fingerprint
+from .exceptions import ClientException
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .api import Api
+
+
+# sink(metadata type, objects of one page)
+MetadataSink = Callable[[str, List[dict]], None]
+
+CHECKPOINT_FILENAME = ".export_metadata.checkpoint.json"
+
+
+def _jsonl_path(directory: Union[str, os.PathLike, Path], metadata_type: str) -> str:
+    return os.path.join(directory, "{}.jsonl".format(metadata_type))
+
+
+def _write_jsonl(path: str, objects: List[dict], offset: Optional[int]) -> int:
+    """
+    Append objects as JSON lines, truncating the file to `offset` first (None: start a new file)
+    :return: the new file size, the offset to resume from
+    """
+    with open(path, "a+b") as f:
+        f.truncate(offset or 0)
+        f.seek(0, os.SEEK_END)
+        for obj in objects:
+            f.write(json.dumps(obj, separators=(",", ":")).encode("utf-8"))
+            f.write(b"\n")
+        return f.tell()
+
+
+def _check_export_args(
+    types: Sequence[str], directory: Any, sink: Optional[MetadataSink], workers: int, page_size: int
+) -> None:
+    if (directory is None) == (sink is None):
+        raise ClientException("Specify either `directory` or `sink`")
+    if not types or isinstance(types, str):
+        raise ClientException("`types` must be a list of metadata types")
+    if int(workers) < 1 or int(page_size) < 1:
+        raise ClientException("`workers` and `page_size` must be > 0")
+
+
+def _load_state(store: Optional[Checkpoint], job: str) -> Dict[str, dict]:
+    """:return: progress per type of the checkpoint (the dict that is saved with it)"""
+    if store is None:
+        return {}
+    if store.state and store.state.get("job") != job:
+        raise ClientException(
+            "Checkpoint {} belongs to a different export, delete it to start over".format(store.path)
+        )
+    store.state["job"] = job
+    return store.state.setdefault("types", {})
+
+
+def _requestable(progress: dict, next_page: int) -> bool:
+    """:return: whether `next_page` of a type may be requested, given its progress"""
+    if progress["pageCount"] is None:  # one page at a time until the first one tells the page count
+        return next_page == progress["page"] + 1
+    return next_page <= progress["pageCount"]
+
+
+def export_metadata(
+    api: "Api",
+    types: Sequence[str],
+    directory: Union[str, os.PathLike, Path] = None,
+    sink: MetadataSink = None,
+    workers: int = 4,
+    page_size: int = 1000,
+    fields: str = ":owner",
+    params: dict = None,
+    checkpoint: Union[str, os.PathLike, Path] = None,
+) -> Dict[str, int]:
+    """
+    Export many metadata types by paging them concurrently. The first page of every type tells its page count,
+    after that further pages of a type are requested ahead, round-robin over the types. At most `workers` pages
+    are requested (or held in memory, waiting for an earlier page of their type) at a time, pages are handed
+    to the sink / written in page order in the calling thread.
+    Progress is checkpointed after every page: re-running the same export resumes every type
+    after its last written page. The checkpoint is deleted when the export completes.
+    :param api: Api instance
+    :param types: metadata collections, e.g. ['dataElements', 'organisationUnits']
+    :param directory: write objects as JSON lines into <directory>/<type>.jsonl
+    :param sink: OR a callable(type, objects) receiving the objects of each page
+    :param workers: maximum concurrent requests (and pages held in memory) across all types
+    :param page_size: objects per page
+    :param fields: fields to export
+    :param params: additional request parameters, e.g. {'filter': 'lastUpdated:gt:2021-01-01'}.
+    Objects are ordered by id unless an `order` is given
+    :param checkpoint: checkpoint file path, defaults to <directory>/.export_metadata.checkpoint.json
+    :return: dict of type -> number of exported objects
+    """
+    _check_export_args(types, directory, sink, workers, page_size)
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+        if checkpoint is None:
+            checkpoint = os.path.join(directory, CHECKPOINT_FILENAME)
+
+    base_params = dict(params or {})
+    # pages of an unordered collection may change between requests, and between a crash and the resumed export
+    base_params.setdefault("order", "id:asc")
+    base_params.update({"fields": fields, "pageSize": page_size, "totalPages": True})
+    target = os.path.abspath(directory) if directory is not None else None
+    job = fingerprint(api.api_url, sorted(types), base_params, target)
+    store = Checkpoint(checkpoint) if checkpoint is not None else None
+    state = _load_state(store, job)
+
+    progress = {t: state.get(t) or {"page": 0, "pageCount": None, "objects": 0, "offset": None} for t in types}
+    pending: Deque[str] = deque(
+        t for t in types if progress[t]["pageCount"] is None or progress[t]["page"] < progress[t]["pageCount"]
+    )
+
+    def fetch(metadata_type: str, page: int) -> dict:
+        request_params = dict(base_params, page=page)
+        return api._json(api.get(metadata_type, params=request_params))
+
+    next_page = {t: progress[t]["page"] + 1 for t in types}
+    # pages that arrived before an earlier page of their type: type -> page -> response
+    early: Dict[str, Dict[int, dict]] = {t: {} for t in types}
+    failed: Set[str] = set()
+
+    def write(metadata_type: str, page: int, data: dict) -> None:
+        p = progress[metadata_type]
+        objects = data.get(metadata_type) or []
+        if sink is not None:
+            sink(metadata_type, objects)
+        else:
+            p["offset"] = _write_jsonl(_jsonl_path(directory, metadata_type), objects, p["offset"])  # type: ignore
+        p["page"] = page
+        p["pageCount"] = data.get("pager", {}).get("pageCount", page)
+        p["objects"] += len(objects)
+        if store is not None:
+            state[metadata_type] = p
+            store.save()
+        if metadata_type not in pending and _requestable(p, next_page[metadata_type]):
+            pending.append(metadata_type)
+
+    error: Optional[BaseException] = None
+    held = 0  # pages in `early`
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight: Dict[Future, Tuple[str, int]] = {}
+        while in_flight or (pending and error is None):
+            while pending and error is None and len(in_flight) + held < workers:
+                metadata_type = pending.popleft()
+                page = next_page[metadata_type]
+                next_page[metadata_type] += 1
+                in_flight[executor.submit(fetch, metadata_type, page)] = (metadata_type, page)
+                if _requestable(progress[metadata_type], next_page[metadata_type]):
+                    pending.append(metadata_type)  # round-robin over the types
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                metadata_type, page = in_flight.pop(future)
+                if metadata_type in failed:
+                    continue
+                pages = early[metadata_type]
+                try:
+                    pages[page] = future.result()
+                    held += 1
+                    while progress[metadata_type]["page"] + 1 in pages:
+                        held -= 1
+                        next_written = progress[metadata_type]["page"] + 1
+                        write(metadata_type, next_written, pages.pop(next_written))
+                except Exception as e:
+                    # let the requests in flight finish and be checkpointed, then re-raise
+                    failed.add(metadata_type)
+                    error = error or e
+
+    if error is not None:
+        raise error
+    if store is not None:
+        store.delete()
+    return {t: progress[t]["objects"] for t in types}
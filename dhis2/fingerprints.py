@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+"""
+dhis2.fingerprints
+~~~~~~~~~~~~~~~~~~
+
+This module keeps a local store of what was imported into dataValueSets, so that a repeated sync
+submits only the data values that changed since the last successful import.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, List, Optional, Sequence, Tuple, Union
+
+from .exceptions import ClientException
+from .importer import _import_confirmed, _response_json
+
+# the fields of a data value that identify it on the server
+KEY_FIELDS = ("dataElement", "period", "orgUnit", "categoryOptionCombo", "attributeOptionCombo")
+# the fields of a data value whose change makes it to be submitted again
+VALUE_FIELDS = ("value", "comment", "followup", "deleted")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS data_values (
+    data_element TEXT NOT NULL,
+    period TEXT NOT NULL,
+    org_unit TEXT NOT NULL,
+    category_option_combo TEXT NOT NULL,
+    attribute_option_combo TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (data_element, period, org_unit, category_option_combo, attribute_option_combo)
+) WITHOUT ROWID
+"""
+_SELECT = (
+    "SELECT hash FROM data_values WHERE data_element = ? AND period = ? AND org_unit = ? "
+    "AND category_option_combo = ? AND attribute_option_combo = ?"
+)
+_UPSERT = "INSERT OR REPLACE INTO data_values VALUES (?, ?, ?, ?, ?, ?, ?)"
+_DELETE = (
+    "DELETE FROM data_values WHERE data_element = ? AND period = ? AND org_unit = ? "
+    "AND category_option_combo = ? AND attribute_option_combo = ?"
+)
+
+
+def _set_defaults(payload: dict) -> dict:
+    """:return: the fields of a data value set that apply to all of its data values"""
+    return {field: payload[field] for field in ("period", "orgUnit", "attributeOptionCombo") if payload.get(field)}
+
+
+def _import_mode(params: Union[dict, List[tuple], None]) -> Tuple[bool, bool]:
+    """:return: whether the import request parameters ask for a dry run, whether they ask to delete"""
+    items = params.items() if isinstance(params, dict) else (params or [])
+    dry_run = delete = False
+    for name, value in items:
+        if name == "dryRun":
+            dry_run = str(value).lower() == "true"
+        elif name in ("importStrategy", "strategy"):
+            delete = str(value).upper() == "DELETE"
+    return dry_run, delete
+
+
+def _text(value: Any) -> Optional[str]:
+    """Values as text, so that 5 and "5" or True and "true" hash the same"""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+class DataValueFingerprints(object):
+    """
+    A SQLite file of the data values that were imported: per dataElement / period / orgUnit /
+    categoryOptionCombo / attributeOptionCombo a hash of the value (and comment, followup, deleted).
+    Data values whose hash didn't change since the last confirmed import are left out of a payload.
+    A store belongs to one server - use one file per server.
+
+    with DataValueFingerprints('sync.fingerprints') as store:
+        for response in api.post_partitioned('dataValueSets', json=data, fingerprints=store):
+            pass
+    """
+
+    def __init__(
+        self,
+        path: Union[str, os.PathLike, Path],
+        value_fields: Sequence[str] = VALUE_FIELDS,
+    ) -> None:
+        """
+        :param path: SQLite file, created if it doesn't exist
+        :param value_fields: fields of a data value that are hashed
+        """
+        self.path = path
+        self.value_fields = tuple(value_fields)
+        self._lock = threading.Lock()
+        try:
+            self._db: Optional[sqlite3.Connection] = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute(_SCHEMA)
+            self._db.commit()
+        except sqlite3.DatabaseError as e:
+            raise ClientException("Not a fingerprint store: {} ({})".format(path, e))
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        if self._db is None:
+            raise ClientException("Fingerprint store is closed: {}".format(self.path))
+        return self._db
+
+    @staticmethod
+    def key(data_value: dict, defaults: dict = None) -> Optional[Tuple[str, ...]]:
+        """
+        :param data_value: e.g. {"dataElement": ..., "period": ..., "orgUnit": ..., "value": ...}
+        :param defaults: fields of the data value set, used when the data value has none
+        :return: the identifying fields, None if dataElement, period or orgUnit are missing.
+        Missing option combos are the default ones ("").
+        """
+        defaults = defaults or {}
+        key = tuple(data_value.get(field) or defaults.get(field) or "" for field in KEY_FIELDS)
+        if not all(key[:3]):
+            return None
+        return tuple(str(part) for part in key)
+
+    def value_hash(self, data_value: dict) -> str:
+        """:return: hex digest of the value fields of a data value"""
+        text = json.dumps([_text(data_value.get(field)) for field in self.value_fields], separators=(",", ":"))
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def filter(self, payload: dict, params: Union[dict, List[tuple]] = None) -> dict:
+        """
+        Leave out the data values that are in the store with the same hash
+        :param payload: a dataValueSets payload, e.g. {"dataValues": [...]}. Data values without period, orgUnit or
+        attributeOptionCombo take them from the payload (a data value set of one period / org unit)
+        :param params: request parameters of the import, nothing is left out of a deletion (importStrategy=DELETE)
+        :return: the payload with only the changed data values (incl. those that can't be identified)
+        """
+        if _import_mode(params)[1]:
+            return payload
+        defaults = _set_defaults(payload)
+        changed = []
+        with self._lock:
+            cursor = self._connection.cursor()
+            for data_value in payload.get("dataValues") or []:
+                key = self.key(data_value, defaults)
+                if key is not None:
+                    row = cursor.execute(_SELECT, key).fetchone()
+                    if row is not None and row[0] == self.value_hash(data_value):
+                        continue
+                changed.append(data_value)
+        return dict(payload, dataValues=changed)
+
+    def record(self, payload: dict) -> int:
+        """
+        Store the hashes of imported data values
+        :param payload: the dataValueSets payload the server confirmed
+        :return: number of data values stored
+        """
+        defaults = _set_defaults(payload)
+        now = time.time()
+        rows = []
+        for data_value in payload.get("dataValues") or []:
+            key = self.key(data_value, defaults)
+            if key is not None:
+                rows.append(key + (self.value_hash(data_value), now))
+        with self._lock:
+            connection = self._connection
+            with connection:  # one transaction
+                connection.executemany(_UPSERT, rows)
+        return len(rows)
+
+    def forget(self, payload: dict) -> int:
+        """
+        Remove data values from the store, e.g. deleted ones, so that they are submitted again
+        :param payload: a dataValueSets payload
+        :return: number of data values removed
+        """
+        defaults = _set_defaults(payload)
+        keys = [key for key in (self.key(dv, defaults) for dv in payload.get("dataValues") or []) if key is not None]
+        with self._lock:
+            connection = self._connection
+            with connection:
+                before = connection.total_changes
+                connection.executemany(_DELETE, keys)
+                return connection.total_changes - before
+
+    def confirm(self, payload: dict, response: Any, params: Union[dict, List[tuple]] = None) -> bool:
+        """
+        Store the data values of a chunk if the server's import summary confirms that all of them were imported.
+        The data values of a chunk with ignored values are not stored and are submitted again next time.
+        Nothing is stored for a dry run (dryRun=true), a deletion (importStrategy=DELETE) removes the data values.
+        :param payload: the dataValueSets payload of the chunk
+        :param response: requests.Response (or the import summary dict) of the chunk
+        :param params: request parameters of the import
+        :return: True if the data values were stored
+        """
+        dry_run, delete = _import_mode(params)
+        if dry_run:
+            return False
+        if delete:  # whatever the server deleted, forgetting only makes the values to be submitted again
+            self.forget(payload)
+            return False
+        summary = response if isinstance(response, dict) else _response_json(response)
+        if not _import_confirmed(summary):
+            return False
+        self.record(payload)
+        return True
+
+    def clear(self) -> None:
+        """Forget all data values, the next import submits everything"""
+        with self._lock:
+            connection = self._connection
+            with connection:
+                connection.execute("DELETE FROM data_values")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM data_values").fetchone()[0]
+
+    def __enter__(self) -> "DataValueFingerprints":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def __repr__(self) -> str:
+        return "DataValueFingerprints({})".format(self.path)
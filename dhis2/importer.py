@@ -0,0 +1,666 @@
+# -*- coding: utf-8 -*-
+
+"""
+dhis2.importer
+~~~~~~~~~~~~~~
+
+This module implements streaming imports, e.g. CSV files into dataValueSets.
+"""
+
+import json
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from csv import DictReader
+from itertools import islice
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import requests
+
+from .exceptions import ClientException, RequestException
+from .utils import ImportSummary, _batched, load_csv
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .api import Api
+
+
+DATA_VALUE_FIELDS = (
+    "dataElement",
+    "period",
+    "orgUnit",
+    "categoryOptionCombo",
+    "attributeOptionCombo",
+    "value",
+    "storedBy",
+    "comment",
+    "followup",
+)
+REQUIRED_DATA_VALUE_FIELDS = ("dataElement", "period", "orgUnit", "value")
+
+# a mapping of dataValue field -> CSV column name or a callable(row) -> value
+ColumnMapping = Dict[str, Union[str, Callable[[dict], Any]]]
+
+
+class ImportReport(object):
+    """
+    Aggregated import summaries of many (partitioned or concurrent) import requests.
+    Counters of dataValues, metadata, events and tracker imports are merged into
+    imported / updated / ignored / deleted, conflicts and errorReports are kept with their chunk index.
+    Beyond `spill_threshold` conflicts are written to a temporary file instead of being kept in memory.
+
+    Usage:
+
+    report = ImportReport().consume(api.post_partitioned('metadata', json=data))
+    print(report.import_count, report.throughput)
+    for conflict in report.iter_conflicts():
+        print(conflict)
+    """
+
+    def __init__(self, spill_threshold: int = 10000) -> None:
+        """
+        :param spill_threshold: number of conflicts to keep in memory before spilling to a temporary file
+        """
+        self.chunks = 0
+        self.objects = 0
+        self.import_count = {"imported": 0, "updated": 0, "ignored": 0, "deleted": 0}
+        self.statuses: Counter = Counter()
+        self.conflict_count = 0
+        self.errors: List[Tuple[int, str]] = []
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+        self._spill_threshold = spill_threshold
+        self._conflicts: List[dict] = []
+        self._spill: Optional[IO[str]] = None
+
+    def add(self, response: dict, chunk_index: int = None, objects: int = 0) -> None:
+        """
+        Add the import summary of one chunk
+        :param response: the JSON import summary returned by DHIS2
+        :param chunk_index: the (zero-based) index of the chunk, defaults to the number of chunks added so far
+        :param objects: the number of objects submitted in this chunk (if known)
+        """
+        chunk_index = self.chunks if chunk_index is None else chunk_index
+        self.chunks += 1
+        self.objects += objects
+        if not isinstance(response, dict):
+            response = {}
+        wrapped = response.get("response")
+        summary = wrapped if isinstance(wrapped, dict) else response
+        self.statuses[summary.get("status", response.get("status"))] += 1
+        try:
+            counts = ImportSummary.from_import_response(response)
+        except (ClientException, KeyError, TypeError, ValueError):
+            pass  # no statistics in this response, e.g. an error page
+        else:
+            self.import_count["imported"] += counts.imported
+            self.import_count["updated"] += counts.updated
+            self.import_count["ignored"] += counts.ignored
+            self.import_count["deleted"] += counts.deleted
+        for conflict in _iter_response_conflicts(summary):
+            conflict["chunk"] = chunk_index
+            self._add_conflict(conflict)
+
+    def add_response(self, response: Any, chunk_index: int = None, objects: int = 0) -> None:
+        """
+        Add a requests.Response (or a RequestException with an import summary in its body)
+        :param response: requests.Response or RequestException
+        :param chunk_index: see add()
+        :param objects: see add()
+        """
+        if isinstance(response, RequestException):
+            summary = _error_json(response)
+            if summary:
+                self.add(summary, chunk_index, objects)
+            else:
+                chunk_index = self.chunks if chunk_index is None else chunk_index
+                self.add_error(chunk_index, str(response), objects)
+        else:
+            self.add(_response_json(response), chunk_index, objects)
+
+    def add_error(self, chunk_index: int, description: str, objects: int = 0) -> None:
+        """
+        Add a chunk that failed without an import summary
+        :param chunk_index: the (zero-based) index of the chunk
+        :param description: the error description
+        :param objects: the number of objects submitted in this chunk
+        """
+        self.chunks += 1
+        self.objects += objects
+        self.statuses["ERROR"] += 1
+        self.errors.append((chunk_index, description))
+
+    def consume(self, responses: Iterable[Any]) -> "ImportReport":
+        """
+        Add every response of an iterable as it comes in, e.g. the generator of Api.post_partitioned()
+        :param responses: iterable of requests.Response objects or import summary dicts
+        :return: self
+        """
+        for response in responses:
+            if isinstance(response, dict):
+                self.add(response)
+            else:
+                self.add_response(response)
+        self.finish()
+        return self
+
+    def finish(self) -> None:
+        """Stop the clock for `elapsed` and `throughput`"""
+        self.finished = time.monotonic()
+
+    def _add_conflict(self, conflict: dict) -> None:
+        self.conflict_count += 1
+        if self._spill is not None:
+            self._spill.seek(0, 2)  # iter_conflicts() may have stopped reading anywhere
+            self._spill.write(json.dumps(conflict) + "\n")
+            return
+        self._conflicts.append(conflict)
+        if len(self._conflicts) >= self._spill_threshold:
+            self._spill = tempfile.TemporaryFile("w+", encoding="utf-8")
+            for c in self._conflicts:
+                self._spill.write(json.dumps(c) + "\n")
+            self._conflicts = []
+
+    def iter_conflicts(self) -> Iterator[dict]:
+        """
+        Yield all conflicts / errorReports in the order they were added,
+        each with the index of its `chunk`
+        """
+        if self._spill is None:
+            yield from list(self._conflicts)
+            return
+        self._spill.flush()
+        self._spill.seek(0)
+        for line in self._spill:
+            yield json.loads(line)
+
+    @property
+    def conflicts(self) -> List[dict]:
+        """All conflicts as a list - prefer iter_conflicts() for large imports"""
+        return list(self.iter_conflicts())
+
+    @property
+    def total(self) -> int:
+        """Objects counted in the import summaries"""
+        return sum(self.import_count.values())
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds from creating the report until finish() (or now)"""
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def throughput(self) -> float:
+        """Objects per second"""
+        elapsed = self.elapsed
+        return (self.objects or self.total) / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def ok(self) -> bool:
+        """True if all chunks succeeded without ignored objects"""
+        return all(
+            [
+                set(self.statuses) <= {"OK", "SUCCESS"},
+                self.import_count["ignored"] == 0,
+                self.conflict_count == 0,
+                not self.errors,
+            ]
+        )
+
+    def close(self) -> None:
+        """Remove the temporary conflicts file, if any"""
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+        self._conflicts = []
+
+    def to_dict(self, max_conflicts: int = 100) -> dict:
+        """
+        :param max_conflicts: include at most this many conflicts
+        :return: dict of the report
+        """
+        return {
+            "chunks": self.chunks,
+            "objects": self.objects,
+            "total": self.total,
+            "importCount": dict(self.import_count),
+            "statuses": dict(self.statuses),
+            "elapsed": round(self.elapsed, 3),
+            "throughput": round(self.throughput, 1),
+            "conflictCount": self.conflict_count,
+            "conflicts": list(islice(self.iter_conflicts(), max_conflicts)),
+            "errors": [
+                {"chunk": chunk, "description": description}
+                for chunk, description in self.errors
+            ],
+        }
+
+    def __repr__(self) -> str:
+        return "ImportReport(chunks={}, objects={}, importCount={}, conflicts={}, errors={})".format(
+            self.chunks,
+            self.objects,
+            self.import_count,
+            self.conflict_count,
+            len(self.errors),
+        )
+
+
+def _iter_response_conflicts(summary: dict) -> Iterator[dict]:
+    """
+    Yield the conflicts of an import summary
+    - dataValueSets: conflicts
+    - events / trackedEntityInstances: importSummaries[].conflicts (with the reference)
+    - metadata: typeReports[].objectReports[].errorReports
+    """
+    for conflict in summary.get("conflicts") or []:
+        yield {"kind": "conflict", "object": conflict.get("object"), "value": conflict.get("value")}
+    for import_summary in summary.get("importSummaries") or []:
+        for conflict in import_summary.get("conflicts") or []:
+            yield {
+                "kind": "conflict",
+                "reference": import_summary.get("reference"),
+                "object": conflict.get("object"),
+                "value": conflict.get("value"),
+            }
+    for type_report in summary.get("typeReports") or []:
+        for object_report in type_report.get("objectReports") or []:
+            for error_report in object_report.get("errorReports") or []:
+                error = {"kind": "errorReport", "uid": object_report.get("uid")}
+                error.update(error_report)
+                yield error
+
+
+def _compile_mapping(mapping: ColumnMapping) -> List[Tuple[str, Callable[[dict], Any]]]:
+    """
+    Validate a column mapping and turn it into a list of (field, getter)
+    :param mapping: dataValue field -> CSV column name or callable(row)
+    :return: list of (dataValue field, callable(row))
+    """
+    if not isinstance(mapping, dict) or not mapping:
+        raise ClientException("`mapping` must be a non-empty dict")
+    unknown = [field for field in mapping if field not in DATA_VALUE_FIELDS]
+    if unknown:
+        raise ClientException(
+            "Unknown dataValue fields in `mapping`: {} - must be one of {}".format(
+                unknown, DATA_VALUE_FIELDS
+            )
+        )
+    missing = [field for field in REQUIRED_DATA_VALUE_FIELDS if field not in mapping]
+    if missing:
+        raise ClientException("`mapping` is missing required fields: {}".format(missing))
+
+    getters = []
+    for field, column in mapping.items():
+        if callable(column):
+            getters.append((field, column))
+        elif isinstance(column, str):
+            getters.append((field, _column_getter(column)))
+        else:
+            raise ClientException(
+                "`mapping` values must be a column name or a callable, not {}".format(
+                    column.__class__.__name__
+                )
+            )
+    return getters
+
+
+def _column_getter(column: str) -> Callable[[dict], Any]:
+    def getter(row: dict) -> Any:
+        try:
+            return row[column]
+        except KeyError:
+            raise ClientException("Column '{}' not found in CSV".format(column))
+
+    return getter
+
+
+def iter_data_values(
+    rows: Iterable[dict], mapping: ColumnMapping
+) -> Iterator[dict]:
+    """
+    Map CSV rows to DHIS2 dataValues
+    :param rows: iterable of dicts, e.g. from load_csv()
+    :param mapping: dataValue field -> CSV column name or callable(row) -> value
+    :return: a generator where __next__ is a dataValue dict
+    """
+    getters = _compile_mapping(mapping)
+    for row in rows:
+        data_value = {}
+        for field, getter in getters:
+            value = getter(row)
+            # leave out empty optional fields, e.g. no attributeOptionCombo
+            if (value is not None and value != "") or field in REQUIRED_DATA_VALUE_FIELDS:
+                data_value[field] = value
+        yield data_value
+
+
+def _response_json(response: Any) -> dict:
+    try:
+        data = response.json()
+    except ValueError:
+        data = None
+    return data if isinstance(data, dict) else {}
+
+
+def _import_confirmed(summary: dict) -> bool:
+    """:return: True if an import summary reports success without ignored objects"""
+    try:
+        import_summary = ImportSummary.from_import_response(summary)
+    except ClientException:
+        return False
+    return import_summary.status_ok and not import_summary.ignored
+
+
+def _error_json(exc: RequestException) -> dict:
+    """DHIS2 returns the import summary in the body of e.g. a 409 Conflict"""
+    try:
+        data = json.loads(exc.description)
+    except (TypeError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+# errors of requests that got no response, e.g. connection errors and timeouts
+_NO_RESPONSE_ERRORS = (requests.RequestException, OSError)
+
+
+def _error_text(e: BaseException) -> str:
+    return str(e) or type(e).__name__
+
+
+def _collect(
+    done: Iterable[Future], in_flight: Dict[Future, Tuple[int, int]], report: ImportReport
+) -> None:
+    for future in done:
+        chunk_index, objects = in_flight.pop(future)
+        try:
+            response = future.result()
+        except RequestException as e:
+            report.add_response(e, chunk_index, objects)
+        except _NO_RESPONSE_ERRORS as e:
+            report.add_error(chunk_index, _error_text(e), objects)
+        else:
+            report.add_response(response, chunk_index, objects)
+
+
+def import_data_values_csv(
+    api: "Api",
+    source: Union[str, IO[str]],
+    mapping: ColumnMapping,
+    chunk_size: int = 1000,
+    max_workers: int = 4,
+    params: Union[dict, List[tuple]] = None,
+    delimiter: str = ",",
+    encoding: str = None,
+) -> ImportReport:
+    """
+    Stream a CSV file into the dataValueSets endpoint.
+    Rows are read and mapped in chunks of `chunk_size` dataValues, each chunk is POSTed as soon as it is built.
+    At most `max_workers` chunks are uploaded (and held in memory) at the same time.
+
+    Usage:
+
+    report = import_data_values_csv(
+        api,
+        '/path/to/values.csv',
+        mapping={'dataElement': 'de', 'period': 'pe', 'orgUnit': 'ou', 'value': 'value'},
+        params={'dryRun': 'true'}
+    )
+    print(report.import_count)
+
+    :param api: Api instance
+    :param source: path to a CSV file or an open text stream of CSV data
+    :param mapping: dataValue field -> CSV column name or callable(row) -> value
+    :param chunk_size: dataValues per request
+    :param max_workers: maximum concurrent uploads
+    :param params: request parameters, e.g. {'dryRun': 'true', 'importStrategy': 'CREATE'}
+    :param delimiter: CSV delimiter
+    :param encoding: file encoding (only if `source` is a path)
+    :return: ImportReport with the aggregated import summaries
+    """
+    if not isinstance(chunk_size, int) or chunk_size < 1:
+        raise ClientException("`chunk_size` must be a positive integer")
+    if not isinstance(max_workers, int) or max_workers < 1:
+        raise ClientException("`max_workers` must be a positive integer")
+
+    if hasattr(source, "read"):
+        rows: Iterable[dict] = DictReader(source, delimiter=delimiter)
+    else:
+        rows = load_csv(source, delimiter=delimiter, encoding=encoding)  # type: ignore
+    data_values = iter_data_values(rows, mapping)
+
+    report = ImportReport()
+    in_flight: Dict[Future, Tuple[int, int]] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for chunk_index, chunk in enumerate(_batched(data_values, chunk_size)):
+                if len(in_flight) >= max_workers:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    _collect(done, in_flight, report)
+                future = executor.submit(
+                    api.post, "dataValueSets", json={"dataValues": chunk}, params=params
+                )
+                in_flight[future] = (chunk_index, len(chunk))
+            _collect(wait(in_flight).done, in_flight, report)
+            report.finish()
+        except BaseException:
+            for future in in_flight:
+                future.cancel()
+            raise
+    return report
+
+
+# job types of asynchronous imports when the server does not report them
+ASYNC_JOB_TYPES = {
+    "dataValueSets": "DATAVALUE_IMPORT",
+    "metadata": "METADATA_IMPORT",
+    "events": "EVENT_IMPORT",
+    "trackedEntityInstances": "TEI_IMPORT",
+    "enrollments": "ENROLLMENT_IMPORT",
+}
+
+
+def _async_params(params: Union[dict, List[tuple], None]) -> Union[dict, List[tuple]]:
+    """Add async=true to request parameters without changing the caller's params"""
+    if isinstance(params, list):
+        return [p for p in params if p[0] != "async"] + [("async", "true")]
+    params = dict(params or {})
+    params["async"] = "true"
+    return params
+
+
+class AsyncImportJob(object):
+    """
+    An import running in the background on the server (submitted with async=true).
+    Polling is driven by the caller via poll_due() / poll(), with an exponential backoff.
+    """
+
+    def __init__(
+        self,
+        api: "Api",
+        endpoint: str,
+        response: dict,
+        chunk_index: int = 0,
+        objects: int = 0,
+        poll_interval: float = 1.0,
+        max_poll_interval: float = 30.0,
+        backoff: float = 1.5,
+    ) -> None:
+        """
+        :param api: Api instance
+        :param endpoint: the import endpoint, e.g. 'dataValueSets'
+        :param response: the JSON response of the async import request
+        :param chunk_index: index of the chunk this job imports
+        :param objects: number of objects submitted with this job
+        :param poll_interval: seconds until the first poll
+        :param max_poll_interval: maximum seconds between two polls
+        :param backoff: factor to increase the poll interval with after every poll
+        """
+        self.api = api
+        self.endpoint = endpoint
+        self.chunk_index = chunk_index
+        self.objects = objects
+        job = response.get("response")
+        if not isinstance(job, dict):
+            job = {}
+        self.job_id = job.get("id")
+        self.job_type = job.get("jobType") or ASYNC_JOB_TYPES.get(endpoint.split("/")[0])
+        if not self.job_id or not self.job_type:
+            raise ClientException(
+                "Response of async import to '{}' has no job id / type: {}".format(
+                    endpoint, response
+                )
+            )
+        self.interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.backoff = backoff
+        self.submitted = time.monotonic()
+        self.next_poll = self.submitted + poll_interval
+        self.completed = False
+
+    @classmethod
+    def submit(
+        cls,
+        api: "Api",
+        endpoint: str,
+        json: dict,
+        params: Union[dict, List[tuple]] = None,
+        chunk_index: int = 0,
+        **kwargs: Any
+    ) -> "AsyncImportJob":
+        """
+        POST a payload with async=true and return the job
+        :param api: Api instance
+        :param endpoint: the import endpoint, e.g. 'dataValueSets'
+        :param json: the payload
+        :param params: request parameters
+        :param chunk_index: index of the chunk this job imports
+        :param kwargs: see __init__
+        :return: AsyncImportJob
+        """
+        objects = sum(len(v) for v in json.values() if isinstance(v, list))
+        r = api.post(endpoint, json=json, params=_async_params(params))
+        return cls(api, endpoint, _response_json(r), chunk_index, objects, **kwargs)
+
+    def poll(self) -> bool:
+        """
+        Ask the server whether the job completed (system/tasks) and schedule the next poll
+        :return: True if completed
+        """
+        tasks = self.api.get(
+            "system/tasks/{}/{}".format(self.job_type, self.job_id)
+        ).json()
+        if isinstance(tasks, dict):  # some versions return a single notification
+            tasks = [tasks]
+        self.completed = any(t.get("completed") for t in tasks if isinstance(t, dict))
+        self.interval = min(self.interval * self.backoff, self.max_poll_interval)
+        self.next_poll = time.monotonic() + self.interval
+        return self.completed
+
+    def summary(self) -> dict:
+        """:return: the import summary of the completed job (system/taskSummaries)"""
+        return self.api.get(
+            "system/taskSummaries/{}/{}".format(self.job_type, self.job_id)
+        ).json()
+
+    def __repr__(self) -> str:
+        return "AsyncImportJob({}, {}, chunk={})".format(
+            self.job_type, self.job_id, self.chunk_index
+        )
+
+
+def wait_for_async_import(
+    job: AsyncImportJob, timeout: float = None, sleep: Callable[[float], None] = time.sleep
+) -> dict:
+    """
+    Poll an async import job until it completed
+    :param job: AsyncImportJob
+    :param timeout: seconds after submitting to give up, None to wait forever
+    :param sleep: function to sleep with
+    :return: the import summary
+    """
+    while not job.completed:
+        if timeout is not None and time.monotonic() - job.submitted > timeout:
+            raise ClientException("{} did not complete within {}s".format(job, timeout))
+        sleep(max(0.0, job.next_poll - time.monotonic()))
+        job.poll()
+    return job.summary()
+
+
+def run_async_imports(
+    api: "Api",
+    endpoint: str,
+    payloads: Iterable[dict],
+    params: Union[dict, List[tuple]] = None,
+    max_jobs: int = 4,
+    timeout: float = None,
+    sleep: Callable[[float], None] = time.sleep,
+    **kwargs: Any
+) -> ImportReport:
+    """
+    Submit payloads as async import jobs with at most `max_jobs` jobs running on the server at a time.
+    All jobs are polled from the calling thread, no thread or connection is held while the server is importing.
+    :param api: Api instance
+    :param endpoint: the import endpoint, e.g. 'dataValueSets'
+    :param payloads: iterable of payloads, e.g. from partition_payload()
+    :param params: request parameters
+    :param max_jobs: maximum concurrent jobs
+    :param timeout: seconds after submitting a job to give up on it, None to wait forever
+    :param sleep: function to sleep with
+    :param kwargs: poll_interval / max_poll_interval / backoff, see AsyncImportJob
+    :return: ImportReport of all jobs
+    """
+    if not isinstance(max_jobs, int) or max_jobs < 1:
+        raise ClientException("`max_jobs` must be a positive integer")
+    report = ImportReport()
+    pending = enumerate(payloads)
+    active: List[AsyncImportJob] = []
+    exhausted = False
+    while active or not exhausted:
+        while not exhausted and len(active) < max_jobs:
+            try:
+                chunk_index, payload = next(pending)
+            except StopIteration:
+                exhausted = True
+                break
+            try:
+                active.append(
+                    AsyncImportJob.submit(api, endpoint, payload, params, chunk_index, **kwargs)
+                )
+            except RequestException as e:
+                report.add_response(e, chunk_index)
+            except _NO_RESPONSE_ERRORS + (ClientException,) as e:  # e.g. a response without a job id
+                report.add_error(chunk_index, _error_text(e))
+        if not active:
+            continue
+        job = min(active, key=lambda j: j.next_poll)
+        sleep(max(0.0, job.next_poll - time.monotonic()))
+        try:
+            if job.poll():
+                active.remove(job)
+                report.add(job.summary(), job.chunk_index, job.objects)
+            elif timeout is not None and time.monotonic() - job.submitted > timeout:
+                active.remove(job)
+                report.add_error(
+                    job.chunk_index, "{} did not complete within {}s".format(job, timeout), job.objects
+                )
+        except RequestException as e:
+            active.remove(job)
+            report.add_response(e, job.chunk_index, job.objects)
+        except _NO_RESPONSE_ERRORS + (ClientException,) as e:  # the other jobs are still polled
+            active.remove(job)
+            report.add_error(job.chunk_index, "{}: {}".format(job, _error_text(e)), job.objects)
+    report.finish()
+    return report
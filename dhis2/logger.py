@@ -7,10 +7,350 @@ dhis2.logger
 This module sets up logzero loggers.
 """
 
+import atexit
+import itertools
+import json
 import logging
-from typing import Any
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
-import logzero
+from .exceptions import ClientException
+
+
+_context = threading.local()
+_request_ids = itertools.count(1)
+_REQUEST_ID_PREFIX = "{:06x}".format(random.getrandbits(24))  # tells processes apart
+
+
+def new_request_id() -> str:
+    """:return: an id unique to this process and request, e.g. '3fa2c1-17'"""
+    return "{}-{}".format(_REQUEST_ID_PREFIX, next(_request_ids))
+
+
+@contextmanager
+def log_context(**fields: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Add correlation fields to the log records of this thread while the block runs (see LogContextFilter).
+    Nested contexts inherit the fields of the outer ones. Api requests add request_id, method and endpoint,
+    get_paged() and post_partitioned() the page / chunk.
+
+    with log_context(job='nightly-import'):
+        logger.info('started')  # {"message": "started", "job": "nightly-import", "duration": 0.0, ...}
+    """
+    stack = getattr(_context, "stack", None)
+    if stack is None:
+        stack = _context.stack = []
+    merged = dict(stack[-1][0]) if stack else {}
+    merged.update(fields)
+    entry = (merged, time.perf_counter())
+    stack.append(entry)
+    try:
+        yield merged
+    finally:
+        # not necessarily the last entry, e.g. when an abandoned generator is closed later
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i] is entry:
+                del stack[i]
+                break
+
+
+def get_log_context() -> Dict[str, Any]:
+    """
+    :return: fields of the innermost log_context() of this thread
+             and its `duration`: seconds since the context started
+    """
+    stack = getattr(_context, "stack", None)
+    if not stack:
+        return {}
+    fields, started = stack[-1]
+    context = dict(fields)
+    context["duration"] = round(time.perf_counter() - started, 6)
+    return context
+
+
+class LogContextFilter(logging.Filter):
+    """Attach the log_context() fields of the logging thread to every record (as `record.context`)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.context = get_log_context()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format records as one JSON object per line: time (UTC), level, logger, message, module, line,
+    the fields of log_context() and the exception, if any
+    """
+
+    def __init__(self) -> None:
+        super(JsonFormatter, self).__init__()
+        # one encoder instance: json.dumps() with options builds a new one for every call
+        self._encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=str).encode
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": "{}.{:03d}Z".format(
+                time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)), int(record.msecs)
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+        }
+        context = getattr(record, "context", None)
+        if context:
+            entry.update(context)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return self._encode(entry)
+
+
+class _SiteState(object):
+    __slots__ = ("seen", "tokens", "updated", "message", "repeats", "suppressed", "record")
+
+    def __init__(self, tokens: float, now: float) -> None:
+        self.seen = 0
+        self.tokens = tokens
+        self.updated = now
+        self.message: Optional[str] = None
+        self.repeats = 0  # identical messages coalesced since the last logged one
+        self.suppressed = 0  # records sampled out or rate limited since the last logged one
+        self.record: Optional[logging.LogRecord] = None  # the record of `message`
+
+
+class LogSampler(logging.Filter):
+    """
+    Thin out log records of hot loops, per call site (file and line of the log call):
+    log only every n-th record, at most `max_per_second` records and coalesce identical consecutive messages
+    into a "repeated N times" summary. Records above `max_level` (by default WARNING and ERROR) always pass.
+    A record that passes after others were left out tells how many, e.g. 'processed ou 120 (+99 suppressed)'.
+
+    setup_logger(sampler=LogSampler(every=100, max_per_second=10, coalesce=True))
+    """
+
+    def __init__(
+        self,
+        every: int = 1,
+        max_per_second: float = None,
+        coalesce: bool = False,
+        max_level: int = logging.INFO,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        :param every: log 1 in `every` records of a call site
+        :param max_per_second: maximum records per second and call site, None for no limit
+        :param coalesce: leave out a message identical to the previous one of the call site and count it
+        :param max_level: only records up to this level are sampled
+        """
+        super(LogSampler, self).__init__()
+        if every < 1:
+            raise ClientException("`every` must be > 0")
+        if max_per_second is not None and max_per_second <= 0:
+            raise ClientException("`max_per_second` must be > 0")
+        self.every = every
+        self.max_per_second = max_per_second
+        self.coalesce = coalesce
+        self.max_level = max_level
+        self._clock = clock
+        self._burst = max(1.0, max_per_second or 1.0)
+        self._sites: Dict[Tuple[str, int], _SiteState] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.max_level or getattr(record, "summary", False):
+            return True
+        site = (record.pathname, record.lineno)
+        summary = None
+        with self._lock:
+            now = self._clock()
+            state = self._sites.get(site)
+            if state is None:
+                state = self._sites[site] = _SiteState(self._burst, now)
+            if self.coalesce:
+                message = record.getMessage()
+                if message == state.message:
+                    state.repeats += 1
+                    return False
+                if state.repeats:
+                    summary = self._summary(state)
+                state.message, state.record = message, record
+            state.seen += 1
+            if not self._admit(state, now):
+                state.suppressed += 1
+                return False
+            if state.suppressed:
+                record.msg = "{} (+{} suppressed)".format(record.getMessage(), state.suppressed)
+                record.args = None
+                state.suppressed = 0
+        if summary is not None:
+            logging.getLogger(summary.name).handle(summary)
+        return True
+
+    def _admit(self, state: _SiteState, now: float) -> bool:
+        if (state.seen - 1) % self.every:
+            return False
+        if self.max_per_second is None:
+            return True
+        state.tokens = min(self._burst, state.tokens + (now - state.updated) * self.max_per_second)
+        state.updated = now
+        if state.tokens < 1:
+            return False
+        state.tokens -= 1
+        return True
+
+    @staticmethod
+    def _summary(state: _SiteState) -> logging.LogRecord:
+        """:return: a record from the call site of the coalesced message saying how often it was repeated"""
+        like: logging.LogRecord = state.record  # type: ignore  # set together with the message
+        summary = logging.makeLogRecord(
+            {
+                "name": like.name,
+                "levelno": like.levelno,
+                "levelname": like.levelname,
+                "pathname": like.pathname,
+                "filename": like.filename,
+                "module": like.module,
+                "lineno": like.lineno,
+                "funcName": like.funcName,
+                "msg": "previous message repeated {} times: {}".format(state.repeats, state.message),
+                "summary": True,
+            }
+        )
+        state.repeats = 0
+        return summary
+
+    def flush(self) -> None:
+        """Log the summaries of messages that are still being coalesced, e.g. at the end of a loop"""
+        with self._lock:
+            summaries = [self._summary(state) for state in self._sites.values() if state.repeats]
+        for summary in summaries:
+            logging.getLogger(summary.name).handle(summary)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Hands records to a bounded queue that a background thread writes out.
+    When the queue is full, records are dropped (and counted) or - with `block` - the caller waits.
+    The number of dropped records is logged as a warning once the queue has room again.
+    """
+
+    def __init__(self, log_queue: "queue.Queue", block: bool = False) -> None:
+        """
+        :param log_queue: bounded queue.Queue
+        :param block: wait for room in the queue instead of dropping records
+        """
+        super(DroppingQueueHandler, self).__init__(log_queue)
+        self.block = block
+        self.dropped = 0  # in total
+        self._unreported = 0
+        self._lock = threading.Lock()
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.block:
+            self.queue.put(record)  # type: ignore
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                self._unreported += 1
+            return
+        if self._unreported:
+            with self._lock:
+                count, self._unreported = self._unreported, 0
+            if count:
+                self._report_dropped(record, count)
+
+    def _report_dropped(self, record: logging.LogRecord, count: int) -> None:
+        warning = logging.makeLogRecord(
+            {
+                "name": record.name,
+                "levelno": logging.WARNING,
+                "levelname": logging.getLevelName(logging.WARNING),
+                "msg": "{} log records were dropped, the log queue was full".format(count),
+            }
+        )
+        try:
+            self.queue.put_nowait(warning)
+        except queue.Full:
+            with self._lock:
+                self._unreported += count
+
+
+class _QueueListener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)  # type: ignore  # wait for room instead of failing on a full queue
+
+
+# the queue handler and listener installed by setup_logger(queue_size=...)
+_queue_logging: Optional[Tuple[logging.Logger, DroppingQueueHandler, _QueueListener]] = None
+_queue_logging_lock = threading.Lock()
+
+
+def _start_queue_logging(log: logging.Logger, queue_size: int, block: bool) -> DroppingQueueHandler:
+    """Move the handlers of the logger behind a queue that a background thread empties"""
+    global _queue_logging
+    handlers: List[logging.Handler] = list(log.handlers)
+    for handler in handlers:
+        log.removeHandler(handler)
+    log_queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+    queue_handler = DroppingQueueHandler(log_queue, block=block)
+    listener = _QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    log.addHandler(queue_handler)
+    _queue_logging = (log, queue_handler, listener)
+    return queue_handler
+
+
+def stop_queue_logging() -> None:
+    """
+    Write out all queued log records, stop the background thread and attach its handlers to the logger again.
+    Called at exit and whenever setup_logger() runs again.
+    """
+    global _queue_logging
+    with _queue_logging_lock:
+        if _queue_logging is None:
+            return
+        log, queue_handler, listener = _queue_logging
+        _queue_logging = None
+        log.removeHandler(queue_handler)
+        listener.stop()  # processes the records still in the queue
+        for handler in listener.handlers:
+            log.addHandler(handler)
+
+
+atexit.register(stop_queue_logging)
+
+# the sampler installed by setup_logger(sampler=...)
+_sampler: Optional[LogSampler] = None
+
+
+def _flush_sampler() -> None:
+    if _sampler is not None:
+        _sampler.flush()
+
+
+atexit.register(_flush_sampler)  # runs before stop_queue_logging (last registered, first called)
+
+
+def _reset_filters(log: logging.Logger) -> None:
+    """Remove the filters of a previous setup_logger(), logging what its sampler still holds back"""
+    global _sampler
+    _flush_sampler()
+    _sampler = None
+    for log_filter in [f for f in log.filters if isinstance(f, (LogSampler, LogContextFilter))]:
+        log.removeFilter(log_filter)
 
 
 def _set_log_format(color: bool, include_caller: bool) -> str:
@@ -48,6 +388,10 @@ def setup_logger(
     backup_count: int = 20,
     log_level: Any = logging.INFO,
     include_caller: bool = True,
+    queue_size: int = None,
+    block_when_full: bool = False,
+    json_format: bool = False,
+    sampler: LogSampler = None,
 ) -> None:
     """
     Setup logzero logger. if logfile is specified, create additional file logger
@@ -55,18 +399,42 @@ def setup_logger(
     :param backup_count: number of rotating files
     :param log_level: min. log level FOR FILE LOGGING
     :param include_caller: whether to include the caller in the log output to STDOUT, e.g. [script:123]
+    :param queue_size: if set, log calls only put records into a queue of this size,
+                       a background thread formats and writes them (see stop_queue_logging())
+    :param block_when_full: wait for room in a full queue instead of dropping records
+    :param json_format: write JSON lines (see JsonFormatter) with the correlation fields of log_context()
+    :param sampler: LogSampler to thin out DEBUG / INFO records of hot loops
     """
-    formatter = logzero.LogFormatter(
-        fmt=_set_log_format(color=True, include_caller=include_caller),
-        datefmt="%Y-%m-%d %H:%M:%S",
-    )
-    logzero.setup_default_logger(formatter=formatter)
+    global _sampler
+    import logzero  # on first use, to keep `import dhis2` fast
 
-    if logfile:
+    if queue_size is not None and queue_size < 1:
+        raise ClientException("`queue_size` must be > 0")
+    _reset_filters(logzero.logger)
+    stop_queue_logging()
+
+    formatter: logging.Formatter
+    if json_format:
+        formatter = JsonFormatter()
+    else:
         formatter = logzero.LogFormatter(
-            fmt=_set_log_format(color=False, include_caller=True),
+            fmt=_set_log_format(color=True, include_caller=include_caller),
             datefmt="%Y-%m-%d %H:%M:%S",
         )
+    logzero.setup_default_logger(formatter=formatter)
+    # logger filters run in the logging thread, i.e. before records are queued
+    if sampler is not None:
+        _sampler = sampler
+        logzero.logger.addFilter(sampler)
+    if json_format:
+        logzero.logger.addFilter(LogContextFilter())
+
+    if logfile:
+        if not json_format:
+            formatter = logzero.LogFormatter(
+                fmt=_set_log_format(color=False, include_caller=True),
+                datefmt="%Y-%m-%d %H:%M:%S",
+            )
         logzero.logfile(
             logfile,
             formatter=formatter,
@@ -74,3 +442,7 @@ def setup_logger(
             maxBytes=int(1e7),
             backupCount=backup_count,
         )
+
+    if queue_size is not None:
+        with _queue_logging_lock:
+            _start_queue_logging(logzero.logger, queue_size, block_when_full)
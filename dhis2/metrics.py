@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+
+"""
+dhis2.metrics
+~~~~~~~~~~~~~
+
+This module implements request hooks and request metrics (latency histograms, bytes, status codes)
+with exporters for Prometheus and a summary table.
+"""
+
+import bisect
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from .utils import _atomic_write
+
+_UID = re.compile(r"^[A-Za-z][A-Za-z0-9]{10}$")
+# resource names that are as long as a UID, e.g. schemas/dataElement or periodTypes
+_CAMEL_CASE_WORD = re.compile(r"^[a-z]+(?:[A-Z][a-z]+)*$")
+
+# upper bounds in seconds, like the Prometheus client defaults
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+@lru_cache(maxsize=4096)
+def endpoint_template(endpoint: str) -> str:
+    """
+    Collapse UIDs and numeric ids of an endpoint, so that metrics can be grouped by it
+    e.g. 'organisationUnits/Rp268JB6Ne4' -> 'organisationUnits/{uid}'
+    :param endpoint: DHIS2 API endpoint
+    :return: endpoint template
+    """
+    segments = endpoint.strip("/").split("/")
+    for i, segment in enumerate(segments[1:], start=1):
+        if segment.isdigit():
+            segments[i] = "{id}"
+        elif _UID.match(segment) and not _CAMEL_CASE_WORD.match(segment):
+            segments[i] = "{uid}"
+    return "/".join(segments)
+
+
+class RequestRecord(object):
+    """Everything known about one API request, handed to the request hooks"""
+
+    __slots__ = (
+        "method",
+        "endpoint",
+        "template",
+        "url",
+        "params",
+        "started",
+        "queued",
+        "duration",
+        "elapsed",
+        "decode",
+        "status_code",
+        "bytes_out",
+        "bytes_in",
+        "retries",
+        "error",
+        "headers",
+        "context",
+    )
+
+    def __init__(self, method: str, endpoint: str, url: str, params: Any = None) -> None:
+        self.method = method.upper()
+        self.endpoint = endpoint
+        self.template = endpoint_template(endpoint)
+        self.url = url
+        self.params = params
+        self.started = time.perf_counter()
+        self.queued = 0.0  # seconds spent in before_request hooks, e.g. waiting for a Throttle
+        self.duration = 0.0  # seconds for the whole call incl. downloading the body
+        self.elapsed = 0.0  # seconds until the response headers arrived (connect + server time)
+        self.decode = 0.0  # seconds to decode the JSON body, if decoded by dhis2.py
+        self.status_code: Optional[int] = None
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.retries = 0
+        self.error: Optional[BaseException] = None
+        self.headers: Optional[Mapping[str, str]] = None  # response headers
+        self.context: Dict[str, Any] = {}  # free-form, e.g. page number or chunk index
+
+    def __repr__(self) -> str:
+        return "RequestRecord({} {} -> {}, {:.3f}s)".format(
+            self.method, self.template, self.status_code, self.duration
+        )
+
+
+class RequestHook(object):
+    """
+    Base class for request hooks, register them with Api.add_request_hook().
+    Hooks are called synchronously in the thread doing the request and should be fast.
+    """
+
+    def before_request(self, record: RequestRecord) -> None:
+        """Called before the request is sent"""
+
+    def after_request(self, record: RequestRecord) -> None:
+        """Called after the response arrived (also for error responses and connection errors)"""
+
+    def after_decode(self, record: RequestRecord) -> None:
+        """Called after dhis2.py decoded the JSON body of a response (`record.decode`)"""
+
+
+class Histogram(object):
+    """Cumulative histogram with fixed buckets"""
+
+    __slots__ = ("buckets", "counts", "count", "sum", "max")
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by interpolating within its bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, count in enumerate(self.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.max
+            if count and seen + count >= rank:
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+            lower = upper
+        return self.max  # pragma: no cover
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+
+class _EndpointStats(object):
+    __slots__ = ("latency", "decode", "statuses", "errors", "bytes_out", "bytes_in", "retries")
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.latency = Histogram(buckets)
+        self.decode = Histogram(buckets)
+        self.statuses: Dict[str, int] = {}
+        self.errors = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.retries = 0
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RequestMetrics(RequestHook):
+    """
+    Collect per-endpoint request metrics: latency histograms, JSON decode time,
+    status codes, bytes sent / received and retries.
+
+    Usage:
+
+    metrics = RequestMetrics()
+    api.add_request_hook(metrics)
+    ...
+    print(metrics.summary_table())
+    metrics.write_prometheus('/var/lib/node_exporter/dhis2.prom')
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS, namespace: str = "dhis2") -> None:
+        """
+        :param buckets: histogram bucket upper bounds in seconds
+        :param namespace: prefix of the Prometheus metric names
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.namespace = namespace
+        self._stats: Dict[Tuple[str, str], _EndpointStats] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, record: RequestRecord) -> _EndpointStats:
+        key = (record.method, record.template)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats.setdefault(key, _EndpointStats(self.buckets))
+        return stats
+
+    def after_request(self, record: RequestRecord) -> None:
+        status = str(record.status_code) if record.status_code is not None else "error"
+        with self._lock:
+            stats = self._get(record)
+            stats.latency.observe(record.duration)
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            if record.error is not None or (record.status_code or 0) >= 400:
+                stats.errors += 1
+            stats.bytes_out += record.bytes_out
+            stats.bytes_in += record.bytes_in
+            stats.retries += record.retries
+
+    def after_decode(self, record: RequestRecord) -> None:
+        with self._lock:
+            self._get(record).decode.observe(record.decode)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats = {}
+
+    def snapshot(self) -> Dict[Tuple[str, str], dict]:
+        """
+        :return: dict of (method, endpoint template) -> dict of metrics
+        """
+        with self._lock:
+            return {
+                key: {
+                    "count": s.latency.count,
+                    "errors": s.errors,
+                    "statuses": dict(s.statuses),
+                    "seconds": s.latency.sum,
+                    "mean": s.latency.mean,
+                    "p50": s.latency.quantile(0.5),
+                    "p95": s.latency.quantile(0.95),
+                    "max": s.latency.max,
+                    "decodeSeconds": s.decode.sum,
+                    "bytesOut": s.bytes_out,
+                    "bytesIn": s.bytes_in,
+                    "retries": s.retries,
+                }
+                for key, s in self._stats.items()
+            }
+
+    def summary_table(self) -> str:
+        """
+        :return: a text table of all endpoints, slowest (by total time) first
+        """
+        header = ("method", "endpoint", "count", "errors", "p50 ms", "p95 ms", "max ms", "decode ms", "KB out", "KB in")
+        rows = [header]
+        snapshot = sorted(self.snapshot().items(), key=lambda item: -item[1]["seconds"])
+        for (method, template), m in snapshot:
+            rows.append(
+                (
+                    method,
+                    template,
+                    str(m["count"]),
+                    str(m["errors"]),
+                    "{:.1f}".format(m["p50"] * 1000),
+                    "{:.1f}".format(m["p95"] * 1000),
+                    "{:.1f}".format(m["max"] * 1000),
+                    "{:.1f}".format(m["decodeSeconds"] * 1000),
+                    "{:.1f}".format(m["bytesOut"] / 1024),
+                    "{:.1f}".format(m["bytesIn"] / 1024),
+                )
+            )
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        lines = []
+        for row in rows:
+            cells = [
+                cell.ljust(widths[i]) if i < 2 else cell.rjust(widths[i])
+                for i, cell in enumerate(row)
+            ]
+            lines.append("  ".join(cells).rstrip())
+        return "\n".join(lines)
+
+    def to_prometheus(self) -> str:
+        """
+        :return: all metrics in the Prometheus text exposition format
+        """
+        ns = self.namespace
+        lines: List[str] = []
+        with self._lock:
+            items = sorted(self._stats.items())
+
+            def header(name: str, kind: str, text: str) -> None:
+                lines.append("# HELP {}_{} {}".format(ns, name, text))
+                lines.append("# TYPE {}_{} {}".format(ns, name, kind))
+
+            def histogram(name: str, attr: str) -> None:
+                for (method, template), s in items:
+                    h = getattr(s, attr)
+                    labels = 'method="{}",endpoint="{}"'.format(method, _escape_label(template))
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + (float("inf"),), h.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append('{}_{}_bucket{{{},le="{}"}} {}'.format(ns, name, labels, le, cumulative))
+                    lines.append("{}_{}_sum{{{}}} {}".format(ns, name, labels, repr(h.sum)))
+                    lines.append("{}_{}_count{{{}}} {}".format(ns, name, labels, h.count))
+
+            def counter(name: str, attr: str) -> None:
+                for (method, template), s in items:
+                    labels = 'method="{}",endpoint="{}"'.format(method, _escape_label(template))
+                    lines.append("{}_{}{{{}}} {}".format(ns, name, labels, getattr(s, attr)))
+
+            header("request_duration_seconds", "histogram", "Duration of DHIS2 API requests")
+            histogram("request_duration_seconds", "latency")
+            header("json_decode_seconds", "histogram", "Duration of decoding JSON responses")
+            histogram("json_decode_seconds", "decode")
+            header("requests_total", "counter", "DHIS2 API requests by status code")
+            for (method, template), s in items:
+                for status, count in sorted(s.statuses.items()):
+                    lines.append(
+                        '{}_requests_total{{method="{}",endpoint="{}",status="{}"}} {}'.format(
+                            ns, method, _escape_label(template), status, count
+                        )
+                    )
+            header("request_bytes_sent_total", "counter", "Bytes of request bodies")
+            counter("request_bytes_sent_total", "bytes_out")
+            header("response_bytes_received_total", "counter", "Bytes of response bodies")
+            counter("response_bytes_received_total", "bytes_in")
+            header("request_retries_total", "counter", "Retries done by the HTTP adapter")
+            counter("request_retries_total", "retries")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str) -> None:
+        """
+        Atomically write the metrics to a file, e.g. for the node_exporter textfile collector
+        :param path: file path, should end with .prom
+        """
+        _atomic_write(path, self.to_prometheus())
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+"""
+dhis2.planner
+~~~~~~~~~~~~~
+
+This module plans the import of a metadata payload of many types: objects are ordered by the references between
+them and split into partitions that can be imported in parallel within each dependency level.
+"""
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Sequence, Tuple, Union
+
+from .exceptions import ClientException, RequestException
+from .importer import ImportReport
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .api import Api
+
+# properties that are not followed when looking for references: they point to users, not to imported metadata
+IGNORED_REFERENCES = frozenset(
+    ("createdBy", "lastUpdatedBy", "user", "sharing", "userAccesses", "userGroupAccesses")
+)
+
+
+def _references(obj: dict, ignore: frozenset) -> Iterator[str]:
+    """Yield the UIDs of all objects referenced (at any depth) by an object, e.g. {"categoryCombo": {"id": ...}}"""
+    stack: List[Any] = [value for key, value in obj.items() if key != "id" and key not in ignore]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            uid = value.get("id")
+            if isinstance(uid, str):
+                yield uid
+            stack.extend(v for k, v in value.items() if k not in ignore)
+        elif isinstance(value, list):
+            stack.extend(value)
+
+
+def _strongly_connected(edges: Sequence[Sequence[int]]) -> List[List[int]]:
+    """
+    Tarjan's algorithm without recursion (dependency chains can be long, e.g. org unit hierarchies)
+    :param edges: node -> nodes it depends on
+    :return: strongly connected components, every component after the components it depends on
+    """
+    index: List[int] = [-1] * len(edges)
+    low: List[int] = [0] * len(edges)
+    on_stack: List[bool] = [False] * len(edges)
+    stack: List[int] = []
+    components: List[List[int]] = []
+    counter = 0
+    for root in range(len(edges)):
+        if index[root] != -1:
+            continue
+        work: List[Tuple[int, int]] = [(root, 0)]
+        while work:
+            node, position = work.pop()
+            if position == 0:
+                index[node] = low[node] = counter
+                counter += 1
+                stack.append(node)
+                on_stack[node] = True
+            descended = False
+            for i in range(position, len(edges[node])):
+                target = edges[node][i]
+                if index[target] == -1:
+                    work.append((node, i + 1))
+                    work.append((target, 0))
+                    descended = True
+                    break
+                if on_stack[target]:
+                    low[node] = min(low[node], index[target])
+            if descended:
+                continue
+            if low[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(sorted(component))
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+    return components
+
+
+class ImportPlan(object):
+    """
+    Partitions of a metadata payload by dependency level: the partitions of a level only reference objects
+    of earlier levels (or objects on the server) and can be imported in parallel.
+    Objects that reference each other in a cycle are kept in one partition.
+    """
+
+    def __init__(self, levels: List[List[dict]], type_order: List[str], cycles: List[List[str]]) -> None:
+        """
+        :param levels: per level, the payloads of its partitions, e.g. {"categoryCombos": [...]}
+        :param type_order: metadata types, each after the types it references
+        :param cycles: UIDs of objects that reference each other
+        """
+        self.levels = levels
+        self.type_order = type_order
+        self.cycles = cycles
+
+    @property
+    def partitions(self) -> int:
+        """Number of partitions of all levels"""
+        return sum(len(level) for level in self.levels)
+
+    def __iter__(self) -> Iterator[dict]:
+        """All partitions in an order that can be imported one after the other"""
+        for level in self.levels:
+            yield from level
+
+    def __repr__(self) -> str:
+        return "ImportPlan(levels={}, partitions={}, cycles={})".format(
+            len(self.levels), self.partitions, len(self.cycles)
+        )
+
+
+def _chunks(objects: List[dict], thresh: int) -> Iterator[List[dict]]:
+    iterator = iter(objects)
+    chunk = list(islice(iterator, thresh))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, thresh))
+
+
+def plan_metadata_import(
+    payload: dict, thresh: int = 1000, ignore: Iterable[str] = IGNORED_REFERENCES
+) -> ImportPlan:
+    """
+    Plan the import of a metadata payload with many types, e.g. a metadata export
+    :param payload: e.g. {"categoryCombos": [...], "dataElements": [...]}, values that are not lists are left out
+    :param thresh: maximum number of objects per partition (objects of a reference cycle are never split)
+    :param ignore: properties whose references are not followed
+    :return: ImportPlan
+    """
+    if not isinstance(payload, dict):
+        raise ClientException("`payload` must be a dict of metadata types, e.g. {'dataElements': [...]}")
+    if not isinstance(thresh, int) or thresh < 1:
+        raise ClientException("`thresh` must be a positive integer")
+    ignored = frozenset(ignore)
+
+    types: List[str] = []
+    objects: List[dict] = []
+    by_uid: Dict[str, int] = {}
+    for key, values in payload.items():
+        if not isinstance(values, list):
+            continue
+        for obj in values:
+            if not isinstance(obj, dict):
+                raise ClientException("Not a metadata object in `{}`: {!r}".format(key, obj))
+            uid = obj.get("id")
+            if isinstance(uid, str):
+                if uid in by_uid:
+                    raise ClientException("Duplicate UID in payload: {}".format(uid))
+                by_uid[uid] = len(objects)
+            types.append(key)
+            objects.append(obj)
+
+    edges: List[List[int]] = []
+    for node, obj in enumerate(objects):
+        targets = {by_uid[uid] for uid in _references(obj, ignored) if uid in by_uid}
+        targets.discard(node)
+        edges.append(sorted(targets))
+
+    components = _strongly_connected(edges)
+    component_of = [0] * len(objects)
+    for i, component in enumerate(components):
+        for node in component:
+            component_of[node] = i
+    level_of: List[int] = []
+    for i, component in enumerate(components):  # dependencies come first
+        deps = {component_of[t] for node in component for t in edges[node]} - {i}
+        level_of.append(1 + max(level_of[d] for d in deps) if deps else 0)
+
+    grouped: Dict[int, Dict[str, List[Tuple[int, dict]]]] = defaultdict(lambda: defaultdict(list))
+    levels: List[List[dict]] = [[] for _ in range(max(level_of) + 1 if level_of else 0)]
+    cycles: List[List[str]] = []
+    for i, component in enumerate(components):
+        if len(component) == 1:
+            node = component[0]
+            grouped[level_of[i]][types[node]].append((node, objects[node]))
+            continue
+        cycle: Dict[str, List[dict]] = defaultdict(list)
+        for node in component:
+            cycle[types[node]].append(objects[node])
+        levels[level_of[i]].append(dict(cycle))
+        cycles.append([objects[node]["id"] for node in component])  # referenced, so they have one
+    for level, by_type in grouped.items():
+        for key in sorted(by_type):
+            ordered = [obj for _, obj in sorted(by_type[key], key=lambda item: item[0])]
+            levels[level].extend({key: chunk} for chunk in _chunks(ordered, thresh))
+
+    return ImportPlan(levels, _type_order(types, edges), cycles)
+
+
+def _type_order(types: List[str], edges: List[List[int]]) -> List[str]:
+    """:return: metadata types, each after the types its objects reference (types in a cycle next to each other)"""
+    names = sorted(set(types))
+    position = {name: i for i, name in enumerate(names)}
+    type_edges: List[set] = [set() for _ in names]
+    for node, targets in enumerate(edges):
+        for target in targets:
+            if types[target] != types[node]:
+                type_edges[position[types[node]]].add(position[types[target]])
+    components = _strongly_connected([sorted(t) for t in type_edges])
+    return [names[i] for component in components for i in component]
+
+
+def import_metadata_plan(
+    api: "Api",
+    plan: Union[ImportPlan, dict],
+    params: Union[dict, List[tuple]] = None,
+    max_workers: int = 4,
+    thresh: int = 1000,
+    stop_on_error: bool = True,
+) -> ImportReport:
+    """
+    Import the partitions of a plan level by level, the partitions of a level in parallel
+    :param api: Api instance
+    :param plan: ImportPlan or a metadata payload to plan (see plan_metadata_import)
+    :param params: request parameters of the metadata endpoint, e.g. {"importStrategy": "CREATE_AND_UPDATE"}
+    :param max_workers: maximum concurrent requests
+    :param thresh: partition size when `plan` is a payload
+    :param stop_on_error: don't import the next levels after a partition failed, they probably reference its objects
+    :return: ImportReport of all imported partitions, the chunk index is the partition's index in the plan
+    """
+    if not isinstance(max_workers, int) or max_workers < 1:
+        raise ClientException("`max_workers` must be a positive integer")
+    if not isinstance(plan, ImportPlan):
+        plan = plan_metadata_import(plan, thresh=thresh)
+
+    def post(partition: dict) -> Any:
+        try:
+            return api.post("metadata", json=partition, params=params)
+        except RequestException as e:
+            return e
+
+    report = ImportReport()
+    chunk_index = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for level in plan.levels:
+            for partition, response in zip(level, executor.map(post, level)):
+                report.add_response(response, chunk_index, sum(len(objs) for objs in partition.values()))
+                chunk_index += 1
+            if stop_on_error and (report.errors or report.statuses["ERROR"]):
+                break
+    report.finish()
+    return report
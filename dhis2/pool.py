@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""
+dhis2.pool
+~~~~~~~~~~
+
+This module provides a pool of long-lived Api instances, one per profile of a multi-profile auth file,
+to be shared across the threads of a process.
+"""
+
+import threading
+from typing import Dict, List, Optional
+
+from requests.adapters import HTTPAdapter
+
+from .api import Api
+from .exceptions import ClientException
+from .utils import load_auth_profiles, search_auth_file, select_auth_profile
+
+
+class ApiPool(object):
+    """
+    Hands out one Api per profile, created on first use and kept for the life of the pool:
+    its session (and with it the connections to the server) is reused and `system/info` is requested only once.
+    Api instances can be shared across threads.
+
+    pool = ApiPool.from_auth_file()
+    pool.get('prod').get_paged('dataElements')
+    """
+
+    def __init__(
+        self,
+        profiles: Dict[str, dict],
+        default: Optional[str] = None,
+        warm: bool = True,
+        pool_maxsize: Optional[int] = None,
+        location: str = "profiles",
+    ) -> None:
+        """
+        :param profiles: profile name -> {"baseurl", "username", "password"[, "api_version", "user_agent"]}
+        :param default: profile used when none is given
+        :param warm: request `system/info` when an Api is created, so that it's cached and the connection is open
+        :param pool_maxsize: connections kept per server, the requests default is 10 - raise it when more threads share an Api
+        :param location: where the profiles come from, for error messages
+        """
+        if not profiles:
+            raise ClientException("No auth profiles")
+        if default is not None and default not in profiles:
+            raise ClientException("Default auth profile '{}' not found in {}".format(default, location))
+        if pool_maxsize is not None and pool_maxsize < 1:
+            raise ClientException("`pool_maxsize` must be > 0")
+        self._profiles = dict(profiles)
+        self.default = default
+        self.warm = warm
+        self.pool_maxsize = pool_maxsize
+        self.location = location
+        self._apis: Dict[str, Api] = {}
+        self._locks: Dict[str, threading.Lock] = {name: threading.Lock() for name in self._profiles}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_auth_file(cls, location: Optional[str] = None, **kwargs) -> "ApiPool":
+        """
+        :param location: auth file path, searched like Api.from_auth_file when not specified
+        :param kwargs: see ApiPool
+        :return: ApiPool with the profiles of the auth file
+        """
+        location = search_auth_file() if not location else location
+        profiles, default = load_auth_profiles(location)
+        return cls(profiles, default=default, location=location, **kwargs)
+
+    @property
+    def profiles(self) -> List[str]:
+        """Names of all profiles"""
+        return sorted(self._profiles)
+
+    def get(self, profile: Optional[str] = None) -> Api:
+        """
+        :param profile: profile name, None for the default profile
+        :return: the Api of the profile
+        """
+        name, section = select_auth_profile(self._profiles, self.default, profile, self.location)
+        api = self._apis.get(name)
+        if api is not None:
+            return api
+        with self._locks[name]:  # other profiles are not blocked while this one connects
+            api = self._apis.get(name)
+            if api is None:
+                api = self._create(section)
+                with self._lock:
+                    self._apis[name] = api
+        return api
+
+    __getitem__ = get
+
+    def _create(self, section: dict) -> Api:
+        # optional keys of the profile, left to the defaults of Api when missing
+        options = {key: section[key] for key in ("api_version", "user_agent") if section.get(key)}
+        api = Api(section["baseurl"], section["username"], section["password"], **options)
+        if self.pool_maxsize:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+            api.session.mount("https://", adapter)
+            api.session.mount("http://", adapter)
+        if self.warm:
+            try:
+                api.get_info()
+            except Exception:
+                api.session.close()
+                raise
+        return api
+
+    def close(self, profile: Optional[str] = None) -> None:
+        """
+        Close the session of a profile's Api (or of all), the next get() creates a new Api
+        :param profile: profile name, None for all
+        """
+        with self._lock:
+            names = [profile] if profile else list(self._apis)
+            apis = [self._apis.pop(name) for name in names if name in self._apis]
+        for api in apis:
+            api.session.close()
+
+    def __enter__(self) -> "ApiPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __contains__(self, profile: str) -> bool:
+        return profile in self._profiles
+
+    def __repr__(self) -> str:
+        return "ApiPool(profiles={}, open={})".format(self.profiles, sorted(self._apis))
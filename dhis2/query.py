@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+
+"""
+dhis2.query
+~~~~~~~~~~~
+
+This module provides a builder for the `fields`, `filter` and `order` parameters of metadata requests,
+checked against the server's schemas, so that responses contain only what is needed.
+"""
+
+import difflib
+import json
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from .exceptions import ClientException
+from .utils import _atomic_write
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .api import Api
+
+FILTER_OPERATORS = frozenset(
+    "eq !eq ieq ne gt ge lt le like !like $like !$like like$ !like$ ilike !ilike $ilike !$ilike ilike$ !ilike$ "
+    "in !in token !token null !null empty".split()
+)
+NO_VALUE_OPERATORS = frozenset(("null", "!null", "empty"))
+ORDER_DIRECTIONS = ("asc", "desc", "iasc", "idesc")
+
+# properties of the schemas endpoint needed to check queries and payloads (see dhis2.validation)
+SCHEMA_FIELDS = (
+    "plural,klass,properties[name,fieldName,collectionName,collection,klass,itemKlass,propertyType,"
+    "itemPropertyType,required,min,max,constants,persisted,embeddedObject]"
+)
+
+NestedFields = Union[str, List[Any], Dict[str, Any]]
+
+
+class _Field(object):
+    """A node of a `fields` selection, e.g. categoryCombo~rename(cc)[id,name]"""
+
+    __slots__ = ("name", "transformers", "children")
+
+    def __init__(self, name: str, transformers: List[str] = None, children: List["_Field"] = None) -> None:
+        self.name = name
+        self.transformers = transformers or []
+        self.children = children
+
+    def __str__(self) -> str:
+        text = "".join([self.name] + ["~" + t for t in self.transformers])
+        if self.children is not None:
+            text += "[{}]".format(",".join(str(c) for c in self.children))
+        return text
+
+
+def _split_top_level(text: str) -> List[str]:
+    """Split at commas outside of [...] and (...)"""
+    parts, depth, start = [], 0, 0
+    for i, char in enumerate(text):
+        if char in "[(":
+            depth += 1
+        elif char in "])":
+            depth -= 1
+            if depth < 0:
+                raise ClientException("Unbalanced brackets in fields: {}".format(text))
+        elif char == "," and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    if depth:
+        raise ClientException("Unbalanced brackets in fields: {}".format(text))
+    parts.append(text[start:])
+    return [p.strip() for p in parts if p.strip()]
+
+
+def parse_fields(text: str) -> List[_Field]:
+    """
+    Parse a DHIS2 `fields` parameter
+    :param text: e.g. "id,name~rename(label),categoryCombo[id,categories[id]]"
+    :return: field nodes
+    """
+    fields: List[_Field] = []
+    for part in _split_top_level(text):
+        children: Optional[List[_Field]] = None
+        bracket = part.find("[")
+        if bracket != -1:
+            if not part.endswith("]"):
+                raise ClientException("Invalid field selection: {}".format(part))
+            children = parse_fields(part[bracket + 1 : -1])
+            part = part[:bracket]
+        name, *transformers = part.split("~")
+        if not name or not all(transformers):
+            raise ClientException("Invalid field selection: {}".format(part))
+        fields.append(_Field(name, transformers, children))
+    return fields
+
+
+def _nested_fields(value: NestedFields) -> List[_Field]:
+    """Fields from a keyword argument of Query.fields(): a fields string, a list of them or a dict"""
+    if isinstance(value, str):
+        return parse_fields(value)
+    if isinstance(value, dict):
+        return _keyword_fields(value)
+    if isinstance(value, (list, tuple)):
+        return [f for item in value for f in _nested_fields(item)]
+    raise ClientException("Invalid field selection: {!r}".format(value))
+
+
+def _keyword_fields(nested: Dict[str, NestedFields]) -> List[_Field]:
+    fields: List[_Field] = []
+    for key, value in nested.items():
+        head = parse_fields(key)
+        if len(head) != 1 or head[0].children is not None:
+            raise ClientException("Invalid field selection: {}".format(key))
+        head[0].children = _nested_fields(value)
+        fields.append(head[0])
+    return fields
+
+
+def _format_value(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return "[{}]".format(",".join(_format_value(v) for v in value))
+    return str(value)
+
+
+class Schemas(object):
+    """The properties of every schema of a server, by schema (plural name, e.g. dataElements)"""
+
+    def __init__(self, schemas: List[dict]) -> None:
+        """
+        :param schemas: the "schemas" list of the schemas endpoint
+        """
+        self._by_plural: Dict[str, Dict[str, Optional[str]]] = {}
+        self._by_klass: Dict[str, Dict[str, Optional[str]]] = {}
+        self._schemas: Dict[str, dict] = {s["plural"]: s for s in schemas if s.get("plural")}
+        for schema in schemas:
+            properties: Dict[str, Optional[str]] = {}
+            for p in schema.get("properties", []):
+                target = p.get("itemKlass") if p.get("collection") else p.get("klass")
+                for key in ("name", "fieldName", "collectionName"):
+                    if p.get(key):
+                        properties[p[key]] = target
+            if not properties:  # nothing to check against
+                continue
+            if schema.get("plural"):
+                self._by_plural[schema["plural"]] = properties
+            if schema.get("klass"):
+                self._by_klass[schema["klass"]] = properties
+
+    def properties(self, plural: str) -> Optional[Dict[str, Optional[str]]]:
+        """:return: property name -> class of its objects, None if there is no such schema"""
+        return self._by_plural.get(plural)
+
+    def of_class(self, klass: Optional[str]) -> Optional[Dict[str, Optional[str]]]:
+        """:return: the properties of the schema of a (nested) object class, None if it has none"""
+        return self._by_klass.get(klass) if klass else None
+
+    def schema(self, plural: str) -> Optional[dict]:
+        """:return: the schema as received from the server, None if there is no such schema"""
+        return self._schemas.get(plural)
+
+
+class SchemaCache(object):
+    """
+    Keeps the schemas of every server for the life of the process and - with `path` - in a JSON file for `max_age`
+    seconds, so that short scripts don't request them every time they start.
+    """
+
+    def __init__(self, path: str = None, max_age: float = 86400.0) -> None:
+        """
+        :param path: JSON file to keep schemas in across processes, None to keep them in memory only
+        :param max_age: seconds after which schemas are requested again
+        """
+        self.path = path
+        self.max_age = max_age
+        self._schemas: Dict[str, Schemas] = {}
+        self._lock = threading.Lock()
+
+    def get(self, api: "Api") -> Schemas:
+        """
+        :param api: Api of the server
+        :return: the server's schemas, requested once
+        """
+        key = api.base_url  # type: ignore
+        with self._lock:
+            schemas = self._schemas.get(key)
+            if schemas is None:
+                schemas = self._schemas[key] = Schemas(self._load(api, key))
+        return schemas
+
+    def _load(self, api: "Api", key: str) -> List[dict]:
+        stored: Dict[str, dict] = {}
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    stored = json.load(f)
+            except ValueError:
+                stored = {}  # not valid JSON: request again
+            if not isinstance(stored, dict):
+                stored = {}  # not a schema cache either
+            entry = stored.get(key)
+            if (
+                isinstance(entry, dict)
+                and entry.get("fields") == SCHEMA_FIELDS
+                and isinstance(entry.get("fetched"), (int, float))
+                and isinstance(entry.get("schemas"), list)
+                and time.time() - entry["fetched"] < self.max_age
+            ):
+                return entry["schemas"]
+        schemas = api.get("schemas", params={"fields": SCHEMA_FIELDS}).json()["schemas"]
+        if self.path:
+            stored[key] = {"fetched": time.time(), "fields": SCHEMA_FIELDS, "schemas": schemas}
+            _atomic_write(self.path, json.dumps(stored))
+        return schemas
+
+    def clear(self) -> None:
+        """Forget the schemas kept in memory, the file is read again"""
+        with self._lock:
+            self._schemas.clear()
+
+
+DEFAULT_SCHEMA_CACHE = SchemaCache()
+
+
+def _unknown(name: str, properties: Dict[str, Optional[str]], path: str) -> str:
+    close = difflib.get_close_matches(name, properties, n=1)
+    return "'{}'{}".format(path, " (did you mean '{}'?)".format(close[0]) if close else "")
+
+
+class Query(object):
+    """
+    Builds the `fields`, `filter` and `order` parameters of a metadata request.
+    With an Api, fields and filters are checked against the server's schemas (requested once per server).
+
+    query = (
+        Query('dataElements')
+        .fields('id', 'name', categoryCombo=['id', 'name'], dataSetElements={'dataSet': 'id,name'})
+        .filter('valueType', 'eq', 'NUMBER')
+        .order('name')
+    )
+    api.get_paged(query.endpoint, params=query.params(api), page_size=1000)
+    """
+
+    def __init__(self, endpoint: str) -> None:
+        """
+        :param endpoint: DHIS2 API endpoint, e.g. dataElements or dataElements/<uid>
+        """
+        self.endpoint = endpoint
+        self._fields: List[_Field] = []
+        self._filters: List[tuple] = []
+        self._order: List[str] = []
+        self._root_junction: Optional[str] = None
+
+    @property
+    def resource(self) -> str:
+        """The collection the endpoint belongs to, e.g. dataElements"""
+        return self.endpoint.strip("/").split("/")[0].split(".")[0]
+
+    def _properties(self, schemas: Schemas) -> Tuple[str, Optional[Dict[str, Optional[str]]]]:
+        """
+        :return: the name and the properties of the endpoint's objects - for <type>/<uid>/<collection> those of the
+        collection's items, e.g. the data elements of dataSets/<uid>/dataElements - None if they have no schema
+        """
+        parts = [part.split(".")[0] for part in self.endpoint.strip("/").split("/")]
+        name, properties = self.resource, schemas.properties(self.resource)
+        for collection in parts[2::2]:
+            if properties is None:
+                break
+            name, properties = collection, schemas.of_class(properties.get(collection))
+        return name, properties
+
+    def fields(self, *fields: str, **nested: NestedFields) -> "Query":
+        """
+        Add fields to select
+        :param fields: DHIS2 field selections, e.g. "id", "name~rename(label)", ":owner", "!code", "categoryCombo[id]"
+        :param nested: nested selections, e.g. categoryCombo=["id", "name"] or dataSetElements={"dataSet": "id"}
+        :return: the query
+        """
+        for text in fields:
+            self._fields.extend(parse_fields(text))
+        self._fields.extend(_keyword_fields(nested))
+        return self
+
+    def filter(self, path: str, operator: str, value: Any = None) -> "Query":
+        """
+        Add a filter, all filters must match (or any of them, see match_any())
+        :param path: property (path), e.g. "name" or "categoryCombo.id"
+        :param operator: e.g. "eq", "ilike", "in", "null"
+        :param value: compared value, a list for "in" / "!in", None for "null", "!null" and "empty"
+        :return: the query
+        """
+        if operator not in FILTER_OPERATORS:
+            raise ClientException(
+                "Unknown filter operator '{}', use one of: {}".format(operator, ", ".join(sorted(FILTER_OPERATORS)))
+            )
+        if (value is None) != (operator in NO_VALUE_OPERATORS):
+            raise ClientException(
+                "Filter operator '{}' {}".format(operator, "takes no value" if value is not None else "needs a value")
+            )
+        self._filters.append((path, operator, value))
+        return self
+
+    def order(self, path: str, direction: str = "asc") -> "Query":
+        """
+        Add a sort order
+        :param path: property, e.g. "name"
+        :param direction: "asc", "desc" or - ignoring case - "iasc", "idesc"
+        :return: the query
+        """
+        if direction not in ORDER_DIRECTIONS:
+            raise ClientException("`direction` must be one of: {}".format(", ".join(ORDER_DIRECTIONS)))
+        self._order.append("{}:{}".format(path, direction))
+        return self
+
+    def match_any(self) -> "Query":
+        """Return objects matching any of the filters instead of all of them (rootJunction=OR)"""
+        self._root_junction = "OR"
+        return self
+
+    def validate(self, schemas: Schemas) -> "Query":
+        """
+        Check that the selected fields, filtered and ordered properties exist.
+        Endpoints without a schema (e.g. events) and objects without one aren't checked.
+        :param schemas: the server's schemas
+        :return: the query
+        """
+        name, properties = self._properties(schemas)
+        if properties is None:
+            return self
+        errors: List[str] = []
+        self._validate_fields(self._fields, properties, schemas, "", errors)
+        for path, _, _ in self._filters:
+            if path != "identifiable":  # searches id, code and name
+                self._validate_path(path.split("."), properties, schemas, errors, path)
+        for order in self._order:
+            self._validate_path([order.split(":")[0]], properties, schemas, errors, order)
+        if errors:
+            raise ClientException("Unknown properties of {}: {}".format(name, ", ".join(errors)))
+        return self
+
+    @classmethod
+    def _validate_fields(
+        cls,
+        fields: Iterable[_Field],
+        properties: Dict[str, Optional[str]],
+        schemas: Schemas,
+        prefix: str,
+        errors: List[str],
+    ) -> None:
+        for field in fields:
+            name = field.name.lstrip("!")
+            if name == "*" or name.startswith(":"):  # presets: all, :owner, :identifiable ...
+                continue
+            if name not in properties:
+                errors.append(_unknown(name, properties, prefix + name))
+                continue
+            nested = schemas.of_class(properties[name])
+            if field.children is not None and nested is not None:
+                cls._validate_fields(field.children, nested, schemas, "{}{}.".format(prefix, name), errors)
+
+    @staticmethod
+    def _validate_path(
+        names: List[str],
+        properties: Optional[Dict[str, Optional[str]]],
+        schemas: Schemas,
+        errors: List[str],
+        path: str,
+    ) -> None:
+        for name in names:
+            if properties is None:  # no schema to check the rest of the path
+                return
+            if name not in properties:
+                errors.append(_unknown(name, properties, path))
+                return
+            properties = schemas.of_class(properties[name])
+
+    def params(self, api: "Api" = None, cache: SchemaCache = None) -> Dict[str, Union[str, List[str]]]:
+        """
+        :param api: check the query against the schemas of its server
+        :param cache: SchemaCache to get the schemas from, by default one for the process
+        :return: HTTP parameters for Api.get(), get_paged() ...
+        """
+        if api is not None:
+            self.validate((cache or DEFAULT_SCHEMA_CACHE).get(api))
+        params: Dict[str, Union[str, List[str]]] = {}
+        if self._fields:
+            params["fields"] = ",".join(str(f) for f in self._fields)
+        if self._filters:
+            params["filter"] = [
+                ":".join([path, operator] + ([_format_value(value)] if value is not None else []))
+                for path, operator, value in self._filters
+            ]
+        if self._order:
+            params["order"] = ",".join(self._order)
+        if self._root_junction:
+            params["rootJunction"] = self._root_junction
+        return params
+
+    def __repr__(self) -> str:
+        return "Query({!r}, {})".format(self.endpoint, self.params())
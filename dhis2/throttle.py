@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+"""
+dhis2.throttle
+~~~~~~~~~~~~~~
+
+This module implements client-side rate limiting and a concurrency governor for API requests
+that backs off when the server is overloaded (429 / 503 responses or rising latency).
+"""
+
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from .exceptions import ClientException
+from .metrics import RequestHook, RequestRecord
+
+ENDPOINT_CLASSES = ("metadata", "tracker", "analytics", "imports")
+
+TRACKER_ENDPOINTS = frozenset(
+    ("events", "trackedEntityInstances", "enrollments", "relationships", "tracker")
+)
+IMPORT_ENDPOINTS = frozenset(
+    (
+        "metadata",
+        "dataValueSets",
+        "dataValues",
+        "completeDataSetRegistrations",
+        "events",
+        "trackedEntityInstances",
+        "enrollments",
+        "relationships",
+        "tracker",
+    )
+)
+OVERLOADED = (429, 503)
+
+
+def endpoint_class(method: str, endpoint: str) -> str:
+    """
+    Classify a request to apply a limit to
+    :param method: HTTP method
+    :param endpoint: DHIS2 API endpoint, e.g. 'analytics/dataValueSet' or 'dataValueSets'
+    :return: one of ENDPOINT_CLASSES
+    """
+    root = endpoint.strip("/").split("/")[0].split(".")[0]
+    if method.upper() != "GET" and root in IMPORT_ENDPOINTS:
+        return "imports"
+    if root.startswith("analytics"):
+        return "analytics"
+    if root in TRACKER_ENDPOINTS:
+        return "tracker"
+    return "metadata"
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket, callers reserve a token and sleep until it is available"""
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        """
+        :param rate: tokens (requests) per second
+        :param burst: bucket size, defaults to one second worth of tokens (at least 1)
+        """
+        if rate <= 0:
+            raise ClientException("`rate` must be > 0")
+        self.rate = float(rate)
+        self.capacity = float(burst) if burst else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate: float) -> None:
+        with self._lock:
+            self._refill()
+            self.rate = float(rate)
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> float:
+        """
+        Take a token, waiting for it if the bucket is empty
+        :return: seconds waited
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= 1  # may go negative: a reservation that later callers wait behind
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            self._sleep(wait)
+        return wait
+
+
+class ConcurrencyLimit(object):
+    """A semaphore whose limit can be changed while it is in use"""
+
+    def __init__(self, limit: int) -> None:
+        if limit < 1:
+            raise ClientException("`max_concurrency` must be > 0")
+        self.limit = limit
+        self.active = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self.active >= self.limit:
+                self._condition.wait()
+            self.active += 1
+
+    def release(self) -> None:
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    def set_limit(self, limit: int) -> None:
+        with self._condition:
+            self.limit = limit
+            self._condition.notify_all()
+
+
+class EndpointLimit(object):
+    """
+    Rate and concurrency limit of one endpoint class that adapts to the server:
+    when it answers 429 / 503 or responds slower than `latency_target`, rate and concurrency are halved
+    (at most once per `cooldown` seconds) and a Retry-After header pauses all requests.
+    After `recover_after` good responses in a row they grow back by 10% / 1 up to the configured values.
+    """
+
+    def __init__(
+        self,
+        rate: float = None,
+        burst: float = None,
+        max_concurrency: int = None,
+        latency_target: float = None,
+        min_rate: float = 0.2,
+        cooldown: float = 1.0,
+        recover_after: int = 10,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        """
+        :param rate: maximum requests per second, None for no rate limit
+        :param burst: requests that may be sent at once before the rate applies
+        :param max_concurrency: maximum requests in flight, None for no limit
+        :param latency_target: seconds (until response headers) above which the server is considered busy
+        :param min_rate: the rate is never lowered below this
+        :param cooldown: seconds between two consecutive back-offs
+        :param recover_after: good responses in a row before rate / concurrency are raised again
+        """
+        self.max_rate = rate
+        self.max_concurrency = max_concurrency
+        self.latency_target = latency_target
+        self.min_rate = min_rate
+        self.cooldown = cooldown
+        self.recover_after = recover_after
+        self.bucket = TokenBucket(rate, burst, clock, sleep) if rate else None
+        self.concurrency = ConcurrencyLimit(max_concurrency) if max_concurrency else None
+        self.throttled = 0  # responses that triggered a back-off
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self._last_backoff = float("-inf")
+        self._good = 0
+
+    @property
+    def rate(self) -> Optional[float]:
+        """The current rate"""
+        return self.bucket.rate if self.bucket else None
+
+    @property
+    def current_concurrency(self) -> Optional[int]:
+        return self.concurrency.limit if self.concurrency else None
+
+    def acquire(self) -> None:
+        if self.concurrency:
+            self.concurrency.acquire()
+        try:
+            pause = self._paused_until - self._clock()
+            if pause > 0:
+                self._sleep(pause)
+            if self.bucket:
+                self.bucket.acquire()
+        except BaseException:  # e.g. KeyboardInterrupt while waiting: the request is not sent
+            self.release()
+            raise
+
+    def release(self) -> None:
+        if self.concurrency:
+            self.concurrency.release()
+
+    def observe(self, status_code: Optional[int], latency: float, retry_after: Optional[str] = None) -> None:
+        """
+        Adapt the limits to a response
+        :param status_code: HTTP status code, None if the request failed
+        :param latency: seconds until the response headers arrived
+        :param retry_after: value of the Retry-After header
+        """
+        overloaded = status_code in OVERLOADED
+        slow = self.latency_target is not None and latency > self.latency_target
+        with self._lock:
+            now = self._clock()
+            if overloaded and retry_after:
+                try:
+                    self._paused_until = max(self._paused_until, now + float(retry_after))
+                except ValueError:  # an HTTP date, not worth parsing
+                    pass
+            if overloaded or slow:
+                self._good = 0
+                if now - self._last_backoff >= self.cooldown:
+                    self._last_backoff = now
+                    self.throttled += 1
+                    if self.bucket:
+                        self.bucket.set_rate(max(self.min_rate, self.bucket.rate / 2))
+                    if self.concurrency:
+                        self.concurrency.set_limit(max(1, self.concurrency.limit // 2))
+                return
+            if status_code is None:
+                return
+            self._good += 1
+            if self._good >= self.recover_after:
+                self._good = 0
+                if self.bucket and self.bucket.rate < self.max_rate:  # type: ignore
+                    self.bucket.set_rate(min(self.max_rate, self.bucket.rate * 1.1))  # type: ignore
+                if self.concurrency and self.concurrency.limit < self.max_concurrency:  # type: ignore
+                    self.concurrency.set_limit(self.concurrency.limit + 1)
+
+    def __repr__(self) -> str:
+        return "EndpointLimit(rate={}, concurrency={}, throttled={})".format(
+            self.rate, self.current_concurrency, self.throttled
+        )
+
+
+class Throttle(RequestHook):
+    """
+    Request hook that holds back requests per endpoint class (metadata, tracker, analytics, imports).
+    It applies to every request of an Api, including the concurrent helpers (e.g. export_metadata).
+
+    Usage:
+
+    api.throttle = Throttle(
+        metadata=EndpointLimit(rate=20, max_concurrency=4),
+        analytics=EndpointLimit(rate=2, max_concurrency=1, latency_target=10),
+        imports=EndpointLimit(max_concurrency=2),
+    )
+    """
+
+    def __init__(self, default: EndpointLimit = None, **limits: EndpointLimit) -> None:
+        """
+        :param default: limit of endpoint classes without their own limit, None for no limit
+        :param limits: limit per endpoint class, e.g. analytics=EndpointLimit(rate=1)
+        """
+        unknown = set(limits) - set(ENDPOINT_CLASSES)
+        if unknown:
+            raise ClientException(
+                "Unknown endpoint classes {}, use {}".format(sorted(unknown), ", ".join(ENDPOINT_CLASSES))
+            )
+        self.default = default
+        self.limits: Dict[str, EndpointLimit] = dict(limits)
+
+    def limit_for(self, method: str, endpoint: str) -> Optional[EndpointLimit]:
+        return self.limits.get(endpoint_class(method, endpoint), self.default)
+
+    def before_request(self, record: RequestRecord) -> None:
+        limit = self.limit_for(record.method, record.endpoint)
+        if limit is not None:
+            limit.acquire()
+            record.context["throttle"] = limit
+
+    def after_request(self, record: RequestRecord) -> None:
+        limit = record.context.pop("throttle", None)
+        if limit is None:
+            return
+        limit.release()
+        retry_after = record.headers.get("Retry-After") if record.headers is not None else None
+        limit.observe(record.status_code, record.elapsed, retry_after)
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+"""
+dhis2.tracing
+~~~~~~~~~~~~~
+
+This module implements lightweight, OpenTelemetry-style tracing spans
+for paged / partitioned operations and their HTTP requests.
+"""
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from .metrics import RequestHook, RequestRecord
+
+
+class Span(object):
+    """A timed operation with attributes, nested via parent_id"""
+
+    __slots__ = (
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "start",
+        "end",
+        "attributes",
+        "error",
+        "_started",
+        "_duration",
+    )
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, attributes: Optional[dict] = None) -> None:
+        self.name = name
+        self.trace_id: str = parent.trace_id if parent else "{:032x}".format(random.getrandbits(128))
+        self.span_id = "{:016x}".format(random.getrandbits(64))
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.error: Optional[str] = None
+        self._started = time.perf_counter()
+        self._duration: Optional[float] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    @property
+    def duration(self) -> float:
+        """Seconds from start to end (or until now if the span has not ended)"""
+        if self._duration is not None:
+            return self._duration
+        return time.perf_counter() - self._started
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self._duration = time.perf_counter() - self._started
+        self.end = self.start + self._duration
+        if error is not None:
+            self.error = "{}: {}".format(error.__class__.__name__, error)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentId": self.parent_id,
+            "start": self.start,
+            "end": self.end,
+            "duration": self.duration,
+            "attributes": dict(self.attributes),
+            "error": self.error,
+        }
+
+    def __repr__(self) -> str:
+        return "Span({}, {:.3f}s, {})".format(self.name, self.duration, self.attributes)
+
+
+class _NoopSpan(object):
+    """Span that records nothing, returned when tracing is disabled"""
+
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, **attributes: Any) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer(object):
+    """
+    Create spans and hand finished spans to an exporter (any object with an `export(span)` method).
+    The current span is tracked per thread, new spans are children of it.
+
+    Usage:
+
+    exporter = InMemorySpanExporter()
+    api.tracer = Tracer(exporter)
+    api.get_paged('organisationUnits', merge=True)
+    print(exporter.render())
+    """
+
+    enabled = True
+
+    def __init__(self, exporter: Any = None) -> None:
+        """
+        :param exporter: receives every finished span via exporter.export(span)
+        """
+        self.exporter = exporter
+        self._local = threading.local()
+
+    def _stack(self) -> List[Span]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current_span(self) -> Optional[Span]:
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def start_span(self, name: str, parent: Optional[Span] = None, **attributes: Any) -> Span:
+        """
+        Start a span and make it the current span of this thread
+        :param name: span name
+        :param parent: parent span, defaults to the current span
+        :param attributes: span attributes
+        :return: Span
+        """
+        span = Span(name, parent or self.current_span(), attributes)
+        self._stack().append(span)
+        return span
+
+    def end_span(self, span: Span, error: Optional[BaseException] = None) -> None:
+        """
+        End a span and export it
+        :param span: the span started with start_span()
+        :param error: the exception that ended the span, if any
+        """
+        self.deactivate(span)
+        span.finish(error)
+        if self.exporter is not None:
+            self.exporter.export(span)
+
+    def activate(self, span: Span) -> None:
+        """Make a started span the current span of this thread (again)"""
+        self._stack().append(span)
+
+    def deactivate(self, span: Span) -> None:
+        """Stop a span from being the current span without ending it"""
+        stack = self._stack()
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i] is span:
+                del stack[i]
+                return
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        """
+        Context manager for a span that ends (and records exceptions) on exit
+        :param name: span name
+        :param attributes: span attributes
+        """
+        span = self.start_span(name, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            self.end_span(span, e)
+            raise
+        else:
+            self.end_span(span)
+
+
+class NoopTracer(Tracer):
+    """Tracer that records nothing - the default of Api"""
+
+    enabled = False
+
+    def __init__(self) -> None:
+        super(NoopTracer, self).__init__(None)
+
+    def current_span(self) -> None:
+        return None
+
+    def start_span(self, name: str, parent: Optional[Span] = None, **attributes: Any) -> Any:
+        return NOOP_SPAN
+
+    def end_span(self, span: Any, error: Optional[BaseException] = None) -> None:
+        pass
+
+    def activate(self, span: Any) -> None:
+        pass
+
+    def deactivate(self, span: Any) -> None:
+        pass
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Any]:
+        yield NOOP_SPAN
+
+
+NOOP_TRACER = NoopTracer()
+
+
+class InMemorySpanExporter(object):
+    """Keep finished spans in memory, for tests and offline analysis"""
+
+    def __init__(self) -> None:
+        self._spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        with self._lock:
+            self._spans.append(span)
+
+    @property
+    def spans(self) -> List[Span]:
+        """Finished spans in the order they ended"""
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._spans = []
+
+    def find(self, name: str) -> List[Span]:
+        """:return: spans with this name"""
+        return [s for s in self.spans if s.name == name]
+
+    def children(self, span: Span) -> List[Span]:
+        """:return: direct children of a span, in the order they started"""
+        return sorted(
+            (s for s in self.spans if s.parent_id == span.span_id), key=lambda s: s.start
+        )
+
+    def to_dicts(self) -> List[dict]:
+        return [s.to_dict() for s in self.spans]
+
+    def render(self) -> str:
+        """:return: an indented text tree of all spans with durations and attributes"""
+        spans = sorted(self.spans, key=lambda s: s.start)
+        ids = {s.span_id for s in spans}
+        lines: List[str] = []
+
+        def walk(span: Span, depth: int) -> None:
+            attributes = " ".join("{}={}".format(k, v) for k, v in sorted(span.attributes.items()))
+            lines.append(
+                "{}{} {:.1f}ms {}{}".format(
+                    "  " * depth,
+                    span.name,
+                    span.duration * 1000,
+                    attributes,
+                    " ERROR {}".format(span.error) if span.error else "",
+                ).rstrip()
+            )
+            for child in self.children(span):
+                walk(child, depth + 1)
+
+        for span in spans:
+            if span.parent_id not in ids:
+                walk(span, 0)
+        return "\n".join(lines)
+
+
+class TracingHook(RequestHook):
+    """Request hook that records a child span for every HTTP request"""
+
+    def __init__(self, tracer: Tracer) -> None:
+        self.tracer = tracer
+
+    def before_request(self, record: RequestRecord) -> None:
+        span = self.tracer.start_span("HTTP {} {}".format(record.method, record.template))
+        span.set_attributes(**{"http.method": record.method, "dhis2.endpoint": record.template})
+        record.context["span"] = span
+
+    def after_request(self, record: RequestRecord) -> None:
+        span = record.context.pop("span", None)
+        if span is None:
+            return
+        span.set_attributes(
+            **{
+                "http.status_code": record.status_code,
+                "http.request_bytes": record.bytes_out,
+                "http.response_bytes": record.bytes_in,
+                "http.retries": record.retries,
+            }
+        )
+        self.tracer.end_span(span, record.error)
@@ -7,25 +7,300 @@ dhis2.utils
 This module provides utility functions that are used within dhis2.py
 """
 
-from csv import DictReader
+import csv
+import importlib
 import json
+import locale
 import os
 import re
 import random
 import string
-from typing import Collection, Optional, Union, Generator
+from contextlib import contextmanager
+from itertools import islice
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Collection,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 from pathlib import Path
 
-from pygments import highlight
-from pygments.lexers.data import JsonLexer
-from pygments.formatters.terminal import TerminalFormatter
 
 from .exceptions import ClientException
 
 
+_CSV_ENGINES = ("python", "pandas", "pyarrow")
+_CSV_CHUNK_SIZE = 10000
+
+
+def _import_optional(name: str) -> Any:
+    """
+    Import an optional dependency or raise a ClientException
+    :param name: module name, e.g. 'pandas' or 'pyarrow.csv'
+    :return: the imported module
+    """
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        raise ClientException(
+            "'{}' is required for this, install it with: pip install {}".format(
+                name, name.split(".")[0]
+            )
+        )
+
+
+@contextmanager
+def _open_csv(
+    path: Union[str, os.PathLike, Path], encoding: Optional[str]
+) -> Iterator[IO[str]]:
+    """
+    Open a CSV file for reading and map I/O errors to ClientExceptions
+    :param path: file path
+    :param encoding: file encoding, None for the platform default
+    """
+    try:
+        csvfile = open(path, "r", encoding=encoding, newline="")
+    except FileNotFoundError:
+        raise ClientException("File not found: {}".format(path))
+    except OSError as e:
+        raise ClientException("Could not open file {}: {}".format(path, e))
+    with csvfile:
+        try:
+            yield csvfile
+        except UnicodeDecodeError as e:
+            raise ClientException(
+                "Could not decode {} with encoding '{}': {}".format(path, encoding, e)
+            )
+        except OSError as e:
+            raise ClientException("Could not read file {}: {}".format(path, e))
+
+
+def _fit_row(values: List[str], width: int) -> List[str]:
+    """Pad a short row with empty values and drop surplus values, as every columnar reader does"""
+    return (values + [""] * width)[:width]
+
+
+def _read_csv_header(
+    path: Union[str, os.PathLike, Path], delimiter: str, encoding: str
+) -> Optional[List[str]]:
+    with _open_csv(path, encoding) as csvfile:
+        return next(csv.reader(csvfile, delimiter=delimiter), None) or None
+
+
+def _check_converters(fieldnames: Sequence[str], converters: Dict[str, Callable]) -> None:
+    missing = [name for name in converters if name not in fieldnames]
+    if missing:
+        raise ClientException(
+            "`converters` refer to columns not in CSV header: {}".format(missing)
+        )
+
+
+def _convert_columns(columns: Dict[str, list], converters: Dict[str, Callable]) -> Dict[str, list]:
+    for name, func in converters.items():
+        columns[name] = list(map(func, columns[name]))
+    return columns
+
+
+def _iter_csv_rows(
+    path: Union[str, os.PathLike, Path],
+    delimiter: str,
+    encoding: str,
+    converters: Dict[str, Callable],
+) -> Generator[dict, None, None]:
+    with _open_csv(path, encoding) as csvfile:
+        reader = csv.reader(csvfile, delimiter=delimiter)
+        header = next(reader, None)
+        if not header:
+            return
+        _check_converters(header, converters)
+        width = len(header)
+        items = list(converters.items())
+        for values in reader:
+            if not values:  # blank line
+                continue
+            row: Dict[Optional[str], Any] = dict(zip(header, values))
+            # ragged rows as with csv.DictReader(restkey=None, restval=None)
+            if len(values) < width:
+                row.update(dict.fromkeys(header[len(values):]))
+            elif len(values) > width:
+                row[None] = values[width:]
+            for name, func in items:
+                value = row[name]
+                if value is not None:  # missing values are not converted
+                    row[name] = func(value)
+            yield row
+
+
+def _iter_csv_columns_python(
+    path: Union[str, os.PathLike, Path],
+    delimiter: str,
+    encoding: str,
+    batch_size: int,
+    skip: int = 0,
+) -> Generator[Dict[str, list], None, None]:
+    with _open_csv(path, encoding) as csvfile:
+        reader = csv.reader(csvfile, delimiter=delimiter)
+        header = next(reader, None)
+        if not header:
+            return
+        width = len(header)
+        rows = islice((row for row in reader if row), skip, None)  # without blank lines
+        while True:
+            chunk = list(islice(rows, batch_size))
+            if not chunk:
+                return
+            if any(len(row) != width for row in chunk):
+                chunk = [_fit_row(row, width) for row in chunk]
+            yield dict(zip(header, map(list, zip(*chunk))))
+
+
+def _iter_csv_columns_pandas(
+    path: Union[str, os.PathLike, Path],
+    delimiter: str,
+    encoding: str,
+    batch_size: int,
+) -> Generator[Dict[str, list], None, None]:
+    pd = _import_optional("pandas")
+    header = _read_csv_header(path, delimiter, encoding)
+    if not header:
+        return
+    try:
+        # usecols: short rows are padded with "" and surplus values dropped instead of failing
+        with pd.read_csv(
+            path,
+            sep=delimiter,
+            encoding=encoding,
+            dtype=str,
+            keep_default_na=False,
+            usecols=range(len(header)),
+            chunksize=batch_size,
+        ) as reader:
+            for df in reader:
+                yield {str(name): df[name].tolist() for name in df.columns}
+    except UnicodeDecodeError as e:
+        raise ClientException("Could not decode {} with encoding '{}': {}".format(path, encoding, e))
+    except pd.errors.ParserError as e:
+        raise ClientException("Could not parse {}: {}".format(path, e))
+    except OSError as e:
+        raise ClientException("Could not read file {}: {}".format(path, e))
+
+
+def _iter_csv_columns_pyarrow(
+    path: Union[str, os.PathLike, Path],
+    delimiter: str,
+    encoding: str,
+    batch_size: int,
+) -> Generator[Dict[str, list], None, None]:
+    pa = _import_optional("pyarrow")
+    pa_csv = _import_optional("pyarrow.csv")
+    # read the header ourselves so that every column is kept as a string
+    header = _read_csv_header(path, delimiter, encoding)
+    if not header:
+        return
+
+    def batches() -> Generator[Dict[str, list], None, None]:
+        reader = pa_csv.open_csv(
+            path,
+            read_options=pa_csv.ReadOptions(encoding=encoding),
+            parse_options=pa_csv.ParseOptions(delimiter=delimiter, newlines_in_values=True),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={name: pa.string() for name in header}
+            ),
+        )
+        for batch in reader:
+            yield batch.to_pydict()
+
+    rows = 0
+    try:
+        for columns in _rebatch_columns(batches(), batch_size):
+            rows += len(columns[header[0]])
+            yield columns
+    except pa.ArrowInvalid as e:
+        if "Expected {} columns".format(len(header)) not in str(e):
+            raise ClientException("Could not parse {}: {}".format(path, e))
+        # pyarrow rejects rows that are too short or too long: read the rest like the python engine
+        yield from _iter_csv_columns_python(path, delimiter, encoding, batch_size, skip=rows)
+
+
+def _rebatch_columns(
+    batches: Iterable[Dict[str, list]], size: int
+) -> Generator[Dict[str, list], None, None]:
+    """
+    Re-slice column batches of arbitrary length into batches of exactly `size` rows
+    (the last one may be shorter)
+    """
+    buffer: Dict[str, list] = {}
+    buffered = 0
+    for columns in batches:
+        length = len(next(iter(columns.values()), []))
+        if not buffered and length == size:
+            yield columns
+            continue
+        if not buffer:
+            buffer = {name: [] for name in columns}
+        for name, values in columns.items():
+            buffer[name].extend(values)
+        buffered += length
+        while buffered >= size:
+            yield {name: values[:size] for name, values in buffer.items()}
+            buffer = {name: values[size:] for name, values in buffer.items()}
+            buffered -= size
+    if buffered:
+        yield buffer
+
+
+def _columns_to_rows(columns: Dict[str, list]) -> List[dict]:
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+
+def _batched(iterable: Iterable, size: int) -> Generator[list, None, None]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _shape_column_batches(
+    batches: Iterable[Dict[str, list]],
+    converters: Dict[str, Callable],
+    batch_size: Optional[int],
+    columnar: bool,
+) -> Generator[Any, None, None]:
+    checked = False
+    for columns in batches:
+        if not checked:
+            _check_converters(list(columns), converters)
+            checked = True
+        columns = _convert_columns(columns, converters)
+        if columnar:
+            yield columns
+        elif batch_size:
+            yield _columns_to_rows(columns)
+        else:
+            yield from _columns_to_rows(columns)
+
+
 def load_csv(
-    path: Union[str, os.PathLike, Path], delimiter: str = ","
-) -> Generator[dict, dict, None]:
+    path: Union[str, os.PathLike, Path],
+    delimiter: str = ",",
+    encoding: str = None,
+    converters: Dict[str, Callable[[str], Any]] = None,
+    batch_size: int = None,
+    columnar: bool = False,
+    engine: str = "python",
+) -> Generator[Any, None, None]:
     """
     Load CSV file from path and yield CSV rows
 
@@ -36,17 +311,52 @@ def load_csv(
     or
     list(load_csv('/path/to/file'))
 
+    for batch in load_csv('/path/to/file', batch_size=10000, converters={'value': float}):
+        print(len(batch))  # a list of 10000 rows
+
+    for columns in load_csv('/path/to/file', batch_size=10000, columnar=True, engine='pyarrow'):
+        print(columns['value'][:3])  # a dict of column name -> list of values
+
     :param path: file path
     :param delimiter: CSV delimiter
-    :return: a generator where __next__ is a row of the CSV
+    :param encoding: file encoding (e.g. 'utf-8'), defaults to the platform default (with every engine)
+    :param converters: a dict of column name -> callable to convert the string values of that column
+    :param batch_size: if set, yield lists of `batch_size` rows instead of single rows
+    :param columnar: if True, yield batches as dicts of column name -> list of values (requires `batch_size`)
+    :param engine: 'python' (default), or 'pandas' / 'pyarrow' for a faster parser if installed.
+    Rows of the 'python' engine are read like csv.DictReader does: missing values of short rows are None
+    and surplus values are listed under the key None. The 'pandas' / 'pyarrow' engines and `columnar` output
+    pad short rows with empty strings and drop surplus values instead
+    :return: a generator where __next__ is a row (or a batch) of the CSV
     """
-    try:
-        with open(path, "r") as csvfile:
-            reader = DictReader(csvfile, delimiter=delimiter)
-            for row in reader:
-                yield row
-    except (OSError, IOError):
-        raise ClientException("File not found: {}".format(path))
+    if engine not in _CSV_ENGINES:
+        raise ClientException(
+            "`engine` must be one of {}, not '{}'".format(_CSV_ENGINES, engine)
+        )
+    if batch_size is not None and (
+        not isinstance(batch_size, int) or isinstance(batch_size, bool) or batch_size < 1
+    ):
+        raise ClientException("`batch_size` must be a positive integer")
+    if columnar and not batch_size:
+        raise ClientException("`columnar` output requires a `batch_size`")
+    converters = converters or {}
+    encoding = encoding or locale.getpreferredencoding(False)
+
+    if engine == "python" and not columnar:
+        rows = _iter_csv_rows(path, delimiter, encoding, converters)
+        if not batch_size:
+            return rows
+        return _batched(rows, batch_size)
+
+    column_readers = {
+        "python": _iter_csv_columns_python,
+        "pandas": _iter_csv_columns_pandas,
+        "pyarrow": _iter_csv_columns_pyarrow,
+    }
+    batches = column_readers[engine](
+        path, delimiter, encoding, batch_size or _CSV_CHUNK_SIZE
+    )
+    return _shape_column_batches(batches, converters, batch_size, columnar)
 
 
 def load_json(path: Union[str, os.PathLike, Path]) -> dict:
@@ -62,6 +372,218 @@ def load_json(path: Union[str, os.PathLike, Path]) -> dict:
         raise ClientException("File not found: {}".format(path))
 
 
+def _atomic_write(path: Union[str, os.PathLike, Path], text: str) -> None:
+    """
+    Write a text file atomically: write a temporary file next to it and rename it
+    :param path: file path
+    :param text: file content
+    """
+    import tempfile  # only for checkpoints and caches
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# characters that can end a number, any other character after a decoded number may still belong to it
+_JSON_DELIMITERS = frozenset(" \t\n\r,]}:")
+
+
+class _JsonStream(object):
+    """
+    Incremental reader for the top level of a (very large) JSON document.
+    The file is read in blocks and single values are decoded with the C-accelerated json decoder,
+    so memory use is bound by the block size and the largest single value.
+    """
+
+    def __init__(self, f: IO[str], path: Union[str, os.PathLike, Path], block_size: int = 1 << 22) -> None:
+        self.f = f
+        self.path = path
+        self.block_size = block_size
+        self.decoder = json.JSONDecoder()
+        self.text = ""
+        self.pos = 0
+        self.offset = 0  # number of characters discarded from the start of the file
+        self.eof = False
+
+    def error(self, expected: str) -> ClientException:
+        return ClientException(
+            "Invalid JSON in {} at character {}: expected {}".format(
+                self.path, self.offset + self.pos, expected
+            )
+        )
+
+    def fill(self) -> bool:
+        """Read the next block (at least doubling the buffered text), drop what was consumed already"""
+        if self.eof:
+            return False
+        remaining = self.text[self.pos :]
+        chunk = self.f.read(max(self.block_size, len(remaining)))
+        if not chunk:
+            self.eof = True
+            return False
+        self.offset += self.pos
+        self.text = remaining + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character, '' at the end of the file"""
+        while True:
+            self.pos = _JSON_WHITESPACE.match(self.text, self.pos).end()  # type: ignore
+            if self.pos < len(self.text) or not self.fill():
+                return self.text[self.pos : self.pos + 1]
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise self.error(repr(char))
+        self.pos += 1
+
+    def value(self) -> Any:
+        """Decode the JSON value at the current position"""
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError as e:
+                # the value may just be cut off at the end of the buffered text
+                truncated = e.msg.startswith("Unterminated") or e.pos >= len(self.text) - 10
+                if truncated and self.fill():
+                    continue
+                raise self.error("a JSON value ({})".format(e.msg))
+            if self._maybe_cut_off(obj, end) and self.fill():
+                continue  # e.g. a number that continues in the next block
+            self.pos = end
+            return obj
+
+    def _maybe_cut_off(self, obj: Any, end: int) -> bool:
+        """
+        Whether a decoded value may continue beyond the buffered text:
+        raw_decode() takes "1.5" of "1.5e10" if the block ends after the "e". At the end of the file fill() stops it.
+        """
+        if end == len(self.text):
+            return True
+        is_number = isinstance(obj, (int, float)) and not isinstance(obj, bool)
+        return is_number and self.text[end] not in _JSON_DELIMITERS
+
+    def items(self) -> Generator[str, None, None]:
+        """
+        Yield the keys of the top-level object.
+        The consumer must read or skip the value before asking for the next key.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            return
+        while True:
+            if self.peek() != '"':
+                raise self.error("a key")
+            key = self.value()
+            self.expect(":")
+            yield key
+            char = self.peek()
+            if char == "}":
+                return
+            if char != ",":
+                raise self.error("',' or '}'")
+            self.pos += 1
+
+    def array(self) -> Generator[Any, None, None]:
+        """Yield the elements of the array at the current position one by one"""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            char = self.peek()
+            if char == "]":
+                self.pos += 1
+                return
+            if char != ",":
+                raise self.error("',' or ']'")
+            self.pos += 1
+
+    def skip(self) -> None:
+        """Skip the value at the current position, element by element for arrays"""
+        if self.peek() == "[":
+            for _ in self.array():
+                pass
+        else:
+            self.value()
+
+
+@contextmanager
+def _open_json_stream(path: Union[str, os.PathLike, Path]) -> Iterator[_JsonStream]:
+    try:
+        f = open(path, "r", encoding="utf-8")
+    except FileNotFoundError:
+        raise ClientException("File not found: {}".format(path))
+    except OSError as e:
+        raise ClientException("Could not open file {}: {}".format(path, e))
+    with f:
+        yield _JsonStream(f, path)
+
+
+def iter_json_file(
+    path: Union[str, os.PathLike, Path], collection: str
+) -> Generator[Any, None, None]:
+    """
+    Yield the objects of one top-level array of a (very large) JSON file one at a time,
+    e.g. all dataElements of a metadata export, without loading the whole file into memory.
+
+    Usage:
+
+    for data_element in iter_json_file('/path/to/metadata.json', 'dataElements'):
+        print(data_element['id'])
+
+    :param path: file path
+    :param collection: the top-level key of the array, e.g. 'dataElements'
+    :return: a generator where __next__ is an element of the array
+    """
+    with _open_json_stream(path) as stream:
+        found = False
+        for key in stream.items():
+            if key == collection:
+                found = True
+                if stream.peek() != "[":
+                    raise stream.error("an array for '{}'".format(collection))
+                yield from stream.array()
+            else:
+                stream.skip()
+        if not found:
+            raise ClientException("'{}' not found in {}".format(collection, path))
+
+
+def count_json_collections(path: Union[str, os.PathLike, Path]) -> Dict[str, int]:
+    """
+    Count the objects in every top-level array of a (very large) JSON file with constant memory,
+    e.g. to plan partitioned imports of a metadata export.
+
+    Usage:
+
+    print(count_json_collections('/path/to/metadata.json'))
+    # {'dataElements': 1034, 'organisationUnits': 13102, ...}
+
+    :param path: file path
+    :return: dict of top-level key -> number of elements (non-array values are left out)
+    """
+    counts = {}
+    with _open_json_stream(path) as stream:
+        for key in stream.items():
+            if stream.peek() == "[":
+                counts[key] = sum(1 for _ in stream.array())
+            else:
+                stream.value()
+    return counts
+
+
 def partition_payload(data: dict, key: str, thresh: int) -> Generator[dict, dict, None]:
     """
     Yield partitions of a payload
@@ -84,26 +606,152 @@ def partition_payload(data: dict, key: str, thresh: int) -> Generator[dict, dict
         yield {key: data[i : i + thresh]}
 
 
-def search_auth_file(filename: str = "dish.json") -> str:
+# directories not searched for the auth file: hidden ones (starting with ".") and these
+_AUTH_SEARCH_SKIP = frozenset(
+    {
+        "node_modules",
+        "site-packages",
+        "dist-packages",
+        "__pycache__",
+        "venv",
+        "env",
+        "virtualenvs",
+        "anaconda3",
+        "miniconda3",
+        "snap",
+        "AppData",
+        "Library",
+        "target",
+        "build",
+        "dist",
+    }
+)
+_auth_file_cache: Dict[tuple, str] = {}
+
+
+def _auth_file_locations(home: str) -> List[str]:
+    """:return: directories checked before the home folder is searched"""
+    config_home = os.environ.get("XDG_CONFIG_HOME") or os.path.join(home, ".config")
+    return [os.path.join(config_home, "dhis2"), os.getcwd(), os.path.join(home, ".dhis2"), home]
+
+
+def _search_tree(top: str, filename: str, max_depth: int) -> Optional[str]:
+    """
+    Breadth-first search for filename in `top` and `max_depth` folder levels below it, the shallowest match wins.
+    Hidden and vendor directories are not entered, nor are symlinked directories.
+    """
+    level = [top]
+    for _ in range(max_depth + 1):
+        next_level = []
+        for directory in level:
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not entry.name.startswith(".") and entry.name not in _AUTH_SEARCH_SKIP:
+                                next_level.append(entry.path)
+                        elif entry.name == filename and entry.is_file():
+                            return entry.path
+            except OSError:  # permission denied, removed meanwhile
+                continue
+        level = sorted(next_level)
+    return None
+
+
+def search_auth_file(filename: str = "dish.json", max_depth: int = 4) -> str:
     """
     Search filename in
     - A) DHIS_HOME (env variable)
-    - B) current user's home folder
+    - B) $XDG_CONFIG_HOME/dhis2 (default: ~/.config/dhis2), the current directory, ~/.dhis2 and the home folder
+    - C) folders below the home folder, up to `max_depth` levels deep, except hidden and vendor folders
+      (e.g. node_modules, virtualenvs)
+    The found path is cached for the process as long as the file exists.
     :param filename: the filename to search for
+    :param max_depth: how many folder levels below the home folder are searched
     :return: full path of filename
     """
     if "DHIS_HOME" in os.environ:
         return os.path.join(os.environ["DHIS_HOME"], filename)
+    home_path = os.path.expanduser("~")
+    key = (filename, home_path, os.getcwd(), os.environ.get("XDG_CONFIG_HOME"), max_depth)
+    cached = _auth_file_cache.get(key)
+    if cached and os.path.isfile(cached):
+        return cached
+
+    path: Optional[str] = None
+    for directory in _auth_file_locations(home_path):
+        if os.path.isfile(os.path.join(directory, filename)):
+            path = os.path.join(directory, filename)
+            break
     else:
-        home_path = os.path.expanduser(os.path.join("~"))
-        for root, dirs, files in os.walk(home_path):
-            if filename in files:
-                return os.path.join(root, filename)
+        path = _search_tree(home_path, filename, max_depth)
+    if path:
+        _auth_file_cache[key] = path
+        return path
     raise ClientException(
-        "'{}' not found - searched in $DHIS_HOME and in home folder".format(filename)
+        "'{}' not found - searched in $DHIS_HOME, the config folder, the current folder "
+        "and {} levels of the home folder".format(filename, max_depth)
     )
 
 
+def load_auth_profiles(location: str) -> Tuple[Dict[str, dict], Optional[str]]:
+    """
+    Read the profiles of an auth file, either a single profile named "dhis":
+    {"dhis": {"baseurl": ..., "username": ..., "password": ...}}
+    or several, optionally with a default one and "api_version" / "user_agent" per profile:
+    {"default": "play", "profiles": {"play": {"baseurl": ..., ...}, "prod": {...}}}
+    :param location: auth file path
+    :return: profiles by name and the name of the default profile (None if there is none)
+    """
+    data = load_json(location)
+    if not isinstance(data, dict):
+        raise ClientException("Auth file found but not valid: {}".format(location))
+    profiles = data.get("profiles", {})
+    if not isinstance(profiles, dict):
+        raise ClientException("Auth file found but not valid: {}".format(location))
+    profiles = dict(profiles)
+    if "dhis" in data:
+        profiles["dhis"] = data["dhis"]
+    if not profiles:
+        raise ClientException("Auth file found but not valid: {}".format(location))
+    for name, section in profiles.items():
+        try:
+            assert all([section["baseurl"], section["username"], section["password"]])
+        except (KeyError, TypeError, AssertionError):
+            raise ClientException("Auth profile '{}' not valid: {}".format(name, location))
+
+    default = data.get("default")
+    if default is None and len(profiles) == 1:
+        default = next(iter(profiles))
+    elif default is None and "dhis" in profiles:
+        default = "dhis"
+    if default is not None and default not in profiles:
+        raise ClientException("Default auth profile '{}' not found: {}".format(default, location))
+    return profiles, default
+
+
+def select_auth_profile(
+    profiles: Dict[str, dict], default: Optional[str], profile: Optional[str], location: str
+) -> Tuple[str, dict]:
+    """
+    :param profiles: see load_auth_profiles
+    :param default: see load_auth_profiles
+    :param profile: the profile asked for, None for the default one
+    :param location: auth file path, for error messages
+    :return: name and section of the profile
+    """
+    name = profile or default
+    if name is None:
+        raise ClientException(
+            "No default auth profile in {}, choose one of: {}".format(location, ", ".join(sorted(profiles)))
+        )
+    if name not in profiles:
+        raise ClientException(
+            "Auth profile '{}' not found in {}, choose one of: {}".format(name, location, ", ".join(sorted(profiles)))
+        )
+    return name, profiles[name]
+
+
 def version_to_int(value: str) -> Optional[int]:
     """
     Convert version info to integer
@@ -156,6 +804,11 @@ def pretty_json(obj: Union[str, dict, list]) -> None:
             obj = json.loads(obj)
         except ValueError:
             raise ClientException("`obj` is not a json string")
+    # pygments is only needed here, import it on first use to keep `import dhis2` fast
+    from pygments import highlight
+    from pygments.lexers.data import JsonLexer
+    from pygments.formatters.terminal import TerminalFormatter
+
     json_str = json.dumps(obj, sort_keys=True, indent=2)
     print(highlight(json_str, JsonLexer(), TerminalFormatter()))
 
@@ -193,12 +846,13 @@ def clean_obj(
 class ImportSummary:
     """Class to track the import status and statistics"""
 
-    def __init__(self, status_ok: bool, imported: int, deleted: int, ignored: int, updated: int):
+    def __init__(self, status_ok: bool, imported: int, deleted: int, ignored: int, updated: int, raw: dict = None):
         self.status_ok = status_ok
         self.imported = imported
         self.deleted = deleted
         self.ignored = ignored
         self.updated = updated
+        self.raw = raw  # the full response, if created from one
 
     @classmethod
     def from_response(cls, status, data) -> 'ImportSummary':
@@ -212,6 +866,60 @@ class ImportSummary:
             updated=int(data['updated'])
         )
 
+    @classmethod
+    def from_import_response(cls, response: dict) -> 'ImportSummary':
+        """
+        Detect the import statistics of an import response of events / trackedEntityInstances / metadata / dataValues.
+        :param response: The response of an import request.
+        :return: ImportSummary
+        """
+        if not isinstance(response, dict):
+            raise ClientException("Cannot parse import stats: `response` must be of type dict")
+
+        if not response.get('status'):
+            raise ClientException("Cannot parse import stats: no 'status' detected")
+        status = response['status']
+        counts = ('imported', 'deleted', 'ignored', 'updated')
+        wrapped = response.get('response')
+        if not isinstance(wrapped, dict):
+            wrapped = {}
+
+        if 'importCount' in response:
+            # data values import
+            data = response['importCount']
+
+        elif 'stats' in response:
+            # metadata import
+            data = response['stats']
+
+        elif all(s in response for s in counts):
+            # events import
+            data = response
+
+        elif all(s in wrapped for s in counts):
+            # tracked entity instances import
+            data = wrapped
+
+        elif 'importCount' in wrapped:
+            # data values import, DHIS2 2.36+
+            data = wrapped['importCount']
+
+        elif 'stats' in wrapped:
+            # metadata import, DHIS2 2.36+
+            data = wrapped['stats']
+
+        else:
+            raise ClientException("Cannot parse import stats: no 'stats' detected")
+
+        summary = cls.from_response(status, data)
+        summary.raw = response
+        return summary
+
+    def __repr__(self) -> str:
+        return "ImportSummary(status_ok={}, imported={}, updated={}, ignored={}, deleted={})".format(
+            self.status_ok, self.imported, self.updated, self.ignored, self.deleted
+        )
+
 
 def import_response_ok(response: dict) -> bool:
     """
@@ -220,31 +928,7 @@ def import_response_ok(response: dict) -> bool:
     :param response: The response of an import request.
     :return: True if response indicates success request and no ignored values
     """
-    if not isinstance(response, dict):
-        raise ClientException("Cannot parse import stats: `response` must be of type dict")
-
-    if not response.get('status'):
-        raise ClientException("Cannot parse import stats: no 'status' detected")
-    status = response['status']
-
-    if 'importCount' in response:
-        # data values import
-        summary = ImportSummary.from_response(status, response['importCount'])
-
-    elif 'stats' in response:
-        # metadata import
-        summary = ImportSummary.from_response(status, response['stats'])
-
-    elif all(s in response for s in ('imported', 'deleted', 'ignored', 'updated')):
-        # events import
-        summary = ImportSummary.from_response(status, response)
-
-    elif 'response' in response and all(s in response['response'] for s in ('imported', 'deleted', 'ignored', 'updated')):
-        # tracked entity instances import
-        summary = ImportSummary.from_response(status, response['response'])
-
-    else:
-        raise ClientException("Cannot parse import stats: no 'stats' detected")
+    summary = ImportSummary.from_import_response(response)
 
     return all([
         summary.status_ok,
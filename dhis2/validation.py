@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+"""
+dhis2.validation
+~~~~~~~~~~~~~~~~
+
+This module checks metadata payloads against the server's schemas before they are imported,
+so that invalid objects can be left out instead of failing a whole chunk on the server.
+"""
+
+import re
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+from .query import DEFAULT_SCHEMA_CACHE, SchemaCache, Schemas
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .api import Api
+
+UID = re.compile(r"^[A-Za-z][A-Za-z0-9]{10}$")
+EMAIL = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+URL = re.compile(r"^[A-Za-z][A-Za-z0-9+.-]*://\S+$")
+COLOR = re.compile(r"^#?([0-9A-Fa-f]{6}|[0-9A-Fa-f]{3})$")
+DATE = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+# references to these classes may be left out, the server uses its "default" object
+DEFAULT_CLASSES = frozenset(
+    (
+        "org.hisp.dhis.category.CategoryCombo",
+        "org.hisp.dhis.category.Category",
+        "org.hisp.dhis.category.CategoryOption",
+        "org.hisp.dhis.category.CategoryOptionCombo",
+    )
+)
+STRING_TYPES = frozenset(("TEXT", "IDENTIFIER", "EMAIL", "URL", "COLOR", "PASSWORD", "PHONENUMBER"))
+
+# returns an error message for a value, None if it's valid
+ValueCheck = Callable[[Any], Optional[str]]
+# returns an error message for an object, None if it's valid
+ObjectCheck = Callable[[dict], Optional[str]]
+
+
+def _reference_error(key: str, value: Any) -> Optional[str]:
+    if not isinstance(value, dict):
+        return "Property `{}` must be an object reference".format(key)
+    uid = value.get("id")
+    if uid is None:
+        return None if value.get("code") else "Reference `{}` has no id".format(key)
+    if not isinstance(uid, str) or not UID.match(uid):
+        return "Reference `{}` has an invalid UID: {}".format(key, uid)
+    return None
+
+
+def _string_check(key: str, kind: str, minimum: Optional[float], maximum: Optional[float]) -> ValueCheck:
+    pattern = {"EMAIL": EMAIL, "URL": URL, "COLOR": COLOR}.get(kind)
+    if key == "id":
+        pattern = UID
+
+    def check(value: Any) -> Optional[str]:
+        if not isinstance(value, str):
+            return "Property `{}` must be a string".format(key)
+        if (minimum is not None and len(value) < minimum) or (maximum is not None and len(value) > maximum):
+            return "Length of property `{}` must be between {:g} and {:g} but was {}".format(
+                key, minimum or 0, maximum if maximum is not None else float("inf"), len(value)
+            )
+        if pattern is not None and not pattern.match(value):
+            return "Property `{}` is not a valid {}: {}".format(key, "UID" if key == "id" else kind.lower(), value)
+        return None
+
+    return check
+
+
+def _number_check(key: str, kind: str, minimum: Optional[float], maximum: Optional[float]) -> ValueCheck:
+    types = int if kind == "INTEGER" else (int, float)
+
+    def check(value: Any) -> Optional[str]:
+        if not isinstance(value, types) or isinstance(value, bool):
+            return "Property `{}` must be {}".format(key, "an integer" if kind == "INTEGER" else "a number")
+        if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+            low = minimum if minimum is not None else float("-inf")
+            high = maximum if maximum is not None else float("inf")
+            return "Property `{}` must be between {:g} and {:g} but was {}".format(key, low, high, value)
+        return None
+
+    return check
+
+
+def _value_check(prop: dict, key: str) -> Optional[ValueCheck]:
+    """:return: a check of a property's value, None if values of its type aren't checked"""
+    kind = prop.get("propertyType")
+    minimum, maximum = prop.get("min"), prop.get("max")
+    if kind in STRING_TYPES:
+        return _string_check(key, kind, minimum, maximum)
+    if kind in ("INTEGER", "NUMBER"):
+        return _number_check(key, kind, minimum, maximum)
+    if kind == "BOOLEAN":
+        return lambda value: None if isinstance(value, bool) else "Property `{}` must be a boolean".format(key)
+    if kind == "DATE":
+        return lambda value: (
+            None if isinstance(value, str) and DATE.match(value) else "Property `{}` must be a date".format(key)
+        )
+    if kind == "CONSTANT" and prop.get("constants"):
+        constants = frozenset(prop["constants"])
+
+        def check(value: Any) -> Optional[str]:
+            # not hashable values (lists, dicts) can't be looked up
+            if isinstance(value, str) and value in constants:
+                return None
+            return "Property `{}` must be one of {}: {}".format(key, sorted(constants), value)
+
+        return check
+    if kind == "REFERENCE" and not prop.get("embeddedObject"):
+        return lambda value: _reference_error(key, value)
+    if kind == "COLLECTION":
+        references = prop.get("itemPropertyType") == "REFERENCE" and not prop.get("embeddedObject")
+
+        def check(value: Any) -> Optional[str]:
+            if not isinstance(value, list):
+                return "Property `{}` must be a list".format(key)
+            if references:
+                for item in value:
+                    error = _reference_error(key, item)
+                    if error:
+                        return error
+            return None
+
+        return check
+    return None
+
+
+def _property_check(prop: dict) -> Optional[ObjectCheck]:
+    """:return: a check of an object's property, None if there's nothing to check"""
+    if prop.get("persisted") is False:  # e.g. displayName, href, access
+        return None
+    key = prop.get("collectionName") if prop.get("collection") else prop.get("name")
+    if not key:
+        return None
+    required = bool(prop.get("required")) and not prop.get("collection") and prop.get("klass") not in DEFAULT_CLASSES
+    value_check = _value_check(prop, key)
+    if not required and value_check is None:
+        return None
+    missing = "Missing required property `{}`".format(key)
+
+    def check(obj: dict) -> Optional[str]:
+        value = obj.get(key)
+        if value is None:
+            return missing if required else None
+        return value_check(value) if value_check is not None else None
+
+    return check
+
+
+def compile_schema(schema: dict) -> List[ObjectCheck]:
+    """
+    Turn a schema into a list of checks, one per property, so that objects aren't checked
+    by walking the schema again and again
+    :param schema: schema as received from the server
+    :return: checks returning an error message or None
+    """
+    checks = []
+    for prop in schema.get("properties", []):
+        check = _property_check(prop)
+        if check is not None:
+            checks.append(check)
+    return checks
+
+
+class MetadataValidator(object):
+    """
+    Checks metadata objects locally against the server's schemas: required properties, types, lengths and ranges,
+    allowed constants and the UIDs of references. What the server checks beyond that (e.g. that references exist
+    or that codes are unique) is not checked.
+
+    validator = MetadataValidator.from_api(api)
+    valid, invalid = validator.split(payload)
+    api.post('metadata', json=valid)
+    """
+
+    def __init__(self, schemas: Schemas) -> None:
+        """
+        :param schemas: the server's schemas, e.g. from SchemaCache.get(api)
+        """
+        self.schemas = schemas
+        self._checks: Dict[str, Optional[List[ObjectCheck]]] = {}
+
+    @classmethod
+    def from_api(cls, api: "Api", cache: SchemaCache = None) -> "MetadataValidator":
+        """
+        :param api: Api of the server to import into
+        :param cache: SchemaCache to get the schemas from, by default one for the process
+        :return: MetadataValidator with the server's schemas
+        """
+        return cls((cache or DEFAULT_SCHEMA_CACHE).get(api))
+
+    def _checks_of(self, collection: str) -> Optional[List[ObjectCheck]]:
+        if collection not in self._checks:
+            schema = self.schemas.schema(collection)
+            self._checks[collection] = compile_schema(schema) if schema is not None else None
+        return self._checks[collection]
+
+    def errors(self, collection: str, obj: Any) -> List[str]:
+        """
+        :param collection: the collection the object belongs to, e.g. dataElements
+        :param obj: metadata object
+        :return: error messages, empty if the object is valid or the collection has no schema
+        """
+        checks = self._checks_of(collection)
+        if checks is None:
+            return []
+        if not isinstance(obj, dict):
+            return ["Not an object: {!r}".format(obj)]
+        errors = []
+        for check in checks:
+            error = check(obj)
+            if error is not None:
+                errors.append(error)
+        return errors
+
+    def split(self, payload: dict) -> Tuple[dict, List[dict]]:
+        """
+        Separate invalid objects from a metadata payload
+        :param payload: e.g. {"dataElements": [...], "dataSets": [...]}, other values are kept as they are
+        :return: the payload without the invalid objects,
+        invalid objects as {"collection": ..., "index": ..., "id": ..., "errors": [...]}
+        """
+        valid: Dict[str, Any] = {}
+        invalid: List[dict] = []
+        for collection, objects in payload.items():
+            if not isinstance(objects, list) or self._checks_of(collection) is None:
+                valid[collection] = objects
+                continue
+            kept = valid[collection] = []
+            for index, obj in enumerate(objects):
+                errors = self.errors(collection, obj)
+                if errors:
+                    uid = obj.get("id") if isinstance(obj, dict) else None
+                    invalid.append({"collection": collection, "index": index, "id": uid, "errors": errors})
+                else:
+                    kept.append(obj)
+        return valid, invalid
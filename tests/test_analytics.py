@@ -0,0 +1,283 @@
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import responses
+
+from dhis2 import Api, AnalyticsResult, decode_analytics, exceptions, split_analytics_query
+from .common import BASEURL, API_URL
+
+
+@pytest.fixture  # BASE FIXTURE
+def api():
+    return Api(BASEURL, "admin", "district")
+
+
+HEADERS = [
+    {"name": "dx", "column": "Data", "valueType": "TEXT"},
+    {"name": "pe", "column": "Period", "valueType": "TEXT"},
+    {"name": "ou", "column": "Organisation unit", "valueType": "TEXT"},
+    {"name": "value", "column": "Value", "valueType": "NUMBER"},
+]
+
+
+def analytics_server(calls, reverse_columns_of=None, delay=0.0):
+    """Answer every analytics query with one row per dx x pe x ou item"""
+    lock = threading.Lock()
+    active = [0]
+
+    def callback(request):
+        with lock:
+            active[0] += 1
+            calls.append((parse_qs(urlparse(request.url).query), active[0]))
+        time.sleep(delay)
+        query = parse_qs(urlparse(request.url).query)
+        dims = dict(d.split(":", 1) for d in query["dimension"])
+        items = {name: value.split(";") for name, value in dims.items()}
+        rows = [[dx, pe, ou, "1.5"] for dx in items["dx"] for pe in items["pe"] for ou in items["ou"]]
+        headers = list(HEADERS)
+        if reverse_columns_of and reverse_columns_of in items["dx"]:
+            headers.reverse()
+            rows = [list(reversed(row)) for row in rows]
+        body = {
+            "headers": headers,
+            "rows": rows,
+            "metaData": {
+                "items": {i: {"name": i.upper()} for values in items.values() for i in values},
+                "dimensions": items,
+                "ouHierarchy": {},
+            },
+            "width": 4,
+            "height": len(rows),
+        }
+        with lock:
+            active[0] -= 1
+        return 200, {}, json.dumps(body)
+
+    responses.add_callback(responses.GET, API_URL + "/analytics.json", callback=callback)
+
+
+PARAMS = {
+    "dimension": ["dx:a;b;c;d", "pe:2021Q1;2021Q2", "ou:x;LEVEL-2"],
+    "filter": "co:y",
+    "displayProperty": "NAME",
+}
+
+
+def test_split_analytics_query():
+    queries = split_analytics_query(PARAMS, max_cells=4)
+    # 4 dx x 2 pe x (1 ou + LEVEL-2) = 16 cells: dx is halved twice -> 1 x 2 x 2
+    assert len(queries) == 4
+    assert queries[0] == [
+        ("dimension", "dx:a"),
+        ("dimension", "pe:2021Q1;2021Q2"),
+        ("dimension", "ou:x;LEVEL-2"),
+        ("filter", "co:y"),
+        ("displayProperty", "NAME"),
+    ]
+    assert [q[0][1] for q in queries] == ["dx:a", "dx:b", "dx:c", "dx:d"]
+
+
+def test_split_analytics_query_largest_dimension_first():
+    params = [("dimension", "dx:a;b"), ("dimension", "pe:1;2;3;4;5;6;7;8"), ("dimension", "ou:USER_ORGUNIT")]
+    queries = split_analytics_query(params, max_cells=8)
+    assert [(q[0][1], q[1][1]) for q in queries] == [
+        ("dx:a;b", "pe:1;2;3;4"),
+        ("dx:a;b", "pe:5;6;7;8"),
+    ]
+    assert queries[0][2] == ("dimension", "ou:USER_ORGUNIT")
+
+
+def test_split_analytics_query_not_splittable():
+    params = {"dimension": ["dx:a", "pe:LAST_12_MONTHS", "ou:x;LEVEL-3", "J5jldMd8OHv"]}
+    assert split_analytics_query(params, max_cells=1) == [
+        [("dimension", "dx:a"), ("dimension", "pe:LAST_12_MONTHS"), ("dimension", "ou:x;LEVEL-3"), ("dimension", "J5jldMd8OHv")]
+    ]
+    assert len(split_analytics_query(params)) == 1
+
+
+@pytest.mark.parametrize(
+    "params,max_cells",
+    [
+        ({"filter": "dx:a"}, 10),
+        (None, 10),
+        ("dimension=dx:a", 10),
+        ({"dimension": "dx:a"}, 0),
+    ],
+)
+def test_split_analytics_query_invalid(params, max_cells):
+    with pytest.raises(exceptions.ClientException):
+        split_analytics_query(params, max_cells=max_cells)
+
+
+@responses.activate
+def test_get_analytics_rows(api):
+    calls = []
+    analytics_server(calls, delay=0.01)
+    result = api.get_analytics(PARAMS, max_cells=4, max_workers=2)
+    assert calls == []  # nothing is requested before the rows are read
+    rows = list(result.iter_rows())
+
+    assert len(calls) == 4 and max(active for _, active in calls) <= 2
+    assert all(query["filter"] == ["co:y"] for query, _ in calls)
+    assert len(rows) == 16 and result.row_count == 16
+    assert [row[0] for row in rows[::4]] == ["a", "b", "c", "d"]  # in sub-query order
+    assert result.names == ["dx", "pe", "ou", "value"]
+    assert result.meta_data["dimensions"] == {
+        "dx": ["a", "b", "c", "d"],
+        "pe": ["2021Q1", "2021Q2"],
+        "ou": ["x", "LEVEL-2"],
+    }
+    assert set(result.meta_data["items"]) == {"a", "b", "c", "d", "2021Q1", "2021Q2", "x", "LEVEL-2"}
+    assert result.meta_data["ouHierarchy"] == {}
+    assert repr(result) == "AnalyticsResult(queries=4, rows=16)"
+    with pytest.raises(exceptions.ClientException):
+        list(result.iter_rows())
+
+
+@responses.activate
+def test_get_analytics_columns_reordered(api):
+    analytics_server([], reverse_columns_of="b")
+    columns = api.get_analytics(PARAMS, max_cells=4).columns()
+    assert list(columns) == ["dx", "pe", "ou", "value"]
+    assert columns["dx"] == ["a"] * 4 + ["b"] * 4 + ["c"] * 4 + ["d"] * 4
+    assert set(columns["value"]) == {"1.5"}
+
+
+@responses.activate
+def test_get_analytics_to_dict(api):
+    analytics_server([])
+    data = api.get_analytics(PARAMS, max_cells=100).to_dict()
+    assert data["headers"] == HEADERS
+    assert data["width"] == data["headerWidth"] == 4
+    assert data["height"] == len(data["rows"]) == 16
+
+
+@responses.activate
+def test_get_analytics_request_error(api):
+    responses.add(responses.GET, API_URL + "/analytics.json", json={"message": "boom"}, status=409)
+    with pytest.raises(exceptions.RequestException):
+        api.get_analytics(PARAMS, max_cells=4).to_dict()
+
+
+def test_get_analytics_invalid_workers(api):
+    with pytest.raises(exceptions.ClientException):
+        api.get_analytics(PARAMS, max_workers=0)
+
+
+def test_analytics_result_merges_responses():
+    first = {"headers": [{"name": "dx"}, {"name": "value"}], "rows": [["a", "1"]], "metaData": {"pe": ["2021"], "n": 1}}
+    empty = {"headers": [{"name": "value"}, {"name": "dx"}], "rows": [], "metaData": {"pe": ["2021", "2022"], "n": 2}}
+    other = {"headers": [{"name": "dx"}], "rows": [["b"]]}
+    result = AnalyticsResult([first, empty])
+    assert result.columns() == {"dx": ["a"], "value": ["1"]}
+    assert result.meta_data == {"pe": ["2021", "2022"], "n": 1}
+    assert AnalyticsResult([dict(empty, metaData={})]).columns() == {"value": [], "dx": []}
+    with pytest.raises(exceptions.ClientException):
+        AnalyticsResult([first, other]).to_dict()
+
+
+TYPED = {
+    "headers": [
+        {"name": "dx", "valueType": "TEXT"},
+        {"name": "value", "valueType": "NUMBER"},
+        {"name": "count", "valueType": "INTEGER"},
+        {"name": "avg", "valueType": "INTEGER_POSITIVE"},
+        {"name": "flag", "valueType": "BOOLEAN"},
+        {"name": "date", "valueType": "DATE"},
+        {"name": "legacy", "type": "java.lang.Double"},
+        {"name": "other"},
+    ],
+    "rows": [
+        ["a", "1.5", "3", "2.0", "1", "2021-03-04 00:00:00.0", "7", "x"],
+        ["b", "", "", "2.5", "", "2021-03-05", "", ""],
+    ],
+    "metaData": {"items": {}},
+}
+
+
+def test_decode_analytics_python():
+    columns = decode_analytics(TYPED)
+    assert columns == {
+        "dx": ["a", "b"],
+        "value": [1.5, None],
+        "count": [3, None],
+        "avg": [2, 2.5],
+        "flag": [True, None],
+        "date": ["2021-03-04 00:00:00.0", "2021-03-05"],
+        "legacy": [7.0, None],
+        "other": ["x", ""],
+    }
+    assert isinstance(columns["avg"][0], int)
+
+
+def test_decode_analytics_sources():
+    body = json.dumps(TYPED)
+    other_order = dict(TYPED, headers=TYPED["headers"][::-1], rows=[row[::-1] for row in TYPED["rows"]])
+    assert decode_analytics(body.encode("utf-8"))["value"] == [1.5, None]
+    assert decode_analytics(body)["dx"] == ["a", "b"]
+    assert decode_analytics([TYPED, other_order])["dx"] == ["a", "b", "a", "b"]
+    assert decode_analytics(iter([])) == {}
+    for invalid in ("{not json", b"[1, 2]"):
+        with pytest.raises(exceptions.ClientException):
+            decode_analytics(invalid)
+    with pytest.raises(exceptions.ClientException):
+        decode_analytics(TYPED, engine="polars")
+
+
+@responses.activate
+def test_decode_analytics_response(api):
+    responses.add(responses.GET, API_URL + "/analytics.json", body=json.dumps(TYPED), status=200)
+    assert decode_analytics(api.get("analytics"))["count"] == [3, None]
+    assert decode_analytics(api.get("analytics", stream=True))["count"] == [3, None]
+
+
+@responses.activate
+def test_decode_analytics_stream_rows_first(api):
+    body = json.dumps({"rows": TYPED["rows"], "headers": TYPED["headers"], "height": 2})
+    responses.add(responses.GET, API_URL + "/analytics.json", body=body, status=200)
+    assert decode_analytics(api.get("analytics", stream=True))["flag"] == [True, None]
+
+    responses.replace(responses.GET, API_URL + "/analytics.json", body=body + " {}", status=200)
+    with pytest.raises(exceptions.ClientException):
+        decode_analytics(api.get("analytics", stream=True))
+
+
+def test_decode_analytics_pandas():
+    pd = pytest.importorskip("pandas")
+    df = decode_analytics(TYPED, engine="pandas")
+    assert list(df.columns) == [h["name"] for h in TYPED["headers"]]
+    assert str(df["value"].dtype) == "float64" and pd.isna(df["value"][1])
+    assert str(df["count"].dtype) == "Int64" and df["count"][0] == 3 and df["count"][1] is pd.NA
+    assert str(df["avg"].dtype) == "float64"
+    assert str(df["flag"].dtype) == "boolean" and df["flag"][0] and df["flag"][1] is pd.NA
+    assert str(df["date"].dtype).startswith("datetime64")
+    assert df["other"].tolist() == ["x", ""]
+
+    unusual = dict(TYPED, rows=[["a", "1", "1", "1", "true", "last week", "1", "x"]])
+    assert decode_analytics(unusual, engine="pandas")["date"].tolist() == ["last week"]
+
+
+def test_decode_analytics_pyarrow():
+    pa = pytest.importorskip("pyarrow")
+    table = decode_analytics(TYPED, engine="pyarrow")
+    assert table.column_names == [h["name"] for h in TYPED["headers"]]
+    assert table.schema.field("value").type == pa.float64()
+    assert table.schema.field("count").type == pa.int64()
+    assert table.schema.field("avg").type == pa.float64()
+    assert table.schema.field("flag").type == pa.bool_()
+    assert table.schema.field("date").type == pa.timestamp("ms")
+    assert table.schema.field("other").type == pa.string()
+    assert table.column("value").to_pylist() == [1.5, None]
+    assert table.column("other").to_pylist() == ["x", None]
+    assert table.column("flag").to_pylist() == [True, None]
+
+
+@responses.activate
+def test_get_analytics_decode(api):
+    analytics_server([])
+    result = api.get_analytics(PARAMS, max_cells=4)
+    columns = result.decode()
+    assert columns["value"] == [1.5] * 16 and columns["dx"][0] == "a"
@@ -0,0 +1,240 @@
+import json
+
+import pytest
+import requests
+import responses
+
+from dhis2 import exceptions, Api
+from dhis2.importer import AsyncImportJob, run_async_imports, wait_for_async_import
+from .common import BASEURL, API_URL
+
+
+@pytest.fixture  # BASE FIXTURE
+def api():
+    return Api(BASEURL, "admin", "district")
+
+
+def job_started(job_id, job_type="DATAVALUE_IMPORT"):
+    return {
+        "httpStatus": "OK",
+        "httpStatusCode": 200,
+        "status": "OK",
+        "message": "Initiated dataValueImport",
+        "response": {
+            "name": "dataValueImport",
+            "id": job_id,
+            "jobType": job_type,
+            "relativeNotifierEndpoint": "/api/system/tasks/{}/{}".format(job_type, job_id),
+        },
+    }
+
+
+def task(completed):
+    return [{"level": "INFO", "category": "DATAVALUE_IMPORT", "completed": completed, "message": "..."}]
+
+
+def summary(imported, conflicts=None):
+    return {
+        "responseType": "ImportSummary",
+        "status": "SUCCESS" if not conflicts else "WARNING",
+        "importCount": {"imported": imported, "updated": 0, "ignored": len(conflicts or []), "deleted": 0},
+        "conflicts": conflicts or [],
+    }
+
+
+def add_job(job_id, polls, imported, conflicts=None, job_type="DATAVALUE_IMPORT"):
+    for completed in polls:
+        responses.add(
+            responses.GET,
+            "{}/system/tasks/{}/{}.json".format(API_URL, job_type, job_id),
+            json=task(completed),
+        )
+    responses.add(
+        responses.GET,
+        "{}/system/taskSummaries/{}/{}.json".format(API_URL, job_type, job_id),
+        json=summary(imported, conflicts),
+    )
+
+
+@responses.activate
+def test_import_async(api):
+    responses.add(responses.POST, "{}/dataValueSets".format(API_URL), json=job_started("YR1UxOUXmzT"))
+    add_job("YR1UxOUXmzT", [False, False, True], 3)
+
+    payload = {"dataValues": [{"value": 1}, {"value": 2}, {"value": 3}]}
+    result = api.import_async("dataValueSets", json=payload, params={"dryRun": "true"}, poll_interval=0)
+
+    assert "async=true" in responses.calls[0].request.url
+    assert "dryRun=true" in responses.calls[0].request.url
+    assert json.loads(responses.calls[0].request.body) == payload
+    assert len(responses.calls) == 5  # post, 3 polls, summary
+    assert result.status_ok
+    assert result.imported == 3
+    assert result.raw["importCount"]["imported"] == 3
+    assert "imported=3" in repr(result)
+
+
+@responses.activate
+def test_import_async_params_list(api):
+    responses.add(responses.POST, "{}/metadata".format(API_URL), json=job_started("abc", "METADATA_IMPORT"))
+    add_job("abc", [True], 1, job_type="METADATA_IMPORT")
+    api.import_async("metadata", json={"dataElements": [{}]}, params=[("async", "false"), ("a", "b")], poll_interval=0)
+    url = responses.calls[0].request.url
+    assert "async=true" in url and "async=false" not in url and "a=b" in url
+
+
+@responses.activate
+def test_import_async_job_type_from_endpoint(api):
+    started = job_started("abc")
+    del started["response"]["jobType"]
+    responses.add(responses.POST, "{}/events".format(API_URL), json=started)
+    add_job("abc", [True], 1, job_type="EVENT_IMPORT")
+    assert api.import_async("events", json={"events": [{}]}, poll_interval=0).imported == 1
+
+
+@responses.activate
+def test_import_async_no_job(api):
+    responses.add(responses.POST, "{}/dataValueSets".format(API_URL), json={"status": "OK"})
+    with pytest.raises(exceptions.ClientException):
+        api.import_async("dataValueSets", json={"dataValues": [{}]})
+
+
+@responses.activate
+def test_import_async_timeout(api):
+    responses.add(responses.POST, "{}/dataValueSets".format(API_URL), json=job_started("abc"))
+    add_job("abc", [False] * 3, 1)
+    with pytest.raises(exceptions.ClientException):
+        api.import_async("dataValueSets", json={"dataValues": [{}]}, wait_timeout=0, poll_interval=0)
+
+
+@responses.activate
+def test_async_job_backoff(api):
+    responses.add(responses.GET, "{}/system/tasks/DATAVALUE_IMPORT/abc.json".format(API_URL), json={"completed": False})
+    job = AsyncImportJob(api, "dataValueSets", job_started("abc"), poll_interval=1, max_poll_interval=3, backoff=2)
+    intervals = []
+    for _ in range(3):
+        assert job.poll() is False
+        intervals.append(job.interval)
+    assert intervals == [2, 3, 3]
+    assert "abc" in repr(job)
+
+
+@responses.activate
+def test_import_async_partitioned(api):
+    url = "{}/dataValueSets".format(API_URL)
+    for i in range(5):
+        responses.add(responses.POST, url, json=job_started("job{}".format(i)))
+    conflict = {"object": "DiszpKrYNg8", "value": "Org unit closed"}
+    add_job("job0", [False, True], 2)
+    add_job("job1", [True], 2)
+    add_job("job2", [False, False, True], 1, conflicts=[conflict])
+    add_job("job3", [True], 2)
+    add_job("job4", [True], 1)
+
+    payload = {"dataValues": [{"value": i} for i in range(9)]}
+    report = api.import_async_partitioned("dataValueSets", json=payload, thresh=2, max_jobs=2, poll_interval=0)
+
+    assert report.chunks == 5
+    assert report.objects == 9
+    assert report.import_count["imported"] == 8
+    assert report.import_count["ignored"] == 1
+    assert report.conflicts == [dict(conflict, kind="conflict", chunk=2)]
+
+
+class FakeApi(object):
+    """Records how many jobs are running on the 'server' at the same time"""
+
+    def __init__(self, polls_until_done=2, fail_post=(), fail_poll=(), error=None):
+        self.polls_until_done = polls_until_done
+        self.fail_post = fail_post
+        self.fail_poll = fail_poll
+        self.error = error  # raised instead of a RequestException
+        self.jobs = {}
+        self.max_running = 0
+
+    def post(self, endpoint, json=None, params=None):
+        job_id = "job{}".format(len(self.jobs))
+        if len(self.jobs) in self.fail_post:
+            self.jobs[job_id] = None
+            raise self.error or exceptions.RequestException(500, endpoint, "Internal server error")
+        self.jobs[job_id] = [0, len(json["dataValues"])]
+        running = sum(1 for j in self.jobs.values() if j and j[0] < self.polls_until_done)
+        self.max_running = max(self.max_running, running)
+        return Response(job_started(job_id))
+
+    def get(self, endpoint, **kwargs):
+        _, kind, _, job_id = endpoint.split("/")
+        if kind == "tasks":
+            if int(job_id[3:]) in self.fail_poll:
+                raise self.error or exceptions.RequestException(404, endpoint, "Not found")
+            self.jobs[job_id][0] += 1
+            return Response(task(self.jobs[job_id][0] >= self.polls_until_done))
+        return Response(summary(self.jobs[job_id][1]))
+
+
+class Response(object):
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+@pytest.mark.parametrize("max_jobs", [1, 2, 5])
+def test_run_async_imports_bounded(max_jobs):
+    api = FakeApi()
+    payloads = ({"dataValues": [{}] * 3} for _ in range(7))
+    report = run_async_imports(api, "dataValueSets", payloads, max_jobs=max_jobs, poll_interval=0)
+    assert report.chunks == 7
+    assert report.import_count["imported"] == 21
+    assert 1 <= api.max_running <= max_jobs
+
+
+def test_run_async_imports_errors():
+    api = FakeApi(fail_post=(1,), fail_poll=(2,))
+    payloads = [{"dataValues": [{}]} for _ in range(4)]
+    report = run_async_imports(api, "dataValueSets", payloads, max_jobs=2, poll_interval=0)
+    assert report.chunks == 4
+    assert sorted(chunk for chunk, _ in report.errors) == [1, 2]
+    assert report.import_count["imported"] == 2
+    assert not report.ok
+
+
+@pytest.mark.parametrize(
+    "error",
+    [requests.ConnectionError("connection reset"), requests.Timeout(), exceptions.ClientException("no job id")],
+)
+def test_run_async_imports_errors_without_response(error):
+    api = FakeApi(fail_post=(1,), fail_poll=(2,), error=error)
+    payloads = [{"dataValues": [{}]} for _ in range(5)]
+    report = run_async_imports(api, "dataValueSets", payloads, max_jobs=2, poll_interval=0)
+    assert report.chunks == 5
+    assert sorted(chunk for chunk, _ in report.errors) == [1, 2]
+    assert report.import_count["imported"] == 3  # the other jobs were polled to the end
+    assert not report.ok
+
+
+def test_run_async_imports_timeout():
+    api = FakeApi(polls_until_done=1000)
+    report = run_async_imports(api, "dataValueSets", [{"dataValues": [{}]}], timeout=0, poll_interval=0)
+    assert len(report.errors) == 1
+
+
+def test_run_async_imports_invalid_max_jobs():
+    with pytest.raises(exceptions.ClientException):
+        run_async_imports(FakeApi(), "dataValueSets", [], max_jobs=0)
+
+
+def test_wait_for_async_import_sleeps_until_next_poll():
+    api = FakeApi(polls_until_done=3)
+    job = AsyncImportJob.submit(api, "dataValueSets", {"dataValues": [{}]}, poll_interval=5)
+    slept = []
+    assert wait_for_async_import(job, sleep=slept.append)["importCount"]["imported"] == 1
+    assert len(slept) == 3
+    assert 4 < slept[0] <= 5
+
+
+@pytest.mark.parametrize("payload", [None, {}, {"a": [1], "b": [2]}, {"a": []}])
+def test_import_async_partitioned_invalid(api, payload):
+    with pytest.raises(exceptions.ClientException):
+        api.import_async_partitioned("dataValueSets", json=payload)
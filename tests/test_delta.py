@@ -0,0 +1,152 @@
+import json
+import re
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import responses
+
+from dhis2 import Api, compute_metadata_delta, exceptions
+from dhis2.delta import MetadataDelta, canonical_hash
+from .common import BASEURL, API_URL
+
+
+@pytest.fixture  # BASE FIXTURE
+def api():
+    return Api(BASEURL, "admin", "district")
+
+
+def test_canonical_hash():
+    obj = {
+        "id": "de000000001",
+        "name": "ANC",
+        "lastUpdated": "2021-01-01",
+        "organisationUnits": [{"id": "b"}, {"id": "a"}],
+        "categories": [{"id": "b"}, {"id": "a"}],
+    }
+    same = {
+        "categories": [{"id": "b"}, {"id": "a"}],
+        "name": "ANC",
+        "organisationUnits": [{"id": "a"}, {"id": "b"}],  # unordered
+        "id": "de000000001",
+        "href": "https://play.dhis2.org/api/dataElements/de000000001",
+    }
+    assert canonical_hash(obj) == canonical_hash(same)
+    assert canonical_hash(obj) != canonical_hash(dict(obj, categories=[{"id": "a"}, {"id": "b"}]))  # ordered
+    assert canonical_hash(obj) != canonical_hash(dict(obj, name="ANC 1"))
+    assert canonical_hash(obj, ignore=()) != canonical_hash(same, ignore=())
+
+
+def test_canonical_hash_shape():
+    local = {"id": "x", "name": "ANC", "dataSetElements": [{"dataSet": {"id": "ds"}}, {"dataElement": {"id": "de"}}]}
+    server = {
+        "id": "x",
+        "name": "ANC",
+        "domainType": "AGGREGATE",  # a server default, not in the local object
+        "dataSetElements": [
+            {"dataElement": {"id": "de"}, "categoryCombo": {"id": "cc"}},
+            {"dataSet": {"id": "ds"}, "categoryCombo": {"id": "cc"}},
+        ],
+    }
+    assert canonical_hash(server, local) == canonical_hash(local)
+    assert canonical_hash(server) != canonical_hash(local)
+    assert canonical_hash(dict(server, name=None), local) != canonical_hash(local)
+
+
+def test_canonical_hash_unordered_by_type():
+    members = [{"id": "de1"}, {"id": "de2"}]
+    reordered = members[::-1]
+    group = {"id": "g", "dataElements": members}
+    assert canonical_hash(group, object_type="dataElementGroups") == canonical_hash(
+        dict(group, dataElements=reordered), object_type="dataElementGroups"
+    )
+    # the data elements of a section are in the order of the form
+    section = {"id": "s", "dataSet": {"id": "ds"}, "dataElements": members}
+    assert canonical_hash(section, object_type="sections") != canonical_hash(
+        dict(section, dataElements=reordered), object_type="sections"
+    )
+    # (type, field) pairs apply to the fields of the object, not to nested objects
+    data_set = {"id": "ds", "sections": [section]}
+    assert canonical_hash(data_set, object_type="dataSets") != canonical_hash(
+        {"id": "ds", "sections": [dict(section, dataElements=reordered)]}, object_type="dataSets"
+    )
+
+
+SERVER = {
+    "dataElements": {
+        "de000000001": {"id": "de000000001", "name": "ANC 1", "valueType": "NUMBER", "lastUpdated": "2021"},
+        "de000000002": {"id": "de000000002", "name": "ANC 2", "valueType": "NUMBER"},
+        "de000000003": {"id": "de000000003", "name": "ANC 3", "valueType": "NUMBER", "code": "MAL_3"},
+        "de000000009": {"id": "de000000009", "name": "Old", "valueType": "NUMBER", "code": "MAL_9"},
+    },
+    "indicators": {},
+}
+
+
+def metadata_server(calls):
+    def callback(request):
+        query = parse_qs(urlparse(request.url).query)
+        key = urlparse(request.url).path.split("/")[-1].replace(".json", "")
+        calls.append((key, query))
+        objects = SERVER[key]
+        match = re.match(r"^id:in:\[(.*)\]$", query["filter"][0])
+        if match:
+            found = [objects[uid] for uid in match.group(1).split(",") if uid in objects]
+            return 200, {}, json.dumps({key: found})
+        prefix = query["filter"][0].split(":", 2)[2]
+        found = [{"id": o["id"]} for o in objects.values() if o.get("code", "").startswith(prefix)]
+        return 200, {}, json.dumps({key: found, "pager": {"page": 1, "pageCount": 1}})
+
+    for key in SERVER:
+        responses.add_callback(responses.GET, "{}/{}.json".format(API_URL, key), callback=callback)
+
+
+@responses.activate
+def test_compute_metadata_delta(api):
+    calls = []
+    metadata_server(calls)
+    payload = {
+        "system": {"version": "2.36"},
+        "dataElements": [
+            {"id": "de000000001", "name": "ANC 1", "valueType": "NUMBER", "lastUpdated": "2022"},
+            {"id": "de000000002", "name": "ANC 2 renamed", "valueType": "NUMBER"},
+            {"id": "de000000003", "name": "ANC 3", "valueType": "NUMBER", "code": "MAL_3"},
+            {"id": "de000000004", "name": "New", "valueType": "TEXT"},
+            {"name": "No id"},
+        ],
+        "indicators": [{"name": "no id either"}],
+    }
+    delta = compute_metadata_delta(api, payload, batch_size=2, scope={"dataElements": "code:$like:MAL_"})
+
+    assert [o.get("id") for o in delta.created["dataElements"]] == ["de000000004", None]
+    assert [o["id"] for o in delta.changed["dataElements"]] == ["de000000002"]
+    assert delta.unchanged == {"dataElements": 2, "indicators": 0}
+    assert delta.deleted == {"dataElements": [{"id": "de000000009"}]}
+    assert repr(delta) == "MetadataDelta(created=3, changed=1, unchanged=2, deleted=1)"
+    assert not delta.empty
+
+    assert [list(p) for p in delta.payloads()] == [["dataElements"], ["indicators"]]
+    assert [o.get("id") for o in next(delta.payloads())["dataElements"]] == ["de000000004", None, "de000000002"]
+    assert list(delta.payloads(deletions=True)) == [{"dataElements": [{"id": "de000000009"}]}]
+
+    batches = [q["filter"][0] for key, q in calls if "fields" in q and q["fields"] == [":owner"]]
+    assert sorted(batches) == ["id:in:[de000000001,de000000002]", "id:in:[de000000003,de000000004]"]
+    assert all(q["paging"] == ["false"] for key, q in calls if "paging" in q)
+    assert not any(key == "indicators" for key, _ in calls)  # nothing to look up
+
+
+@responses.activate
+def test_compute_metadata_delta_unchanged(api):
+    metadata_server([])
+    payload = {"dataElements": [{"id": "de000000003", "code": "MAL_3", "name": "ANC 3"}]}
+    delta = compute_metadata_delta(api, payload, scope={"dataElements": "code:$like:MAL_3"})
+    assert delta.empty and list(delta.payloads()) == [] and list(delta.payloads(deletions=True)) == []
+
+
+@pytest.mark.parametrize("kwargs", [{"batch_size": 0}, {"max_workers": 0}])
+def test_compute_metadata_delta_invalid(api, kwargs):
+    with pytest.raises(exceptions.ClientException):
+        compute_metadata_delta(api, {}, **kwargs)
+
+
+def test_metadata_delta_empty():
+    assert MetadataDelta({}, {}, {}, {}).empty
@@ -10,7 +10,7 @@ import responses
 from .common import BASEURL, API_URL, override_environ
 
 from dhis2.api import Api, search_auth_file
-from dhis2 import exceptions
+from dhis2 import exceptions, utils
 
 
 @pytest.fixture  # BASE FIXTURE
@@ -267,6 +267,103 @@ def test_search_auth_file_not_found():
         search_auth_file("not_here.json")
 
 
+@pytest.fixture
+def fake_home(monkeypatch):
+    """An empty home folder, current folder and no DHIS_HOME / XDG_CONFIG_HOME"""
+    home = tempfile.mkdtemp()
+    cwd = tempfile.mkdtemp()
+    monkeypatch.setenv("HOME", home)
+    monkeypatch.delenv("DHIS_HOME", raising=False)
+    monkeypatch.delenv("XDG_CONFIG_HOME", raising=False)
+    monkeypatch.chdir(cwd)
+    utils._auth_file_cache.clear()
+    yield home
+    shutil.rmtree(home)
+    shutil.rmtree(cwd)
+
+
+def touch(*parts):
+    path = os.path.join(*parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "w").close()
+    return path
+
+
+def test_search_auth_file_known_locations(fake_home, monkeypatch):
+    nested = touch(fake_home, "projects", "dhis", "dish.json")
+    assert search_auth_file() == nested
+    home = touch(fake_home, "dish.json")
+    assert search_auth_file() == nested  # cached while it exists
+    utils._auth_file_cache.clear()
+    assert search_auth_file() == home
+    dot_dhis2 = touch(fake_home, ".dhis2", "dish.json")
+    cwd = touch(os.getcwd(), "dish.json")
+    config = touch(fake_home, ".config", "dhis2", "dish.json")
+    xdg = tempfile.mkdtemp()
+    for expected in (config, cwd, dot_dhis2, home):
+        utils._auth_file_cache.clear()
+        assert search_auth_file() == expected
+        os.remove(expected)
+    utils._auth_file_cache.clear()
+    touch(os.getcwd(), "dish.json")
+    monkeypatch.setenv("XDG_CONFIG_HOME", xdg)
+    config = touch(xdg, "dhis2", "dish.json")
+    assert search_auth_file() == config
+    shutil.rmtree(xdg)
+
+
+def test_search_auth_file_bounded(fake_home):
+    touch(fake_home, "a", "b", "c", "d", "e", "dish.json")  # too deep
+    touch(fake_home, "code", "node_modules", "dish.json")
+    touch(fake_home, ".cache", "dish.json")
+    os.symlink(os.path.join(fake_home, "a"), os.path.join(fake_home, "link"))
+    with pytest.raises(exceptions.ClientException):
+        search_auth_file()
+    found = touch(fake_home, "a", "b", "c", "d", "dish.json")
+    assert search_auth_file() == found
+    assert search_auth_file("dish.json", max_depth=5) == found  # the shallowest wins
+    shallow = touch(fake_home, "z", "dish.json")
+    assert search_auth_file() == found  # cached
+    os.remove(found)
+    assert search_auth_file() == shallow
+
+
+def test_search_auth_file_unreadable_folder(fake_home, monkeypatch):
+    locked = os.path.join(fake_home, "locked")
+    touch(locked, "dish.json")
+    scandir = os.scandir
+
+    def denied(path):
+        if path == locked:
+            raise PermissionError(path)
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", denied)
+    with pytest.raises(exceptions.ClientException):
+        search_auth_file()
+
+
+def test_search_auth_file_large_home_is_fast(fake_home):
+    import time
+
+    # a home folder with many vendor, hidden and deep folders that must not be searched
+    for top in ("node_modules", ".venv", ".cache", os.path.join("data", "x", "y", "z", "deep")):
+        for i in range(40):
+            for j in range(25):
+                os.makedirs(os.path.join(fake_home, top, str(i), str(j)))
+    expected = touch(fake_home, "work", "dhis2", "dish.json")
+
+    start = time.perf_counter()
+    for _ in os.walk(fake_home):
+        pass
+    walk_all = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assert search_auth_file() == expected
+    bounded = time.perf_counter() - start
+    assert bounded < walk_all / 5
+
+
 def test_str():
     api = Api("https://play.dhis2.org/demo", "admin", "district")
     assert str(api).startswith("DHIS2")
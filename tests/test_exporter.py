@@ -0,0 +1,224 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import responses
+
+from dhis2 import Api, exceptions
+from dhis2.checkpoint import Checkpoint, fingerprint
+from dhis2.exporter import CHECKPOINT_FILENAME
+from .common import BASEURL, API_URL
+
+
+@pytest.fixture  # BASE FIXTURE
+def api():
+    return Api(BASEURL, "admin", "district")
+
+
+TOTALS = {"dataElements": 5, "organisationUnits": 3, "indicators": 0}
+
+
+def metadata_server(page_size, fail=None, order="id:asc", slow=None):
+    """
+    Register a paged metadata endpoint for all TOTALS
+    :param fail: (type, page) to answer with a 500
+    :param order: the expected order parameter
+    :param slow: (type, page) to answer late
+    :return: list of requested (type, page), in the order they are answered
+    """
+    calls = []
+
+    def callback(request):
+        url = urlparse(request.url)
+        metadata_type = url.path.rsplit("/", 1)[-1].split(".")[0]
+        query = parse_qs(url.query)
+        page = int(query["page"][0])
+        assert int(query["pageSize"][0]) == page_size
+        assert query["fields"] == [":owner"]
+        assert query["order"] == [order]
+        if (metadata_type, page) == slow:
+            time.sleep(0.2)
+        calls.append((metadata_type, page))
+        if (metadata_type, page) == fail:
+            return 500, {}, json.dumps({"message": "boom"})
+        total = TOTALS[metadata_type]
+        start = (page - 1) * page_size
+        objects = [{"id": "{}{}".format(metadata_type, i)} for i in range(start, min(start + page_size, total))]
+        page_count = max(1, -(-total // page_size))
+        body = {"pager": {"page": page, "pageCount": page_count, "total": total}, metadata_type: objects}
+        return 200, {}, json.dumps(body)
+
+    responses.add_callback(responses.GET, re.compile(API_URL + r"/\w+\.json"), callback=callback)
+    return calls
+
+
+def read_jsonl(directory, metadata_type):
+    with open(os.path.join(directory, "{}.jsonl".format(metadata_type))) as f:
+        return [json.loads(line)["id"] for line in f]
+
+
+@responses.activate
+def test_export_metadata_directory(api):
+    calls = metadata_server(page_size=2)
+    directory = tempfile.mkdtemp()
+    counts = api.export_metadata(list(TOTALS), directory=directory, page_size=2, workers=3)
+
+    assert counts == TOTALS
+    assert read_jsonl(directory, "dataElements") == ["dataElements{}".format(i) for i in range(5)]
+    assert read_jsonl(directory, "organisationUnits") == ["organisationUnits{}".format(i) for i in range(3)]
+    assert read_jsonl(directory, "indicators") == []
+    assert sorted(calls) == sorted(
+        [("dataElements", p) for p in (1, 2, 3)] + [("organisationUnits", p) for p in (1, 2)] + [("indicators", 1)]
+    )
+    assert not os.path.exists(os.path.join(directory, CHECKPOINT_FILENAME))
+
+
+@responses.activate
+def test_export_metadata_prefetches_pages(api):
+    # once the page count is known, pages 2-4 are requested together, page 3 and 4 wait for page 2
+    calls = metadata_server(page_size=1, slow=("dataElements", 2))
+    directory = tempfile.mkdtemp()
+    counts = api.export_metadata(["dataElements"], directory=directory, page_size=1, workers=3)
+    assert counts == {"dataElements": 5}
+    assert read_jsonl(directory, "dataElements") == ["dataElements{}".format(i) for i in range(5)]
+    assert calls.index(("dataElements", 3)) < calls.index(("dataElements", 2))
+    assert sorted(calls) == [("dataElements", p) for p in range(1, 6)]
+
+
+@responses.activate
+def test_export_metadata_prefetched_pages_after_error(api):
+    directory = tempfile.mkdtemp()
+    checkpoint = os.path.join(directory, CHECKPOINT_FILENAME)
+    calls = metadata_server(page_size=1, fail=("dataElements", 2), slow=("dataElements", 3))
+    with pytest.raises(exceptions.RequestException):
+        api.export_metadata(["dataElements"], directory=directory, page_size=1, workers=3)
+    assert ("dataElements", 3) in calls  # answered after page 2 failed, but not written
+    assert read_jsonl(directory, "dataElements") == ["dataElements0"]
+    assert Checkpoint(checkpoint).state["types"]["dataElements"]["page"] == 1
+
+
+@responses.activate
+def test_export_metadata_sink(api):
+    metadata_server(page_size=4)
+    received = {}
+
+    def sink(metadata_type, objects):
+        received.setdefault(metadata_type, []).extend(o["id"] for o in objects)
+
+    counts = api.export_metadata(["dataElements", "organisationUnits"], sink=sink, page_size=4, workers=1)
+    assert counts == {"dataElements": 5, "organisationUnits": 3}
+    assert len(received["dataElements"]) == 5 and len(received["organisationUnits"]) == 3
+
+
+@responses.activate
+def test_export_metadata_order(api):
+    metadata_server(page_size=4, order="name:desc")
+    params = {"order": "name:desc"}
+    counts = api.export_metadata(["dataElements"], sink=lambda *args: None, page_size=4, params=params)
+    assert counts == {"dataElements": 5}
+    assert params == {"order": "name:desc"}
+
+
+@responses.activate
+def test_export_metadata_resumes_from_checkpoint(api):
+    directory = tempfile.mkdtemp()
+    checkpoint = os.path.join(directory, CHECKPOINT_FILENAME)
+    calls = metadata_server(page_size=2, fail=("dataElements", 2))
+    with pytest.raises(exceptions.RequestException):
+        api.export_metadata(["dataElements", "organisationUnits"], directory=directory, page_size=2, workers=1)
+
+    state = Checkpoint(checkpoint).state["types"]
+    assert state["dataElements"]["page"] == 1 and state["dataElements"]["pageCount"] == 3
+    assert read_jsonl(directory, "dataElements") == ["dataElements0", "dataElements1"]
+
+    # a crash after writing a page but before checkpointing it leaves extra lines behind
+    with open(os.path.join(directory, "dataElements.jsonl"), "a") as f:
+        f.write('{"id": "dataElements2"}\n')
+
+    responses.reset()
+    calls = metadata_server(page_size=2)
+    counts = api.export_metadata(["dataElements", "organisationUnits"], directory=directory, page_size=2, workers=1)
+    assert counts["dataElements"] == 5
+    assert read_jsonl(directory, "dataElements") == ["dataElements{}".format(i) for i in range(5)]
+    assert read_jsonl(directory, "organisationUnits") == ["organisationUnits{}".format(i) for i in range(3)]
+    assert ("dataElements", 1) not in calls
+    assert not os.path.exists(checkpoint)
+
+
+@responses.activate
+def test_export_metadata_sink_error_is_checkpointed(api):
+    metadata_server(page_size=2)
+    checkpoint = os.path.join(tempfile.mkdtemp(), "export.json")
+
+    def sink(metadata_type, objects):
+        if metadata_type == "organisationUnits":
+            raise ValueError("sink is full")
+
+    with pytest.raises(ValueError):
+        api.export_metadata(
+            ["dataElements", "organisationUnits"], sink=sink, page_size=2, workers=2, checkpoint=checkpoint
+        )
+    state = Checkpoint(checkpoint).state
+    assert "organisationUnits" not in state["types"]
+    assert state["types"]["dataElements"]["page"] >= 1
+
+
+def test_export_metadata_checkpoint_of_other_export(api):
+    directory = tempfile.mkdtemp()
+    store = Checkpoint(os.path.join(directory, CHECKPOINT_FILENAME))
+    store.state = {"job": "something else", "types": {}}
+    store.save()
+    with pytest.raises(exceptions.ClientException):
+        api.export_metadata(["dataElements"], directory=directory)
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"types": ["dataElements"]},  # neither directory nor sink
+        {"types": ["dataElements"], "directory": "x", "sink": print},
+        {"types": "dataElements", "sink": print},
+        {"types": [], "sink": print},
+        {"types": ["dataElements"], "sink": print, "workers": 0},
+        {"types": ["dataElements"], "sink": print, "page_size": 0},
+    ],
+)
+def test_export_metadata_invalid(api, kwargs):
+    with pytest.raises(exceptions.ClientException):
+        api.export_metadata(**kwargs)
+
+
+def test_checkpoint_roundtrip():
+    path = os.path.join(tempfile.mkdtemp(), "state.json")
+    store = Checkpoint(path)
+    assert store.state == {} and not store.exists
+    store.state["page"] = 3
+    store.save()
+    assert store.exists and Checkpoint(path).state == {"page": 3}
+    assert repr(store) == "Checkpoint({})".format(path)
+    store.delete()
+    assert store.state == {} and not store.exists
+    store.delete()  # missing file is fine
+
+
+@pytest.mark.parametrize("content", ["{not json", "[1, 2]"])
+def test_checkpoint_invalid_file(content):
+    path = os.path.join(tempfile.mkdtemp(), "state.json")
+    with open(path, "w") as f:
+        f.write(content)
+    with pytest.raises(exceptions.ClientException):
+        Checkpoint(path)
+
+
+def test_fingerprint():
+    assert fingerprint({"a": 1, "b": [1, 2]}) == fingerprint({"b": [1, 2], "a": 1})
+    assert fingerprint("x", 1) != fingerprint("x", 2)
+    # the JSON text is hashed, without building it
+    parts = ("dataValues", [{"value": str(i), "b": [i, None]} for i in range(2500)], {"x": (1, 2)}, [])
+    text = json.dumps(parts, sort_keys=True, separators=(",", ":"))
+    assert fingerprint(*parts) == hashlib.sha256(text.encode("utf-8")).hexdigest()
@@ -0,0 +1,193 @@
+import json
+import os
+import tempfile
+
+import pytest
+import responses
+
+from dhis2 import Api, DataValueFingerprints, exceptions
+from .common import BASEURL, API_URL
+
+
+@pytest.fixture  # BASE FIXTURE
+def api():
+    return Api(BASEURL, "admin", "district")
+
+
+@pytest.fixture
+def path():
+    return os.path.join(tempfile.mkdtemp(), "sync.fingerprints")
+
+
+def data_value(de, value, **kwargs):
+    return dict({"dataElement": de, "period": "202101", "orgUnit": "ImspTQPwCqd", "value": value}, **kwargs)
+
+
+def summary(status="SUCCESS", imported=0, updated=0, ignored=0):
+    counts = {"imported": imported, "updated": updated, "ignored": ignored, "deleted": 0}
+    return {"status": status, "importCount": counts}
+
+
+def test_filter_and_record(path):
+    values = [data_value("de{:09d}".format(i), str(i)) for i in range(5)]
+    with DataValueFingerprints(path) as store:
+        assert store.filter({"dataValues": values}) == {"dataValues": values}
+        assert store.record({"dataValues": values}) == 5 and len(store) == 5
+
+    with DataValueFingerprints(path) as store:  # persisted
+        changed = [
+            values[0],
+            data_value("de000000001", 1),  # same as "1"
+            data_value("de000000002", "2", comment="checked"),
+            data_value("de000000003", "3", categoryOptionCombo="Prlt0C1RF0s"),  # another combo
+            data_value("de000000004", "4.0"),
+            data_value("de000000005", "5"),
+            {"dataElement": "de000000006", "value": "6"},  # can't be identified
+        ]
+        assert store.filter({"dataValues": changed})["dataValues"] == changed[2:]
+        assert repr(store) == "DataValueFingerprints({})".format(path)
+        store.clear()
+        assert len(store) == 0
+
+
+def test_key():
+    assert DataValueFingerprints.key(data_value("de000000001", "1")) == ("de000000001", "202101", "ImspTQPwCqd", "", "")
+    assert DataValueFingerprints.key({"dataElement": "de000000001", "period": "202101"}) is None
+    defaults = {"orgUnit": "ImspTQPwCqd", "attributeOptionCombo": "HllvX50cXC0"}
+    assert DataValueFingerprints.key({"dataElement": "de000000001", "period": 202101}, defaults)[2:] == (
+        "ImspTQPwCqd", "", "HllvX50cXC0"
+    )
+
+
+def test_data_value_set_defaults(path):
+    with DataValueFingerprints(path) as store:
+        payload = {
+            "dataSet": "pBOMPrpg1QX",
+            "period": "202101",
+            "orgUnit": "ImspTQPwCqd",
+            "dataValues": [{"dataElement": "de000000001", "value": "1"}],
+        }
+        assert store.record(payload) == 1
+        assert store.filter(payload)["dataValues"] == []
+        assert store.filter(dict(payload, period="202102"))["dataValues"] == payload["dataValues"]
+        assert store.filter({"dataValues": [data_value("de000000001", "1")]})["dataValues"] == []
+
+
+def test_value_fields(path):
+    with DataValueFingerprints(path, value_fields=["value"]) as store:
+        store.record({"dataValues": [data_value("de000000001", "1", followup=False)]})
+        assert store.filter({"dataValues": [data_value("de000000001", "1", followup=True)]})["dataValues"] == []
+    with DataValueFingerprints(path) as store:
+        assert store.value_hash({"value": "1", "followup": True}) == store.value_hash({"value": 1, "followup": "true"})
+        assert store.value_hash({"value": "1", "deleted": True}) != store.value_hash({"value": "1"})
+
+
+@pytest.mark.parametrize(
+    "response,stored",
+    [
+        (summary(imported=1), True),
+        ({"status": "OK", "response": summary(updated=1)}, True),  # DHIS2 2.36+
+        (summary(status="WARNING", imported=1, ignored=1), False),
+        (summary(status="ERROR"), False),
+        ({"status": "OK"}, False),  # no import summary
+    ],
+)
+def test_confirm(path, response, stored):
+    payload = {"dataValues": [data_value("de000000001", "1")]}
+    with DataValueFingerprints(path) as store:
+        assert store.confirm(payload, response) is stored
+        assert len(store) == (1 if stored else 0)
+
+
+def test_closed_and_invalid_store(path):
+    store = DataValueFingerprints(path)
+    store.close()
+    store.close()
+    with pytest.raises(exceptions.ClientException):
+        len(store)
+    with open(path, "w") as f:
+        f.write("not a database" * 100)
+    with pytest.raises(exceptions.ClientException):
+        DataValueFingerprints(path)
+
+
+def data_value_server(bodies, ignore=()):
+    def callback(request):
+        body = json.loads(request.body)
+        bodies.append([dv["dataElement"] for dv in body["dataValues"]])
+        ignored = [dv for dv in body["dataValues"] if dv["dataElement"] in ignore]
+        if ignored:
+            return 200, {}, json.dumps(summary("WARNING", len(body["dataValues"]) - len(ignored), 0, len(ignored)))
+        return 200, {}, json.dumps(summary(imported=len(body["dataValues"])))
+
+    responses.add_callback(responses.POST, API_URL + "/dataValueSets", callback=callback)
+
+
+@responses.activate
+def test_post_partitioned_fingerprints(api, path):
+    bodies = []
+    data_value_server(bodies, ignore=("de000000003",))
+    data = {"dataValues": [data_value("de{:09d}".format(i), str(i)) for i in range(6)]}
+    assert len(list(api.post_partitioned("dataValueSets", json=data, thresh=2, fingerprints=path))) == 3
+    with DataValueFingerprints(path) as store:
+        assert len(store) == 4  # the chunk with an ignored value is not stored
+
+    data["dataValues"][5]["value"] = "changed"
+    bodies.clear()
+    with DataValueFingerprints(path) as store:
+        list(api.post_partitioned("dataValueSets", json=data, thresh=2, fingerprints=store))
+        assert bodies == [["de000000002", "de000000003"], ["de000000005"]]
+        store.record({"dataValues": data["dataValues"][2:4]})
+        assert list(api.post_partitioned("dataValueSets", json=data, thresh=2, fingerprints=store)) == []
+        assert len(bodies) == 2
+        assert len(store) == 6  # not closed by post_partitioned
+    assert list(api.post_partitioned("dataValueSets", json=data, thresh=2, fingerprints=path)) == []
+
+
+@responses.activate
+def test_post_partitioned_fingerprints_failed_chunk(api, path):
+    responses.add(responses.POST, API_URL + "/dataValueSets", body="Conflict", status=409)
+    data = {"dataValues": [data_value("de000000001", "1")]}
+    with pytest.raises(exceptions.RequestException):
+        list(api.post_partitioned("dataValueSets", json=data, fingerprints=path))
+    with DataValueFingerprints(path) as store:
+        assert len(store) == 0
+
+
+def test_post_partitioned_fingerprints_other_endpoint(api, path):
+    with pytest.raises(exceptions.ClientException):
+        list(api.post_partitioned("events", json={"events": [{"event": "a"}]}, fingerprints=path))
+
+
+@pytest.mark.parametrize("params", [{"dryRun": "true"}, [("dryRun", True), ("importStrategy", "CREATE")]])
+@responses.activate
+def test_post_partitioned_fingerprints_dry_run(api, path, params):
+    bodies = []
+    data_value_server(bodies)
+    data = {"dataValues": [data_value("de{:09d}".format(i), str(i)) for i in range(3)]}
+    list(api.post_partitioned("dataValueSets", json=data, params=params, fingerprints=path))
+    with DataValueFingerprints(path) as store:
+        assert len(store) == 0
+        assert store.filter(data) == data
+    list(api.post_partitioned("dataValueSets", json=data, params={"dryRun": "false"}, fingerprints=path))
+    with DataValueFingerprints(path) as store:
+        assert len(store) == 3
+
+
+@responses.activate
+def test_post_partitioned_fingerprints_delete(api, path):
+    bodies = []
+    data_value_server(bodies)
+    data = {"dataValues": [data_value("de{:09d}".format(i), str(i)) for i in range(3)]}
+    list(api.post_partitioned("dataValueSets", json=data, fingerprints=path))
+
+    deletion = {"dataValues": data["dataValues"][:2]}
+    list(api.post_partitioned("dataValueSets", json=deletion, params={"importStrategy": "DELETE"}, fingerprints=path))
+    assert bodies[-1] == ["de000000000", "de000000001"]  # not left out because they are in the store
+    with DataValueFingerprints(path) as store:
+        assert len(store) == 1
+        assert store.forget({"dataValues": [{"dataElement": "x"}]}) == 0
+
+    bodies.clear()
+    list(api.post_partitioned("dataValueSets", json=data, fingerprints=path))  # re-created
+    assert bodies == [["de000000000", "de000000001"]]
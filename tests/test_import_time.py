@@ -0,0 +1,86 @@
+import os
+import statistics
+import subprocess
+import sys
+
+import pytest
+
+# cumulative time of `import dhis2` relative to that of requests (imported by it), median of runs
+# of the 2.3.0 release - measuring against requests keeps the budget independent of the machine's speed
+BASELINE_IMPORT_RATIO = float(os.environ.get("DHIS2_BASELINE_IMPORT_RATIO", 1.33))
+IMPORT_TIME_RUNS = 7
+LAZY_DEPENDENCIES = ("pygments", "logzero")
+
+
+def importtime(code):
+    """
+    Run code in a fresh interpreter with -X importtime
+    :return: dict of module name -> (self microseconds, cumulative microseconds)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="-X importtime and module __getattr__ need 3.7+")
+def test_import_does_not_load_lazy_dependencies():
+    modules = importtime("import dhis2")
+    assert "dhis2" in modules
+    for dependency in LAZY_DEPENDENCIES:
+        assert dependency not in modules
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="-X importtime and module __getattr__ need 3.7+")
+def test_import_time_budget():
+    ratios = []
+    for _ in range(IMPORT_TIME_RUNS):
+        modules = importtime("import dhis2")
+        ratios.append(modules["dhis2"][1] / modules["requests"][1])
+    ratio = statistics.median(ratios)
+    assert ratio <= BASELINE_IMPORT_RATIO, "import dhis2 took {:.2f}x the time of requests, {:.2f}x before".format(
+        ratio, BASELINE_IMPORT_RATIO
+    )
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="-X importtime and module __getattr__ need 3.7+")
+def test_import_does_not_load_subsystems():
+    modules = importtime("import dhis2")
+    for name in ("dhis2.analytics", "dhis2.importer", "dhis2.fingerprints", "dhis2.query", "sqlite3"):
+        assert name not in modules
+    assert "sqlite3" in importtime("from dhis2 import DataValueFingerprints")
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="-X importtime and module __getattr__ need 3.7+")
+@pytest.mark.parametrize(
+    "code,dependency",
+    [
+        ("from dhis2 import logger", "logzero"),
+        ("from dhis2 import setup_logger; setup_logger()", "logzero"),
+        ("from dhis2 import pretty_json; pretty_json({})", "pygments"),
+    ],
+)
+def test_lazy_dependencies_load_on_first_use(code, dependency):
+    assert dependency in importtime(code)
+
+
+def test_lazy_logger_attribute():
+    import dhis2
+    import logzero
+
+    assert dhis2.logger is logzero.logger
+    from dhis2.query import Query
+
+    assert dhis2.Query is Query
+    with pytest.raises(AttributeError):
+        dhis2.does_not_exist
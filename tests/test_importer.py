@@ -0,0 +1,362 @@
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+
+import pytest
+import requests
+import responses
+
+from dhis2 import Api, exceptions
+from dhis2.importer import ImportReport, import_data_values_csv, iter_data_values
+from .common import BASEURL, API_URL
+
+
+MAPPING = {
+    "dataElement": "de",
+    "period": "pe",
+    "orgUnit": "ou",
+    "categoryOptionCombo": "coc",
+    "value": "value",
+}
+
+
+@pytest.fixture  # BASE FIXTURE
+def api():
+    return Api(BASEURL, "admin", "district")
+
+
+def csv_content(rows):
+    lines = ["de,pe,ou,coc,value"]
+    for i in range(rows):
+        lines.append("fbfJHSPpUQD,2021{:02d},DiszpKrYNg8,{},{}".format(i % 12 + 1, "pq2XI5kz2BY" if i % 2 else "", i))
+    return "\n".join(lines) + "\n"
+
+
+def import_summary(imported, ignored=0, conflicts=None, status="SUCCESS"):
+    return {
+        "responseType": "ImportSummary",
+        "status": status,
+        "importCount": {"imported": imported, "updated": 0, "ignored": ignored, "deleted": 0},
+        "conflicts": conflicts or [],
+    }
+
+
+def test_iter_data_values():
+    rows = [
+        {"de": "a", "pe": "202101", "ou": "b", "coc": "", "value": "1"},
+        {"de": "a", "pe": "202102", "ou": "b", "coc": "c", "value": ""},
+    ]
+    mapping = dict(MAPPING, comment=lambda row: "from csv")
+    assert list(iter_data_values(rows, mapping)) == [
+        {"dataElement": "a", "period": "202101", "orgUnit": "b", "value": "1", "comment": "from csv"},
+        {"dataElement": "a", "period": "202102", "orgUnit": "b", "categoryOptionCombo": "c", "value": "", "comment": "from csv"},
+    ]
+
+
+@pytest.mark.parametrize(
+    "mapping",
+    [
+        None,
+        {},
+        {"dataElement": "de", "period": "pe", "orgUnit": "ou"},  # no value
+        dict(MAPPING, notAField="x"),
+        dict(MAPPING, value=3),
+    ],
+)
+def test_iter_data_values_invalid_mapping(mapping):
+    with pytest.raises(exceptions.ClientException):
+        list(iter_data_values([], mapping))
+
+
+def test_iter_data_values_missing_column():
+    with pytest.raises(exceptions.ClientException):
+        list(iter_data_values([{"de": "a"}], MAPPING))
+
+
+@responses.activate
+def test_import_data_values_csv_file(api):
+    url = "{}/dataValueSets".format(API_URL)
+    responses.add(responses.POST, url, json=import_summary(10), status=200)
+    responses.add(responses.POST, url, json=import_summary(10), status=200)
+    responses.add(responses.POST, url, json=import_summary(5), status=200)
+
+    filename = os.path.join(tempfile.mkdtemp(), "values.csv")
+    with open(filename, "w") as f:
+        f.write(csv_content(25))
+
+    report = import_data_values_csv(api, filename, MAPPING, chunk_size=10, max_workers=1)
+
+    assert len(responses.calls) == 3
+    payloads = [json.loads(call.request.body) for call in responses.calls]
+    assert [len(p["dataValues"]) for p in payloads] == [10, 10, 5]
+    assert payloads[0]["dataValues"][0] == {
+        "dataElement": "fbfJHSPpUQD",
+        "period": "202101",
+        "orgUnit": "DiszpKrYNg8",
+        "value": "0",
+    }
+    assert payloads[0]["dataValues"][1]["categoryOptionCombo"] == "pq2XI5kz2BY"
+    assert report.ok
+    assert report.chunks == 3
+    assert report.objects == 25
+    assert report.import_count["imported"] == 25
+
+
+@responses.activate
+def test_import_data_values_csv_conflicts(api):
+    url = "{}/dataValueSets".format(API_URL)
+    conflict = {"object": "DiszpKrYNg8", "value": "Org unit not in hierarchy"}
+    responses.add(responses.POST, url, json=import_summary(10), status=200)
+    responses.add(
+        responses.POST,
+        url,
+        json={
+            "httpStatus": "Conflict",
+            "status": "WARNING",
+            "response": import_summary(8, ignored=2, conflicts=[conflict], status="WARNING"),
+        },
+        status=409,
+    )
+    responses.add(responses.POST, url, body="Bad gateway", status=502)
+
+    report = import_data_values_csv(
+        api, io.StringIO(csv_content(30)), MAPPING, chunk_size=10, max_workers=1,
+        params={"dryRun": "true"},
+    )
+
+    assert "dryRun=true" in responses.calls[0].request.url
+    assert not report.ok
+    assert report.chunks == 3
+    assert report.import_count == {"imported": 18, "updated": 0, "ignored": 2, "deleted": 0}
+    assert report.conflicts == [dict(conflict, kind="conflict", chunk=1)]
+    assert report.errors[0][0] == 2
+    assert report.statuses == {"SUCCESS": 1, "WARNING": 1, "ERROR": 1}
+    as_dict = report.to_dict()
+    assert as_dict["conflicts"] == [dict(conflict, kind="conflict", chunk=1)]
+    assert as_dict["conflictCount"] == 1
+    assert as_dict["errors"][0]["chunk"] == 2
+    assert "chunks=3" in repr(report)
+
+
+class SlowApi(object):
+    """Fake Api that records how many uploads run at the same time"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.posted = 0
+
+    def post(self, endpoint, json=None, params=None):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.01)
+        with self.lock:
+            self.running -= 1
+            self.posted += len(json["dataValues"])
+
+        class Response(object):
+            @staticmethod
+            def json():
+                return import_summary(len(json["dataValues"]))
+
+        return Response()
+
+
+@pytest.mark.parametrize("max_workers", [1, 3])
+def test_import_data_values_csv_bounded_concurrency(max_workers):
+    api = SlowApi()
+    report = import_data_values_csv(
+        api, io.StringIO(csv_content(200)), MAPPING, chunk_size=7, max_workers=max_workers
+    )
+    assert api.posted == 200
+    assert 1 <= api.max_running <= max_workers
+    assert report.chunks == 29
+    assert report.import_count["imported"] == 200
+    assert report.ok
+
+
+def test_import_data_values_csv_error_propagates():
+    class FailingApi(object):
+        def post(self, *args, **kwargs):
+            raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        import_data_values_csv(FailingApi(), io.StringIO(csv_content(30)), MAPPING, chunk_size=10)
+
+
+@pytest.mark.parametrize(
+    "error", [requests.ConnectionError("connection refused"), requests.Timeout("read timed out"), TimeoutError()]
+)
+def test_import_data_values_csv_connection_error(error):
+    class FlakyApi(SlowApi):
+        def post(self, endpoint, json=None, params=None):
+            if json["dataValues"][0]["value"] == "10":  # the second chunk
+                raise error
+            return super(FlakyApi, self).post(endpoint, json=json, params=params)
+
+    report = import_data_values_csv(FlakyApi(), io.StringIO(csv_content(30)), MAPPING, chunk_size=10, max_workers=1)
+    assert report.chunks == 3 and report.objects == 30
+    assert report.import_count["imported"] == 20
+    assert report.errors == [(1, str(error) or "TimeoutError")]
+    assert not report.ok
+
+
+@pytest.mark.parametrize("kwargs", [{"chunk_size": 0}, {"max_workers": 0}, {"chunk_size": "10"}])
+def test_import_data_values_csv_invalid_args(kwargs):
+    with pytest.raises(exceptions.ClientException):
+        import_data_values_csv(SlowApi(), io.StringIO(csv_content(1)), MAPPING, **kwargs)
+
+
+@pytest.mark.parametrize("response", [{}, None, ["a"], {"status": "OK", "stats": {"created": "x"}}])
+def test_import_report_unparseable_response(response):
+    report = ImportReport()
+    report.add(response, 0, 3)
+    assert report.chunks == 1
+    assert report.total == 0
+
+
+@responses.activate
+def test_import_data_values_csv_empty_response(api):
+    url = "{}/dataValueSets".format(API_URL)
+    responses.add(responses.POST, url, body="", status=200)
+    report = import_data_values_csv(api, io.StringIO(csv_content(3)), MAPPING)
+    assert report.chunks == 1
+    assert report.objects == 3
+
+
+METADATA_RESPONSE = {
+    "status": "ERROR",
+    "stats": {"created": 1, "updated": 2, "deleted": 0, "ignored": 1, "total": 4},
+    "typeReports": [
+        {
+            "klass": "org.hisp.dhis.dataelement.DataElement",
+            "stats": {"created": 1, "updated": 2, "deleted": 0, "ignored": 1, "total": 4},
+            "objectReports": [
+                {
+                    "uid": "fbfJHSPpUQD",
+                    "index": 3,
+                    "errorReports": [
+                        {"errorCode": "E4000", "message": "Missing required property `name`."}
+                    ],
+                },
+                {"uid": "cYeuwXTCPkU", "index": 1, "errorReports": []},
+            ],
+        }
+    ],
+}
+
+EVENTS_RESPONSE = {
+    "status": "ERROR",
+    "imported": 1,
+    "updated": 0,
+    "deleted": 0,
+    "ignored": 1,
+    "importSummaries": [
+        {"reference": "GL5ef5j2rX5", "status": "SUCCESS", "conflicts": []},
+        {
+            "reference": "dyXsEQMOlTd",
+            "status": "ERROR",
+            "conflicts": [{"object": "orgUnit", "value": "Org unit not found"}],
+        },
+    ],
+}
+
+TRACKER_RESPONSE = {
+    "status": "OK",
+    "httpStatusCode": 200,
+    "response": {"status": "SUCCESS", "imported": 2, "updated": 1, "deleted": 0, "ignored": 0},
+}
+
+
+def test_import_report_merges_import_types():
+    report = ImportReport()
+    report.add(METADATA_RESPONSE)
+    report.add(EVENTS_RESPONSE)
+    report.add(TRACKER_RESPONSE)
+    report.add(import_summary(5))
+    report.finish()
+
+    assert report.chunks == 4
+    assert report.import_count == {"imported": 9, "updated": 3, "ignored": 2, "deleted": 0}
+    assert report.total == 14
+    assert report.statuses == {"ERROR": 2, "SUCCESS": 2}
+    assert report.conflicts == [
+        {
+            "kind": "errorReport",
+            "uid": "fbfJHSPpUQD",
+            "errorCode": "E4000",
+            "message": "Missing required property `name`.",
+            "chunk": 0,
+        },
+        {
+            "kind": "conflict",
+            "reference": "dyXsEQMOlTd",
+            "object": "orgUnit",
+            "value": "Org unit not found",
+            "chunk": 1,
+        },
+    ]
+    assert report.throughput > 0
+    assert report.elapsed == report.elapsed  # clock is stopped
+
+
+@responses.activate
+def test_import_report_consume_post_partitioned(api):
+    url = "{}/metadata".format(API_URL)
+    ok = {"status": "OK", "stats": {"created": 2, "updated": 0, "deleted": 0, "ignored": 0, "total": 2}}
+    responses.add(responses.POST, url, json=ok, status=200)
+    responses.add(responses.POST, url, json=ok, status=200)
+    responses.add(responses.POST, url, json=ok, status=200)
+
+    payload = {"dataElements": [{"id": str(i)} for i in range(5)]}
+    report = ImportReport().consume(api.post_partitioned("metadata", json=payload, thresh=2))
+
+    assert report.chunks == 3
+    assert report.import_count["imported"] == 6
+    assert report.ok
+    assert report.to_dict()["throughput"] >= 0
+
+
+def test_import_report_consume_dicts():
+    report = ImportReport().consume([import_summary(1), import_summary(2)])
+    assert report.import_count["imported"] == 3
+    assert report.finished is not None
+
+
+def test_import_report_spills_conflicts():
+    report = ImportReport(spill_threshold=10)
+    conflicts = [{"object": str(i), "value": "bad"} for i in range(25)]
+    for i in range(5):
+        report.add(import_summary(0, ignored=5, conflicts=conflicts[i * 5 : (i + 1) * 5]), i)
+    assert report._spill is not None
+    assert report._conflicts == []
+    assert report.conflict_count == 25
+
+    seen = list(report.iter_conflicts())
+    assert [c["object"] for c in seen] == [str(i) for i in range(25)]
+    assert [c["chunk"] for c in seen][::5] == [0, 1, 2, 3, 4]
+
+    # still appends after reading
+    report.add(import_summary(0, ignored=1, conflicts=[{"object": "25", "value": "bad"}]), 5)
+    assert len(report.conflicts) == 26
+    assert len(report.to_dict(max_conflicts=3)["conflicts"]) == 3
+
+    report.close()
+    assert report.conflicts == []
+
+
+def test_import_report_spill_after_partial_read():
+    report = ImportReport(spill_threshold=3)
+    conflicts = [{"object": str(i), "value": "bad"} for i in range(5000)]
+    report.add(import_summary(0, ignored=5000, conflicts=conflicts), 0)
+    # stops reading the spill file early
+    assert [c["object"] for c in report.to_dict(max_conflicts=2)["conflicts"]] == ["0", "1"]
+    assert next(report.iter_conflicts())["object"] == "0"
+    report.add(import_summary(0, ignored=1, conflicts=[{"object": "5000", "value": "bad"}]), 1)
+    assert [c["object"] for c in report.conflicts] == [str(i) for i in range(5001)]
+    report.close()
@@ -44,3 +44,345 @@ def test_set_log_format():
     assert (
         _set_log_format(color=False, include_caller=False) == color_false_caller_false
     )
+
+
+def test_setup_logger_queue():
+    import logging
+    from dhis2 import logger, setup_logger
+    from dhis2.logger import DroppingQueueHandler, stop_queue_logging
+
+    filename = os.path.join(tempfile.mkdtemp(), "queued.log")
+    setup_logger(logfile=filename, queue_size=1000, block_when_full=True)
+    handlers = logger.handlers
+    assert len(handlers) == 1 and isinstance(handlers[0], DroppingQueueHandler)
+    for i in range(200):
+        logger.info("queued %d", i)
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logger.exception("failed")
+
+    setup_logger(logfile=filename, queue_size=10)  # replaces the running queue
+    assert len(logger.handlers) == 1
+    stop_queue_logging()
+    stop_queue_logging()  # nothing to stop
+    assert not any(isinstance(h, DroppingQueueHandler) for h in logger.handlers)
+    assert any(isinstance(h, logging.FileHandler) for h in logger.handlers)
+
+    with open(filename) as f:
+        content = f.read()
+    assert "queued 0" in content and "queued 199" in content
+    assert "ValueError: boom" in content
+    setup_logger()
+
+
+def test_setup_logger_invalid_queue_size():
+    import pytest
+    from dhis2 import exceptions, setup_logger
+
+    with pytest.raises(exceptions.ClientException):
+        setup_logger(queue_size=0)
+
+
+def make_record(msg):
+    import logging
+
+    return logging.makeLogRecord({"name": "test", "levelno": logging.INFO, "levelname": "INFO", "msg": msg})
+
+
+def test_dropping_queue_handler_drops_and_reports():
+    import queue
+    from dhis2.logger import DroppingQueueHandler
+
+    log_queue = queue.Queue(maxsize=2)
+    handler = DroppingQueueHandler(log_queue)
+    for i in range(5):
+        handler.handle(make_record("message {}".format(i)))
+    assert handler.dropped == 3 and log_queue.qsize() == 2
+
+    log_queue.get_nowait()
+    handler.handle(make_record("message 5"))  # fills the queue: the report has to wait
+    assert handler.dropped == 3 and log_queue.qsize() == 2
+
+    log_queue.get_nowait()
+    log_queue.get_nowait()
+    handler.handle(make_record("message 6"))
+    messages = [log_queue.get_nowait().getMessage() for _ in range(2)]
+    assert messages == ["message 6", "3 log records were dropped, the log queue was full"]
+
+
+def test_dropping_queue_handler_blocks():
+    import queue
+    import threading
+    import time
+    from dhis2.logger import DroppingQueueHandler
+
+    log_queue = queue.Queue(maxsize=1)
+    handler = DroppingQueueHandler(log_queue, block=True)
+    received = []
+
+    def drain():
+        for _ in range(3):
+            time.sleep(0.01)
+            received.append(log_queue.get().getMessage())
+
+    thread = threading.Thread(target=drain)
+    thread.start()
+    for i in range(3):
+        handler.handle(make_record("message {}".format(i)))
+    thread.join()
+    assert received == ["message 0", "message 1", "message 2"] and handler.dropped == 0
+
+
+class Capture(object):
+    """A logger whose records carry the log_context() fields"""
+
+    def __init__(self):
+        import logging
+        from dhis2.logger import LogContextFilter
+
+        self.records = []
+        self.logger = logging.getLogger("dhis2.tests.capture")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.handlers = []
+        self.logger.filters = []
+        handler = logging.Handler()
+        handler.emit = self.records.append
+        handler.addFilter(LogContextFilter())
+        self.logger.addHandler(handler)
+
+    def contexts(self):
+        return [{k: v for k, v in r.context.items() if k != "duration"} for r in self.records]
+
+
+def test_log_context():
+    from dhis2.logger import get_log_context, log_context, new_request_id
+
+    assert get_log_context() == {}
+    with log_context(job="import", chunk=1) as fields:
+        assert fields == {"job": "import", "chunk": 1}
+        with log_context(chunk=2):
+            context = get_log_context()
+            assert context["job"] == "import" and context["chunk"] == 2 and context["duration"] >= 0
+        assert get_log_context()["chunk"] == 1
+    assert get_log_context() == {}
+
+    # contexts that end out of order (e.g. generators) remove only themselves
+    outer, inner = log_context(a=1), log_context(b=2)
+    outer.__enter__()
+    inner.__enter__()
+    outer.__exit__(None, None, None)
+    assert get_log_context()["b"] == 2
+    inner.__exit__(None, None, None)
+    assert get_log_context() == {}
+
+    first, second = new_request_id(), new_request_id()
+    assert first != second and first.split("-")[0] == second.split("-")[0]
+
+
+def test_json_formatter():
+    import json
+    import logging
+    import sys
+    from dhis2.logger import JsonFormatter, LogContextFilter, log_context
+
+    formatter = JsonFormatter()
+    record = logging.makeLogRecord(
+        {"name": "test", "levelno": logging.INFO, "levelname": "INFO", "msg": "é %s", "args": ("x",),
+         "module": "script", "lineno": 12, "created": 0.5, "msecs": 500.0}
+    )
+    with log_context(request_id="r-1", endpoint="dataElements/{uid}"):
+        LogContextFilter().filter(record)
+    entry = json.loads(formatter.format(record))
+    assert entry == {
+        "time": "1970-01-01T00:00:00.500Z",
+        "level": "INFO",
+        "logger": "test",
+        "message": "é x",
+        "module": "script",
+        "line": 12,
+        "request_id": "r-1",
+        "endpoint": "dataElements/{uid}",
+        "duration": entry["duration"],
+    }
+
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.makeLogRecord({"msg": "failed", "exc_info": sys.exc_info(), "stack_info": "Stack (most recent call last)"})
+    entry = json.loads(formatter.format(record))
+    assert "ValueError: boom" in entry["exception"] and entry["stack"].startswith("Stack")
+
+
+def test_setup_logger_json(capsys):
+    import json
+    from dhis2 import logger, setup_logger
+    from dhis2.logger import log_context, stop_queue_logging
+
+    filename = os.path.join(tempfile.mkdtemp(), "json.log")
+    for queue_size in (None, 100):
+        setup_logger(logfile=filename, json_format=True, queue_size=queue_size)
+        with log_context(request_id="r-{}".format(queue_size)):
+            logger.info("hello %s", "json")
+        stop_queue_logging()
+    setup_logger()
+    logger.info("plain")
+
+    with open(filename) as f:
+        entries = [json.loads(line) for line in f]
+    assert [(e["message"], e["request_id"]) for e in entries] == [("hello json", "r-None"), ("hello json", "r-100")]
+    assert "plain" not in open(filename).read()
+    assert not logger.filters
+
+
+def test_api_log_context():
+    import responses
+    from dhis2 import Api, RequestHook
+    from .common import BASEURL, API_URL
+
+    capture = Capture()
+
+    class Logging(RequestHook):
+        def after_request(self, record):
+            capture.logger.info("request done")
+
+    api = Api(BASEURL, "admin", "district")
+    api.add_request_hook(Logging())
+    with responses.RequestsMock() as mock:
+        mock.add(responses.GET, API_URL + "/dataElements/Rp268JB6Ne4.json", json={})
+        for page in (1, 2):
+            mock.add(
+                responses.GET,
+                API_URL + "/organisationUnits.json",
+                json={"pager": {"page": page, "pageCount": 2}, "organisationUnits": []},
+            )
+        mock.add(responses.POST, API_URL + "/metadata", json={})
+
+        api.get("dataElements/Rp268JB6Ne4")
+        for page in api.get_paged("organisationUnits", page_size=1):
+            capture.logger.info("processing")
+        for response in api.post_partitioned("metadata", json={"dataElements": [{}, {}, {}, {}]}, thresh=2):
+            capture.logger.info("posted")
+
+    contexts = capture.contexts()
+    request_ids = [c.pop("request_id", None) for c in contexts]
+    assert contexts == [
+        {"method": "GET", "endpoint": "dataElements/{uid}"},
+        {"method": "GET", "endpoint": "organisationUnits", "page": 1},
+        {"endpoint": "organisationUnits", "page": 1},
+        {"method": "GET", "endpoint": "organisationUnits", "page": 2},
+        {"endpoint": "organisationUnits", "page": 2},
+        {"method": "POST", "endpoint": "metadata", "chunk": 0},
+        {"endpoint": "metadata", "chunk": 0},
+        {"method": "POST", "endpoint": "metadata", "chunk": 1},
+        {"endpoint": "metadata", "chunk": 1},
+    ]
+    assert len(set(request_ids)) == 6 and request_ids[2] is None
+
+
+def sampled_logger(sampler):
+    import logging
+
+    capture = Capture()
+    capture.logger.setLevel(logging.DEBUG)
+    capture.logger.addFilter(sampler)
+    return capture
+
+
+def messages(capture):
+    return [r.getMessage() for r in capture.records]
+
+
+def test_log_sampler_every():
+    from dhis2.logger import LogSampler
+
+    capture = sampled_logger(LogSampler(every=3))
+    for i in range(7):
+        capture.logger.info("row %d", i)
+        capture.logger.warning("warning %d", i)  # never sampled
+    assert messages(capture) == ["row 0"] + ["warning {}".format(i) for i in range(3)] + [
+        "row 3 (+2 suppressed)"
+    ] + ["warning {}".format(i) for i in range(3, 6)] + ["row 6 (+2 suppressed)", "warning 6"]
+
+
+def test_log_sampler_rate_limit():
+    from dhis2.logger import LogSampler
+
+    now = [0.0]
+    capture = sampled_logger(LogSampler(max_per_second=2, clock=lambda: now[0]))
+
+    def log_a(i):
+        capture.logger.debug("a %d", i)
+
+    for i in range(5):
+        log_a(i)
+    for i in range(2):
+        capture.logger.debug("b %d", i)  # another call site has its own limit
+    now[0] += 1.0
+    log_a(5)
+    assert messages(capture) == ["a 0", "a 1", "b 0", "b 1", "a 5 (+3 suppressed)"]
+
+
+def test_log_sampler_coalesce():
+    from dhis2.logger import LogSampler
+
+    sampler = LogSampler(coalesce=True)
+    capture = sampled_logger(sampler)
+    for message in ["same", "same", "same", "other", "other", "same"]:
+        capture.logger.info(message)
+    sampler.flush()
+    sampler.flush()  # nothing left
+    assert messages(capture) == [
+        "same",
+        "previous message repeated 2 times: same",
+        "other",
+        "previous message repeated 1 times: other",
+        "same",
+    ]
+    summary = capture.records[1]
+    assert summary.lineno == capture.records[0].lineno and summary.levelname == "INFO"
+
+
+def test_log_sampler_coalesce_and_every():
+    from dhis2.logger import LogSampler
+
+    sampler = LogSampler(every=2, coalesce=True)
+    capture = sampled_logger(sampler)
+    for message in ["a", "b", "b", "c", "d"]:
+        capture.logger.info(message)
+    sampler.flush()
+    assert messages(capture) == ["a", "previous message repeated 1 times: b", "c (+1 suppressed)"]
+
+
+def test_log_sampler_invalid():
+    import pytest
+    from dhis2 import exceptions
+    from dhis2.logger import LogSampler
+
+    with pytest.raises(exceptions.ClientException):
+        LogSampler(every=0)
+    with pytest.raises(exceptions.ClientException):
+        LogSampler(max_per_second=0)
+
+
+def test_setup_logger_sampler():
+    from dhis2 import logger, setup_logger
+    from dhis2.logger import LogSampler, _flush_sampler
+
+    filename = os.path.join(tempfile.mkdtemp(), "sampled.log")
+    sampler = LogSampler(every=10, coalesce=True)
+    setup_logger(logfile=filename, sampler=sampler, queue_size=100)
+    assert sampler in logger.filters
+    for i in range(100):
+        logger.info("row %d", i)
+    for _ in range(5):
+        logger.info("done")
+    setup_logger(logfile=filename)  # flushes the summary of the previous sampler
+    assert not logger.filters
+    _flush_sampler()
+    with open(filename) as f:
+        content = f.read()
+    assert "row 90 (+9 suppressed)" in content and "row 91" not in content
+    assert "previous message repeated 4 times: done" in content
+    setup_logger()
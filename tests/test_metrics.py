@@ -0,0 +1,193 @@
+import os
+import tempfile
+
+import pytest
+import requests
+import responses
+
+from dhis2 import exceptions, Api
+from dhis2.metrics import (
+    Histogram,
+    RequestHook,
+    RequestMetrics,
+    RequestRecord,
+    endpoint_template,
+)
+from .common import BASEURL, API_URL
+
+
+@pytest.fixture  # BASE FIXTURE
+def api():
+    return Api(BASEURL, "admin", "district")
+
+
+class RecordingHook(RequestHook):
+    def __init__(self):
+        self.events = []
+
+    def before_request(self, record):
+        self.events.append(("before", record.method, record.template))
+
+    def after_request(self, record):
+        self.events.append(("after", record.status_code, record.error is not None))
+
+    def after_decode(self, record):
+        self.events.append(("decode", record.decode >= 0))
+
+
+@pytest.mark.parametrize(
+    "endpoint,expected",
+    [
+        ("organisationUnits/Rp268JB6Ne4", "organisationUnits/{uid}"),
+        ("sqlViews/qMYMT0iUGkG/data", "sqlViews/{uid}/data"),
+        ("system/tasks/DATAVALUE_IMPORT/YR1UxOUXmzT", "system/tasks/DATAVALUE_IMPORT/{uid}"),
+        ("events/query", "events/query"),
+        ("organisationUnits", "organisationUnits"),
+        ("messageConversations/12/", "messageConversations/{id}"),
+        ("dataElements/Rp268JB6Ne4/translations", "dataElements/{uid}/translations"),
+        ("schemas/dataElement", "schemas/dataElement"),
+        ("periodTypes", "periodTypes"),
+        ("Rp268JB6Ne4", "Rp268JB6Ne4"),
+    ],
+)
+def test_endpoint_template(endpoint, expected):
+    assert endpoint_template(endpoint) == expected
+
+
+def test_histogram_quantiles():
+    h = Histogram(buckets=(0.1, 0.2, 0.5, 1.0))
+    assert h.quantile(0.5) == 0.0 and h.mean == 0.0
+    for value in [0.05] * 50 + [0.15] * 40 + [0.4] * 9 + [3.0]:
+        h.observe(value)
+    assert h.count == 100
+    assert h.counts == [50, 40, 9, 0, 1]
+    assert 0.09 < h.quantile(0.5) <= 0.1
+    assert 0.2 < h.quantile(0.95) <= 0.5
+    assert h.quantile(1.0) == 3.0
+    assert h.max == 3.0
+    assert h.mean == pytest.approx((2.5 + 6 + 3.6 + 3.0) / 100)
+
+
+@responses.activate
+def test_request_hooks(api):
+    hook = RecordingHook()
+    api.add_request_hook(hook)
+    responses.add(responses.GET, "{}/organisationUnits/Rp268JB6Ne4.json".format(API_URL), json={"id": "Rp268JB6Ne4"})
+    responses.add(responses.GET, "{}/system/info.json".format(API_URL), json={"version": "2.36"})
+    responses.add(responses.POST, "{}/dataElements".format(API_URL), json={}, status=409)
+
+    api.get("organisationUnits/Rp268JB6Ne4")
+    assert api.version == "2.36"
+    with pytest.raises(exceptions.RequestException):
+        api.post("dataElements", json={"a": 1})
+
+    assert hook.events == [
+        ("before", "GET", "organisationUnits/{uid}"),
+        ("after", 200, False),
+        ("before", "GET", "system/info"),
+        ("after", 200, False),
+        ("decode", True),
+        ("before", "POST", "dataElements"),
+        ("after", 409, False),
+    ]
+
+    api.remove_request_hook(hook)
+    api.get("organisationUnits/Rp268JB6Ne4")
+    assert len(hook.events) == 7
+
+
+def test_request_hook_connection_error(api):
+    hook = RecordingHook()
+    api.add_request_hook(hook)
+    with responses.RequestsMock() as rsps:
+        rsps.add(responses.GET, "{}/dataElements.json".format(API_URL), body=requests.ConnectionError("down"))
+        with pytest.raises(requests.ConnectionError):
+            api.get("dataElements")
+    assert hook.events[-1] == ("after", None, True)
+
+
+def test_add_request_hook_invalid(api):
+    with pytest.raises(exceptions.ClientException):
+        api.add_request_hook(lambda record: None)
+
+
+@responses.activate
+def test_request_metrics(api):
+    metrics = RequestMetrics()
+    api.add_request_hook(metrics)
+    for uid in ("Rp268JB6Ne4", "ImspTQPwCqd"):
+        responses.add(responses.GET, "{}/organisationUnits/{}.json".format(API_URL, uid), json={"id": uid})
+        api.get("organisationUnits/{}".format(uid))
+    responses.add(responses.GET, "{}/sqlViews/qMYMT0iUGkG/data.csv".format(API_URL), body="a,b\n1,2\n", headers={"Content-Length": "8"})
+    api.get("sqlViews/qMYMT0iUGkG/data", file_type="csv", stream=True)
+    responses.add(responses.POST, "{}/metadata".format(API_URL), json={"status": "ERROR"}, status=409)
+    with pytest.raises(exceptions.RequestException):
+        api.post("metadata", json={"dataElements": [{"id": "x"}]})
+
+    snapshot = metrics.snapshot()
+    ou = snapshot[("GET", "organisationUnits/{uid}")]
+    assert ou["count"] == 2
+    assert ou["errors"] == 0
+    assert ou["statuses"] == {"200": 2}
+    assert ou["bytesIn"] == len('{"id": "Rp268JB6Ne4"}') * 2
+    assert ou["bytesOut"] == 0
+    assert snapshot[("GET", "sqlViews/{uid}/data")]["bytesIn"] == 8
+    md = snapshot[("POST", "metadata")]
+    assert md["errors"] == 1
+    assert md["statuses"] == {"409": 1}
+    assert md["bytesOut"] == len('{"dataElements": [{"id": "x"}]}')
+
+    table = metrics.summary_table()
+    assert table.splitlines()[0].startswith("method")
+    assert "organisationUnits/{uid}" in table
+    assert len(table.splitlines()) == 4
+
+    text = metrics.to_prometheus()
+    assert '# TYPE dhis2_request_duration_seconds histogram' in text
+    assert 'dhis2_request_duration_seconds_bucket{method="GET",endpoint="organisationUnits/{uid}",le="+Inf"} 2' in text
+    assert 'dhis2_request_duration_seconds_count{method="GET",endpoint="organisationUnits/{uid}"} 2' in text
+    assert 'dhis2_requests_total{method="POST",endpoint="metadata",status="409"} 1' in text
+    assert 'dhis2_request_retries_total{method="GET",endpoint="organisationUnits/{uid}"} 0' in text
+
+    metrics.reset()
+    assert metrics.snapshot() == {}
+
+
+def test_request_metrics_write_prometheus():
+    metrics = RequestMetrics(namespace="test")
+    record = RequestRecord("get", 'dataElements/"quoted"', "url")
+    record.status_code = None
+    record.duration = 0.3
+    metrics.after_request(record)
+    record.decode = 0.01
+    metrics.after_decode(record)
+
+    path = os.path.join(tempfile.mkdtemp(), "dhis2.prom")
+    metrics.write_prometheus(path)
+    with open(path) as f:
+        text = f.read()
+    assert 'test_requests_total{method="GET",endpoint="dataElements/\\"quoted\\"",status="error"} 1' in text
+    assert 'test_json_decode_seconds_count{method="GET",endpoint="dataElements/\\"quoted\\""} 1' in text
+    assert os.listdir(os.path.dirname(path)) == ["dhis2.prom"]
+    assert "0.300s" in repr(record)
+
+
+def test_request_metrics_write_prometheus_cleans_up(monkeypatch):
+    metrics = RequestMetrics()
+    directory = tempfile.mkdtemp()
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", fail)
+    with pytest.raises(OSError):
+        metrics.write_prometheus(os.path.join(directory, "dhis2.prom"))
+    assert os.listdir(directory) == []
+
+
+def test_request_hook_base_class_is_noop():
+    hook = RequestHook()
+    record = RequestRecord("get", "dataElements", "url")
+    hook.before_request(record)
+    hook.after_request(record)
+    hook.after_decode(record)
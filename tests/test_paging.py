@@ -1,9 +1,12 @@
+import os
+import tempfile
 import uuid
 
 import pytest
 import responses
 
 from dhis2 import exceptions, Api
+from dhis2.checkpoint import Checkpoint, CollectionChangedWarning, PageCheckpoint
 from .common import API_URL, BASEURL
 
 
@@ -202,3 +205,122 @@ def test_paging_with_params(api):
     with pytest.raises(exceptions.ClientException):
         params = {"paging": False}
         api.get_paged("organisationUnits", params=params)
+
+
+@responses.activate
+def test_paging_with_list_params(api):
+    url = "{}/organisationUnits.json".format(API_URL)
+    r = {
+        "pager": {"page": 1, "pageCount": 1, "total": 0, "pageSize": 50},
+        "organisationUnits": [],
+    }
+    responses.add(responses.GET, url, json=r, status=200)
+    params = [("filter", "level:eq:2"), ("filter", "name:like:Bo"), ("fields", "id")]
+    api.get_paged("organisationUnits", params=params, page_size=50, merge=True)
+    assert responses.calls[0].request.url.split("?")[1] == (
+        "filter=level%3Aeq%3A2&filter=name%3Alike%3ABo&fields=id&pageSize=50&page=1&totalPages=True"
+    )
+    with pytest.raises(exceptions.ClientException):
+        api.get_paged("organisationUnits", params=[("paging", False)])
+
+
+def add_org_unit_pages(pages, total=None):
+    for page in range(1, pages + 1):
+        responses.add(
+            responses.GET,
+            "{}/organisationUnits.json?pageSize=2&page={}&totalPages=True".format(API_URL, page),
+            json={
+                "pager": {"page": page, "pageCount": pages, "total": total or pages * 2},
+                "organisationUnits": [{"id": "{}-{}".format(page, i)} for i in range(2)],
+            },
+            status=200,
+        )
+
+
+def requested_pages():
+    return [int(c.request.url.split("page=")[1].split("&")[0]) for c in responses.calls]
+
+
+@responses.activate
+def test_get_paged_start_page(api):
+    add_org_unit_pages(3)
+    pages = list(api.get_paged("organisationUnits", page_size=2, start_page=2))
+    assert [p["pager"]["page"] for p in pages] == [2, 3]
+    assert requested_pages() == [2, 3]
+
+
+@responses.activate
+def test_get_paged_checkpoint_resumes(api):
+    path = os.path.join(tempfile.mkdtemp(), "paging.checkpoint.json")
+    add_org_unit_pages(4)
+
+    for page in api.get_paged("organisationUnits", page_size=2, checkpoint=path):
+        if page["pager"]["page"] == 2:
+            break  # page 2 was not processed completely
+
+    state = Checkpoint(path).state
+    assert state["page"] == 1
+    assert state["pager"] == {"total": 8, "pageCount": 4}
+
+    responses.calls.reset()
+    pages = [p["pager"]["page"] for p in api.get_paged("organisationUnits", page_size=2, checkpoint=path)]
+    assert pages == [2, 3, 4]
+    assert requested_pages() == [2, 3, 4]
+    assert not os.path.exists(path)
+
+
+@responses.activate
+def test_get_paged_checkpoint_retry_with_same_params(api):
+    path = os.path.join(tempfile.mkdtemp(), "paging.checkpoint.json")
+    url = "{}/organisationUnits.json".format(API_URL)
+
+    def page(number):
+        return {"pager": {"page": number, "pageCount": 3, "total": 6}, "organisationUnits": [{"id": "a"}, {"id": "b"}]}
+
+    responses.add(responses.GET, url, json=page(1))
+    responses.add(responses.GET, url, json={"message": "boom"}, status=500)
+    params = {"filter": "level:eq:2"}
+    with pytest.raises(exceptions.RequestException):
+        for _ in api.get_paged("organisationUnits", params=params, page_size=2, checkpoint=path):
+            pass
+    assert params == {"filter": "level:eq:2"}
+
+    responses.reset()
+    responses.add(responses.GET, url, json=page(2))
+    responses.add(responses.GET, url, json=page(3))
+    pages = [p["pager"]["page"] for p in api.get_paged("organisationUnits", params=params, page_size=2, checkpoint=path)]
+    assert pages == [2, 3]
+    assert requested_pages() == [2, 3]
+
+
+@responses.activate
+def test_get_paged_checkpoint_collection_changed(api):
+    path = os.path.join(tempfile.mkdtemp(), "paging.checkpoint.json")
+    add_org_unit_pages(3)
+    pages = api.get_paged("organisationUnits", page_size=2, checkpoint=path)
+    next(pages)
+    next(pages)
+    pages.close()
+
+    responses.reset()
+    add_org_unit_pages(4, total=7)
+    with pytest.warns(CollectionChangedWarning, match="6 -> 7 objects"):
+        pages = [p["pager"]["page"] for p in api.get_paged("organisationUnits", page_size=2, checkpoint=path)]
+    assert pages == [2, 3, 4]
+
+
+def test_get_paged_checkpoint_of_other_request(api):
+    path = os.path.join(tempfile.mkdtemp(), "paging.checkpoint.json")
+    store = PageCheckpoint(path, "another job")
+    store.page_done(3)
+    with pytest.raises(exceptions.ClientException):
+        api.get_paged("organisationUnits", page_size=2, checkpoint=path)
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [{"start_page": 0}, {"start_page": "2"}, {"merge": True, "checkpoint": "x.json"}],
+)
+def test_get_paged_checkpoint_invalid(api, kwargs):
+    with pytest.raises(exceptions.ClientException):
+        api.get_paged("organisationUnits", page_size=2, **kwargs)
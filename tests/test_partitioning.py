@@ -1,7 +1,12 @@
+import json
+import os
+import tempfile
+
 import pytest
 import responses
 
 from dhis2 import exceptions, Api
+from dhis2.checkpoint import ChunkJournal
 from .common import BASEURL, API_URL
 
 
@@ -69,3 +74,100 @@ def test_post_partitioned_threshold_invalid(api, threshold):
             endpoint="metadata", json=payload, thresh=threshold
         ):
             continue
+
+
+def journal_path():
+    return os.path.join(tempfile.mkdtemp(), "import.journal")
+
+
+def import_summary(status="SUCCESS", imported=2, ignored=0):
+    return {"status": status, "imported": imported, "updated": 0, "ignored": ignored, "deleted": 0}
+
+
+@responses.activate
+def test_post_partitioned_journal_resumes(api):
+    path = journal_path()
+    payload = {"events": [{"event": str(i)} for i in range(7)]}
+    posted = []
+
+    def callback(request):
+        chunk = json.loads(request.body)["events"]
+        posted.append([e["event"] for e in chunk])
+        if chunk[0]["event"] == "4" and len(posted) < 4:
+            return 500, {}, json.dumps({"message": "boom"})
+        return 200, {}, json.dumps(import_summary())
+
+    responses.add_callback(responses.POST, "{}/events".format(API_URL), callback=callback)
+
+    with pytest.raises(exceptions.RequestException):
+        list(api.post_partitioned("events", json=payload, thresh=2, journal=path))
+    assert posted == [["0", "1"], ["2", "3"], ["4", "5"]]
+
+    journal = ChunkJournal(path)
+    jobs = list(journal._entries)
+    assert len(jobs) == 1
+    assert sorted(journal.completed(jobs[0])) == [0, 1]
+    assert list(journal.failed(jobs[0])) == [2]
+    assert "500" in journal.failed(jobs[0])[2]["status"]
+
+    # rerun: completed chunks are skipped, the failed one is retried
+    responses_ = list(api.post_partitioned("events", json=payload, thresh=2, journal=path))
+    assert len(responses_) == 2
+    assert posted[3:] == [["4", "5"], ["6"]]
+    assert sorted(ChunkJournal(path).completed(jobs[0])) == [0, 1, 2, 3]
+
+    # everything imported - nothing is posted again
+    assert list(api.post_partitioned("events", json=payload, thresh=2, journal=path)) == []
+    assert len(posted) == 5
+
+
+@responses.activate
+def test_post_partitioned_journal_changed_chunk_is_posted(api):
+    path = journal_path()
+    responses.add(responses.POST, "{}/events".format(API_URL), json=import_summary())
+    list(api.post_partitioned("events", json={"events": [1, 2, 3, 4]}, thresh=2, journal=path))
+    # same size, but another payload: another job, everything is posted
+    assert len(list(api.post_partitioned("events", json={"events": [1, 2, 3, 5]}, thresh=2, journal=path))) == 2
+    assert list(api.post_partitioned("events", json={"events": [1, 2, 3, 5]}, thresh=2, journal=path)) == []
+    # another job (other thresh) has its own entries
+    assert len(list(api.post_partitioned("events", json={"events": [1, 2, 3, 5]}, thresh=3, journal=path))) == 2
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        import_summary(status="ERROR", imported=0),
+        import_summary(status="WARNING", imported=0, ignored=2),
+        {"status": "OK"},  # no import summary
+        [],
+    ],
+)
+@responses.activate
+def test_post_partitioned_journal_checks_import_summary(api, body):
+    path = journal_path()
+    responses.add(responses.POST, "{}/events".format(API_URL), json=body, status=200)
+    payload = {"events": [1, 2]}
+    list(api.post_partitioned("events", json=payload, thresh=2, journal=path))
+
+    journal = ChunkJournal(path)
+    job = list(journal._entries)[0]
+    assert journal.completed(job) == {} and list(journal.failed(job)) == [0]
+    # not skipped on resume
+    assert len(list(api.post_partitioned("events", json=payload, thresh=2, journal=path))) == 1
+
+
+def test_chunk_journal_ignores_truncated_line():
+    path = journal_path()
+    journal = ChunkJournal(path)
+    journal.record("job", 0, "h0", ok=True, status=200)
+    journal.close()
+    with open(path, "a") as f:
+        f.write('{"job": "job", "chunk": 1, "ha')  # process died while writing
+
+    journal = ChunkJournal(path)
+    assert journal.completed("job") == {0: "h0"}
+    journal.record("job", 1, "h1", ok=True)
+    journal.close()
+    journal.close()
+    assert ChunkJournal(path).completed("job") == {0: "h0", 1: "h1"}
+    assert repr(journal) == "ChunkJournal({})".format(path)
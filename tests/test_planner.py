@@ -0,0 +1,193 @@
+import json
+import threading
+import time
+
+import pytest
+import responses
+
+from dhis2 import Api, exceptions, import_metadata_plan, plan_metadata_import
+from dhis2.planner import _strongly_connected
+from .common import BASEURL, API_URL
+
+
+@pytest.fixture  # BASE FIXTURE
+def api():
+    return Api(BASEURL, "admin", "district")
+
+
+def ref(uid):
+    return {"id": uid}
+
+
+PAYLOAD = {
+    "system": {"version": "2.36"},
+    "dataSets": [
+        {
+            "id": "ds000000001",
+            "categoryCombo": ref("cc000000001"),
+            "dataSetElements": [{"dataElement": ref("de000000001")}, {"dataElement": ref("de000000002")}],
+            "organisationUnits": [ref("ou000000002")],
+        }
+    ],
+    "dataElements": [
+        {"id": "de000000001", "categoryCombo": ref("cc000000001"), "createdBy": ref("us000000001")},
+        {"id": "de000000002", "categoryCombo": ref("bjDvmb4bfuf")},  # default, on the server
+        {"name": "no id"},
+    ],
+    "categoryCombos": [{"id": "cc000000001", "categories": [ref("ca000000001")]}],
+    "categories": [{"id": "ca000000001", "categoryOptions": [ref("co000000001")]}],
+    "categoryOptions": [{"id": "co000000001", "organisationUnits": [ref("ou000000001")]}],
+    "organisationUnits": [
+        {"id": "ou000000002", "parent": ref("ou000000001")},
+        {"id": "ou000000001"},
+    ],
+    "users": [{"id": "us000000001", "organisationUnits": [ref("ou000000001")]}],
+}
+
+
+def uids(partition):
+    return {key: [obj.get("id") for obj in objects] for key, objects in partition.items()}
+
+
+def test_plan_levels():
+    plan = plan_metadata_import(PAYLOAD)
+    assert [[uids(p) for p in level] for level in plan.levels] == [
+        [
+            {"dataElements": ["de000000002", None]},
+            {"organisationUnits": ["ou000000001"]},
+        ],
+        [
+            {"categoryOptions": ["co000000001"]},
+            {"organisationUnits": ["ou000000002"]},
+            {"users": ["us000000001"]},
+        ],
+        [{"categories": ["ca000000001"]}],
+        [{"categoryCombos": ["cc000000001"]}],
+        [{"dataElements": ["de000000001"]}],  # createdBy is not followed
+        [{"dataSets": ["ds000000001"]}],
+    ]
+    assert plan.type_order == [
+        "organisationUnits",
+        "categoryOptions",
+        "categories",
+        "categoryCombos",
+        "dataElements",
+        "dataSets",
+        "users",
+    ]
+    assert plan.cycles == [] and plan.partitions == 9
+    assert repr(plan) == "ImportPlan(levels=6, partitions=9, cycles=0)"
+    assert [uids(p) for p in plan][:2] == [{"dataElements": ["de000000002", None]}, {"organisationUnits": ["ou000000001"]}]
+
+
+def test_plan_thresh_and_order():
+    payload = {"organisationUnits": [{"id": "ou{:09d}".format(i)} for i in range(5)]}
+    plan = plan_metadata_import(payload, thresh=2)
+    assert [uids(p)["organisationUnits"] for p in plan.levels[0]] == [
+        ["ou000000000", "ou000000001"],
+        ["ou000000002", "ou000000003"],
+        ["ou000000004"],
+    ]
+    assert plan_metadata_import({}).levels == []
+
+
+def test_plan_cycles():
+    payload = {
+        "dataSets": [{"id": "ds000000001", "sections": [ref("se000000001")]}],
+        "sections": [{"id": "se000000001", "dataSet": ref("ds000000001")}],
+        "dataElements": [{"id": "de000000001", "self": ref("de000000001")}],
+        "indicators": [{"id": "in000000001", "numerator": "#{de000000001}", "x": [ref("se000000001")]}],
+    }
+    plan = plan_metadata_import(payload, thresh=1)
+    assert [[uids(p) for p in level] for level in plan.levels] == [
+        [
+            {"dataSets": ["ds000000001"], "sections": ["se000000001"]},  # one partition
+            {"dataElements": ["de000000001"]},
+        ],
+        [{"indicators": ["in000000001"]}],
+    ]
+    assert plan.cycles == [["ds000000001", "se000000001"]]
+    assert plan.type_order == ["dataElements", "dataSets", "sections", "indicators"]
+
+
+def test_plan_deep_hierarchy():
+    payload = {"organisationUnits": [{"id": "ou{:09d}".format(i), "parent": ref("ou{:09d}".format(i - 1))} for i in range(1, 5000)]}
+    payload["organisationUnits"].append({"id": "ou000000000"})
+    plan = plan_metadata_import(payload)
+    assert len(plan.levels) == 5000
+    assert uids(plan.levels[0][0]) == {"organisationUnits": ["ou000000000"]}
+
+
+def test_strongly_connected():
+    # 0 -> 1 -> 2 -> 0, 3 -> 2, 4
+    assert _strongly_connected([[1], [2], [0], [2], []]) == [[0, 1, 2], [3], [4]]
+    assert _strongly_connected([[1], []]) == [[1], [0]]
+
+
+@pytest.mark.parametrize(
+    "payload,thresh",
+    [
+        ([], 10),
+        ({"dataElements": ["de000000001"]}, 10),
+        ({"dataElements": [{"id": "de000000001"}], "indicators": [{"id": "de000000001"}]}, 10),
+        ({"dataElements": []}, 0),
+    ],
+)
+def test_plan_invalid(payload, thresh):
+    with pytest.raises(exceptions.ClientException):
+        plan_metadata_import(payload, thresh=thresh)
+
+
+def metadata_server(calls, fail_type=None, delay=0.0):
+    lock = threading.Lock()
+    active = [0]
+
+    def callback(request):
+        body = json.loads(request.body)
+        with lock:
+            active[0] += 1
+            calls.append((sorted(body), active[0]))
+        time.sleep(delay)
+        with lock:
+            active[0] -= 1
+        count = sum(len(v) for v in body.values())
+        if fail_type in body:
+            return 409, {}, json.dumps({"status": "ERROR", "stats": {"created": 0, "updated": 0, "ignored": count, "deleted": 0}})
+        return 200, {}, json.dumps({"status": "OK", "stats": {"created": count, "updated": 0, "ignored": 0, "deleted": 0}})
+
+    responses.add_callback(responses.POST, API_URL + "/metadata", callback=callback)
+
+
+@responses.activate
+def test_import_metadata_plan(api):
+    calls = []
+    metadata_server(calls, delay=0.02)
+    report = import_metadata_plan(api, PAYLOAD, max_workers=2, params={"importStrategy": "CREATE"})
+    assert report.ok and report.chunks == 9 and report.import_count["imported"] == 10
+    types = [t for t, _ in calls]
+    assert types.index(["dataSets"]) == 8 and types.index(["categoryCombos"]) < types.index(["dataElements"], 2)
+    assert max(active for _, active in calls) == 2  # level 1 has 3 partitions
+    assert "importStrategy=CREATE" in responses.calls[0].request.url
+
+
+@responses.activate
+def test_import_metadata_plan_stops_after_failed_level(api):
+    calls = []
+    metadata_server(calls, fail_type="categories")
+    plan = plan_metadata_import(PAYLOAD)
+    report = import_metadata_plan(api, plan)
+    assert [t for t, _ in calls][-1] == ["categories"] and report.chunks == 6
+    assert not report.ok and report.statuses["ERROR"] == 1
+
+    calls.clear()
+    report = import_metadata_plan(api, plan, stop_on_error=False)
+    assert report.chunks == 9
+
+
+@responses.activate
+def test_import_metadata_plan_connection_error(api):
+    responses.add(responses.POST, API_URL + "/metadata", body="Bad Gateway", status=502)
+    report = import_metadata_plan(api, {"dataElements": [{"id": "de000000001"}], "indicators": [{"id": "in000000001", "x": ref("de000000001")}]})
+    assert report.chunks == 1 and report.errors and not report.ok
+    with pytest.raises(exceptions.ClientException):
+        import_metadata_plan(api, {}, max_workers=0)
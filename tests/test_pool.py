@@ -0,0 +1,142 @@
+import json
+import os
+import tempfile
+import threading
+
+import pytest
+import responses
+
+from dhis2 import Api, ApiPool, exceptions
+from dhis2.utils import load_auth_profiles
+
+PROFILES = {
+    "play": {"baseurl": "https://play.dhis2.org/demo", "username": "admin", "password": "district"},
+    "prod": {
+        "baseurl": "https://prod.example.org",
+        "username": "robot",
+        "password": "secret",
+        "api_version": 36,
+        "user_agent": "nightly/1.0",
+    },
+}
+
+
+def auth_file(content):
+    fd, path = tempfile.mkstemp(suffix=".json")
+    with os.fdopen(fd, "w") as f:
+        json.dump(content, f)
+    return path
+
+
+def system_info(baseurl, calls=None):
+    def callback(request):
+        if calls is not None:
+            calls.append(request.url)
+        return 200, {}, json.dumps({"version": "2.36.1", "revision": "abc"})
+
+    responses.add_callback(responses.GET, baseurl + "/api/system/info.json", callback=callback)
+    responses.add_callback(responses.GET, baseurl + "/api/36/system/info.json", callback=callback)
+
+
+@pytest.mark.parametrize(
+    "content,default",
+    [
+        ({"dhis": PROFILES["play"]}, "dhis"),
+        ({"profiles": PROFILES}, None),
+        ({"profiles": PROFILES, "default": "prod"}, "prod"),
+        ({"profiles": {"play": PROFILES["play"]}}, "play"),
+        ({"profiles": {"prod": PROFILES["prod"]}, "dhis": PROFILES["play"]}, "dhis"),
+    ],
+)
+def test_load_auth_profiles(content, default):
+    profiles, found_default = load_auth_profiles(auth_file(content))
+    assert found_default == default
+    assert set(profiles) == set(content.get("profiles", {})) | ({"dhis"} if "dhis" in content else set())
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        [],
+        {},
+        {"profiles": []},
+        {"profiles": {"play": {"baseurl": "x", "username": "admin"}}},
+        {"profiles": {"play": None}},
+        {"profiles": PROFILES, "default": "test"},
+    ],
+)
+def test_load_auth_profiles_invalid(content):
+    with pytest.raises(exceptions.ClientException):
+        load_auth_profiles(auth_file(content))
+
+
+def test_from_auth_file_profile():
+    path = auth_file({"profiles": PROFILES})
+    api = Api.from_auth_file(path, profile="prod")
+    assert api.api_url == "https://prod.example.org/api/36"
+    assert api.session.headers["user-agent"] == "nightly/1.0"
+    api = Api.from_auth_file(path, profile="prod", api_version=30, user_agent="me")
+    assert api.api_version == 30 and api.session.headers["user-agent"] == "me"
+    with pytest.raises(exceptions.ClientException, match="No default auth profile"):
+        Api.from_auth_file(path)
+    with pytest.raises(exceptions.ClientException, match="choose one of: play, prod"):
+        Api.from_auth_file(path, profile="test")
+
+
+@responses.activate
+def test_pool_reuses_warmed_api():
+    calls = []
+    system_info("https://play.dhis2.org/demo", calls)
+    system_info("https://prod.example.org", calls)
+    pool = ApiPool.from_auth_file(auth_file({"profiles": PROFILES, "default": "play"}), pool_maxsize=32)
+    assert pool.profiles == ["play", "prod"] and "prod" in pool and "test" not in pool
+
+    apis = []
+
+    def use():
+        api = pool.get("prod")
+        apis.append(api)
+        assert api.version == "2.36.1"
+
+    threads = [threading.Thread(target=use) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(apis) == 8 and all(api is apis[0] for api in apis)
+    assert calls == ["https://prod.example.org/api/36/system/info.json"]  # once, when created
+    assert apis[0].session.get_adapter("https://prod.example.org")._pool_maxsize == 32
+
+    assert pool.get() is pool["play"] and pool.get().base_url == "https://play.dhis2.org/demo"
+    assert repr(pool) == "ApiPool(profiles=['play', 'prod'], open=['play', 'prod'])"
+    pool.close("prod")
+    assert repr(pool) == "ApiPool(profiles=['play', 'prod'], open=['play'])"
+    assert pool.get("prod") is not apis[0]
+    with pool:
+        pass
+    assert repr(pool) == "ApiPool(profiles=['play', 'prod'], open=[])"
+
+
+@responses.activate
+def test_pool_warm_fails():
+    responses.add(responses.GET, "https://play.dhis2.org/demo/api/system/info.json", json={}, status=401)
+    pool = ApiPool(PROFILES)
+    with pytest.raises(exceptions.RequestException):
+        pool.get("play")
+    assert repr(pool) == "ApiPool(profiles=['play', 'prod'], open=[])"
+    with pytest.raises(exceptions.ClientException):
+        pool.get()  # no default
+    assert ApiPool(PROFILES, warm=False).get("play").username == "admin"  # no request
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"profiles": {}},
+        {"profiles": PROFILES, "default": "test"},
+        {"profiles": PROFILES, "pool_maxsize": 0},
+    ],
+)
+def test_pool_invalid(kwargs):
+    with pytest.raises(exceptions.ClientException):
+        ApiPool(**kwargs)
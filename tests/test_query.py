@@ -0,0 +1,258 @@
+import json
+import os
+import tempfile
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import responses
+
+from dhis2 import Api, Query, exceptions
+from dhis2.query import SCHEMA_FIELDS, SchemaCache, Schemas, parse_fields
+from .common import BASEURL, API_URL
+
+
+@pytest.fixture  # BASE FIXTURE
+def api():
+    return Api(BASEURL, "admin", "district")
+
+
+SCHEMAS = [
+    {
+        "plural": "dataElements",
+        "klass": "org.hisp.dhis.dataelement.DataElement",
+        "properties": [
+            {"name": "id", "fieldName": "uid", "klass": "java.lang.String"},
+            {"name": "name", "fieldName": "name", "klass": "java.lang.String"},
+            {"name": "valueType", "fieldName": "valueType", "klass": "org.hisp.dhis.common.ValueType"},
+            {"name": "categoryCombo", "fieldName": "categoryCombo", "klass": "org.hisp.dhis.category.CategoryCombo"},
+            {
+                "name": "dataSetElement",
+                "fieldName": "dataSetElements",
+                "collectionName": "dataSetElements",
+                "collection": True,
+                "klass": "java.util.Set",
+                "itemKlass": "org.hisp.dhis.dataset.DataSetElement",
+            },
+        ],
+    },
+    {
+        "plural": "categoryCombos",
+        "klass": "org.hisp.dhis.category.CategoryCombo",
+        "properties": [{"name": "id"}, {"name": "name"}],
+    },
+    {
+        "plural": "dataSetElements",
+        "klass": "org.hisp.dhis.dataset.DataSetElement",
+        "properties": [{"name": "dataSet", "klass": "org.hisp.dhis.dataset.DataSet"}],
+    },
+    {"plural": "dataSets", "klass": "org.hisp.dhis.dataset.DataSet"},
+]
+
+
+def schemas_server(calls):
+    def callback(request):
+        calls.append(parse_qs(urlparse(request.url).query))
+        return 200, {}, json.dumps({"schemas": SCHEMAS})
+
+    responses.add_callback(responses.GET, API_URL + "/schemas.json", callback=callback)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "id,name",
+        "id,name~rename(label),children~size",
+        "categoryCombo[id,categories[id,name~rename(n)]],:owner,!code,*",
+        "dataSetElements~pluck(dataSet)[id]",
+    ],
+)
+def test_parse_fields_round_trip(text):
+    assert ",".join(str(f) for f in parse_fields(text)) == text
+
+
+@pytest.mark.parametrize("text", ["id,categoryCombo[id", "id]", "name~", "categoryCombo[id]x", "~size"])
+def test_parse_fields_invalid(text):
+    with pytest.raises(exceptions.ClientException):
+        parse_fields(text)
+
+
+def test_query_params():
+    query = (
+        Query("dataElements")
+        .fields("id", "name~rename(label)")
+        .fields(categoryCombo=["id", "name"], dataSetElements={"dataSet": "id,name"})
+        .filter("valueType", "eq", "NUMBER")
+        .filter("categoryCombo.id", "in", ["a", "b"])
+        .filter("zeroIsSignificant", "eq", True)
+        .filter("code", "!null")
+        .order("name")
+        .order("created", "idesc")
+        .match_any()
+    )
+    assert query.params() == {
+        "fields": "id,name~rename(label),categoryCombo[id,name],dataSetElements[dataSet[id,name]]",
+        "filter": [
+            "valueType:eq:NUMBER",
+            "categoryCombo.id:in:[a,b]",
+            "zeroIsSignificant:eq:true",
+            "code:!null",
+        ],
+        "order": "name:asc,created:idesc",
+        "rootJunction": "OR",
+    }
+    assert Query("dataElements").params() == {}
+    assert repr(Query("x").fields("id")) == "Query('x', {'fields': 'id'})"
+
+
+@pytest.mark.parametrize(
+    "build",
+    [
+        lambda q: q.fields(categoryCombo=5),
+        lambda q: q.fields(**{"a,b": "id"}),
+        lambda q: q.fields(**{"a[id]": "name"}),
+        lambda q: q.filter("name", "equals", "x"),
+        lambda q: q.filter("name", "eq"),
+        lambda q: q.filter("name", "null", "x"),
+        lambda q: q.order("name", "up"),
+    ],
+)
+def test_query_invalid(build):
+    with pytest.raises(exceptions.ClientException):
+        build(Query("dataElements"))
+
+
+def test_query_validate():
+    schemas = Schemas(SCHEMAS)
+    valid = (
+        Query("dataElements.json")
+        .fields("id", "uid", "name~rename(n)", "!valueType", ":owner", "*")
+        .fields(categoryCombo="id,name", dataSetElements={"dataSet": "id,whatever"})
+        .filter("categoryCombo.id", "eq", "x")
+        .filter("dataSetElements.dataSet.id", "eq", "y")
+        .filter("identifiable", "token", "malaria")
+        .order("name")
+    )
+    assert valid.validate(schemas) is valid
+    assert Query("events").fields("anything").validate(schemas)  # no schema, not checked
+
+    invalid = (
+        Query("dataElements/abc")
+        .fields("id", "nmae", categoryCombo=["id", "code"])
+        .filter("valueTyp", "eq", "NUMBER")
+        .filter("categoryCombo.shortName", "eq", "x")
+        .order("zzz")
+    )
+    with pytest.raises(exceptions.ClientException) as e:
+        invalid.validate(schemas)
+    assert str(e.value) == (
+        "Unknown properties of dataElements: 'nmae' (did you mean 'name'?), 'categoryCombo.code', "
+        "'valueTyp' (did you mean 'valueType'?), 'categoryCombo.shortName', 'zzz:asc'"
+    )
+
+
+def test_query_validate_collection_endpoint():
+    data_set = {
+        "plural": "dataSets",
+        "klass": "org.hisp.dhis.dataset.DataSet",
+        "properties": [
+            {"name": "id"},
+            {
+                "name": "dataElement",
+                "collectionName": "dataElements",
+                "collection": True,
+                "itemKlass": "org.hisp.dhis.dataelement.DataElement",
+            },
+            {"name": "section", "collectionName": "sections", "collection": True, "itemKlass": "Section"},
+        ],
+    }
+    schemas = Schemas(SCHEMAS[:-1] + [data_set])
+    # the fields are those of the collection's items
+    assert Query("dataSets/abc/dataElements.json").fields("id", "valueType", categoryCombo="name").validate(schemas)
+    with pytest.raises(exceptions.ClientException) as e:
+        Query("dataSets/abc/dataElements").fields("id", "periodType").validate(schemas)
+    assert str(e.value) == "Unknown properties of dataElements: 'periodType'"
+    # items or collections without a schema aren't checked
+    assert Query("dataSets/abc/sections").fields("anything").validate(schemas)
+    assert Query("dataSets/abc/nope").fields("anything").validate(schemas)
+    assert Query("events/abc/notes").fields("anything").validate(schemas)
+
+
+@responses.activate
+def test_query_params_with_api(api):
+    calls = []
+    schemas_server(calls)
+    cache = SchemaCache()
+    query = Query("dataElements").fields("id", "name").filter("name", "ilike", "malaria")
+    responses.add(responses.GET, API_URL + "/dataElements.json", json={"dataElements": []})
+    api.get(query.endpoint, params=query.params(api, cache=cache))
+    assert parse_qs(urlparse(responses.calls[-1].request.url).query) == {
+        "fields": ["id,name"],
+        "filter": ["name:ilike:malaria"],
+    }
+    query.params(api, cache=cache)
+    assert len(calls) == 1 and calls[0]["fields"][0].startswith("plural,klass,properties[")
+    with pytest.raises(exceptions.ClientException):
+        Query("dataElements").fields("nope").params(api, cache=cache)
+
+
+@responses.activate
+def test_query_with_get_paged(api):
+    schemas_server([])
+    responses.add(
+        responses.GET,
+        API_URL + "/dataElements.json",
+        json={"dataElements": [{"id": "a"}], "pager": {"page": 1, "pageCount": 1}},
+    )
+    query = Query("dataElements").fields("id").filter("valueType", "in", ["NUMBER", "INTEGER"])
+    pages = list(api.get_paged(query.endpoint, params=query.params(api), page_size=10))
+    assert pages[0]["dataElements"] == [{"id": "a"}]
+    sent = parse_qs(urlparse(responses.calls[-1].request.url).query)
+    assert sent["filter"] == ["valueType:in:[NUMBER,INTEGER]"] and sent["pageSize"] == ["10"]
+
+
+@responses.activate
+def test_schema_cache_file(api):
+    calls = []
+    schemas_server(calls)
+    path = os.path.join(tempfile.mkdtemp(), "schemas.json")
+    SchemaCache(path).get(api)
+    assert SchemaCache(path).get(api).properties("categoryCombos") == {"id": None, "name": None}
+    assert len(calls) == 1  # the second process read the file
+
+    cache = SchemaCache(path, max_age=0)
+    cache.get(api)
+    assert len(calls) == 2  # too old
+    cache.get(api)
+    cache.clear()
+    with open(path, "w") as f:
+        f.write("{")
+    assert SchemaCache(path).get(api).properties("dataSets") is None  # no properties
+    assert len(calls) == 3
+    with open(path) as f:
+        assert list(json.load(f)) == [BASEURL]
+
+
+@pytest.mark.parametrize(
+    "stored",
+    [
+        [],  # not an object
+        {BASEURL: "schemas"},
+        {BASEURL: {"schemas": []}},  # no fetched
+        {BASEURL: {"schemas": [], "fetched": "yesterday"}},
+    ],
+)
+@responses.activate
+def test_schema_cache_file_invalid(api, stored):
+    calls = []
+    schemas_server(calls)
+    path = os.path.join(tempfile.mkdtemp(), "schemas.json")
+    if isinstance(stored, dict):
+        for entry in stored.values():
+            if isinstance(entry, dict):
+                entry.setdefault("fields", SCHEMA_FIELDS)
+    with open(path, "w") as f:
+        json.dump(stored, f)
+    assert SchemaCache(path).get(api).properties("categoryCombos") == {"id": None, "name": None}
+    assert len(calls) == 1  # requested again
+    with open(path) as f:
+        assert list(json.load(f)) == [BASEURL]
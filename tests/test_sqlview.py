@@ -90,6 +90,13 @@ dataelementid,name,valueType\n
         assert row == expected[index]
 
 
+@responses.activate
+def test_get_sqlview_criteria_no_dict(api, sql_view_view):
+    with pytest.raises(exceptions.ClientException):
+        for _ in api.get_sqlview(SQL_VIEW, criteria="name:0-11m"):
+            continue
+
+
 @responses.activate
 def test_get_sqlview_variable_query_execute_throws(api, sql_view_query):  # noqa
     responses.add(responses.POST, "{}/execute".format(sql_view_query), status=200)
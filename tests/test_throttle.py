@@ -0,0 +1,231 @@
+import threading
+import time
+
+import pytest
+import responses
+
+from dhis2 import Api, exceptions, RequestMetrics
+from dhis2.metrics import RequestHook, RequestRecord
+from dhis2.throttle import (
+    ConcurrencyLimit,
+    EndpointLimit,
+    Throttle,
+    TokenBucket,
+    endpoint_class,
+)
+from .common import BASEURL, API_URL
+
+
+@pytest.fixture  # BASE FIXTURE
+def api():
+    return Api(BASEURL, "admin", "district")
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.mark.parametrize(
+    "method,endpoint,expected",
+    [
+        ("get", "dataElements", "metadata"),
+        ("get", "system/info", "metadata"),
+        ("post", "schemas/dataElement", "metadata"),
+        ("get", "metadata", "metadata"),
+        ("post", "metadata", "imports"),
+        ("put", "dataValueSets", "imports"),
+        ("post", "events", "imports"),
+        ("get", "events/query", "tracker"),
+        ("get", "trackedEntityInstances.json", "tracker"),
+        ("get", "analytics/dataValueSet", "analytics"),
+        ("get", "analytics", "analytics"),
+        ("get", "analyticsTables", "analytics"),
+    ],
+)
+def test_endpoint_class(method, endpoint, expected):
+    assert endpoint_class(method, endpoint) == expected
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, burst=2, clock=clock, sleep=clock.sleep)
+    assert bucket.acquire() == 0 and bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert bucket.acquire() == pytest.approx(0.5)  # reserved behind the previous one
+    clock.now += 10
+    assert bucket.acquire() == 0  # refilled, but never more than the burst
+    bucket.set_rate(4)
+    assert bucket.rate == 4.0
+    with pytest.raises(exceptions.ClientException):
+        TokenBucket(rate=0)
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=200, burst=1)
+    start = time.monotonic()
+    for _ in range(21):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_concurrency_limit():
+    limit = ConcurrencyLimit(2)
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def work():
+        limit.acquire()
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.01)
+        with lock:
+            active[0] -= 1
+        limit.release()
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert peak[0] == 2
+    limit.set_limit(3)
+    assert limit.limit == 3
+    with pytest.raises(exceptions.ClientException):
+        ConcurrencyLimit(0)
+
+
+def test_endpoint_limit_backs_off_and_recovers():
+    clock = FakeClock()
+    limit = EndpointLimit(
+        rate=10, max_concurrency=4, latency_target=2.0, recover_after=2, clock=clock, sleep=clock.sleep
+    )
+    limit.observe(429, 0.1)
+    assert limit.rate == 5 and limit.current_concurrency == 2 and limit.throttled == 1
+    limit.observe(503, 0.1)  # within the cooldown: no further back-off
+    assert limit.rate == 5 and limit.throttled == 1
+    clock.now += 1
+    limit.observe(200, 3.0)  # slow
+    assert limit.rate == 2.5 and limit.current_concurrency == 1
+    limit.observe(None, 0.0)  # connection error: neither good nor bad
+    for _ in range(4):
+        limit.observe(200, 0.1)
+    assert limit.rate == pytest.approx(2.5 * 1.1 * 1.1) and limit.current_concurrency == 3
+    for _ in range(100):
+        limit.observe(200, 0.1)
+    assert limit.rate == 10 and limit.current_concurrency == 4
+    assert "EndpointLimit(rate=10" in repr(limit)
+
+
+def test_endpoint_limit_min_rate():
+    clock = FakeClock()
+    limit = EndpointLimit(rate=1, min_rate=0.5, cooldown=0, clock=clock, sleep=clock.sleep)
+    for _ in range(5):
+        limit.observe(429, 0.1)
+    assert limit.rate == 0.5 and limit.current_concurrency is None
+
+
+def test_endpoint_limit_retry_after_pauses():
+    clock = FakeClock()
+    limit = EndpointLimit(max_concurrency=1, clock=clock, sleep=clock.sleep)
+    limit.observe(429, 0.1, retry_after="3")
+    limit.observe(503, 0.1, retry_after="Wed, 21 Oct 2015 07:28:00 GMT")  # ignored
+    limit.acquire()
+    assert clock.slept == [3.0]
+    limit.release()
+    limit.acquire()
+    assert clock.slept == [3.0]
+    limit.release()
+    assert limit.rate is None
+
+
+@pytest.mark.parametrize("kwargs", [{"rate": 1, "burst": 1}, {}])
+def test_endpoint_limit_releases_slot_if_wait_fails(kwargs):
+    clock = FakeClock()
+
+    def sleep(seconds):
+        raise KeyboardInterrupt
+
+    limit = EndpointLimit(max_concurrency=1, clock=clock, sleep=sleep, **kwargs)
+    if "rate" in kwargs:
+        limit.bucket.acquire()  # the next token is a second away
+    else:
+        limit.observe(429, 0.1, retry_after="3")
+    with pytest.raises(KeyboardInterrupt):
+        limit.acquire()
+    assert limit.concurrency.active == 0
+
+
+def test_throttle_unknown_class():
+    with pytest.raises(exceptions.ClientException):
+        Throttle(reports=EndpointLimit(rate=1))
+
+
+@responses.activate
+def test_api_throttle(api):
+    clock = FakeClock()
+    analytics = EndpointLimit(rate=1, burst=1, max_concurrency=2, clock=clock, sleep=clock.sleep)
+    throttle = Throttle(analytics=analytics)
+    metrics = RequestMetrics()
+    api.add_request_hook(metrics)
+    api.throttle = throttle
+    assert api.request_hooks == [throttle, metrics]
+
+    responses.add(responses.GET, "{}/analytics.json".format(API_URL), json={}, status=200)
+    responses.add(responses.GET, "{}/dataElements.json".format(API_URL), json={}, status=200)
+    for _ in range(3):
+        api.get("analytics")
+        api.get("dataElements")
+    assert clock.slept == [pytest.approx(1.0), pytest.approx(1.0)]  # only analytics is limited
+    assert analytics.concurrency.active == 0
+
+    responses.replace(
+        responses.GET, "{}/analytics.json".format(API_URL), json={}, status=429, headers={"Retry-After": "5"}
+    )
+    with pytest.raises(exceptions.RequestException):
+        api.get("analytics")
+    assert analytics.throttled == 1 and analytics.rate == 0.5
+    assert analytics.concurrency.active == 0
+
+    api.throttle = None
+    assert api.throttle is None and api.request_hooks == [metrics]
+
+
+@responses.activate
+def test_api_throttle_default_and_connection_error(api):
+    limit = EndpointLimit(max_concurrency=1)
+    api.throttle = Throttle(default=limit)
+    with pytest.raises(Exception):
+        api.get("dataElements")  # no mock registered: ConnectionError
+    assert limit.concurrency.active == 0 and limit.throttled == 0
+
+
+def test_failing_before_request_hook_cleans_up(api):
+    events = []
+
+    class Recording(RequestHook):
+        def after_request(self, record):
+            events.append(("after", repr(record.error)))
+
+    class Failing(RequestHook):
+        def before_request(self, record):
+            raise RuntimeError("no")
+
+    api.add_request_hook(Recording())
+    api.add_request_hook(Failing())
+    with pytest.raises(RuntimeError):
+        api.get("dataElements")
+    assert events == [("after", "RuntimeError('no')")]
+
+
+def test_throttle_after_request_without_acquire():
+    Throttle().after_request(RequestRecord("get", "dataElements", "url"))
@@ -0,0 +1,279 @@
+import pytest
+import requests
+import responses
+
+from dhis2 import Api, InMemorySpanExporter, Tracer
+from dhis2.tracing import NOOP_SPAN, NOOP_TRACER, NoopTracer, TracingHook
+from .common import BASEURL, API_URL
+
+
+@pytest.fixture  # BASE FIXTURE
+def api():
+    return Api(BASEURL, "admin", "district")
+
+
+@pytest.fixture
+def exporter(api):
+    exporter = InMemorySpanExporter()
+    api.tracer = Tracer(exporter)
+    return exporter
+
+
+def add_pages(endpoint, page_size, pages, last_page_items):
+    for page in range(1, pages + 1):
+        items = page_size if page < pages else last_page_items
+        responses.add(
+            responses.GET,
+            "{}/{}.json?pageSize={}&page={}&totalPages=True".format(API_URL, endpoint, page_size, page),
+            json={
+                "pager": {"page": page, "pageCount": pages},
+                endpoint: [{"id": str(i)} for i in range(items)],
+            },
+            status=200,
+        )
+
+
+def test_tracer_span_nesting():
+    exporter = InMemorySpanExporter()
+    tracer = Tracer(exporter)
+    with tracer.span("outer", a=1) as outer:
+        assert tracer.current_span() is outer
+        assert outer.duration >= 0 and outer.end is None
+        with tracer.span("inner") as inner:
+            inner.set_attribute("b", 2)
+        assert tracer.current_span() is outer
+    assert tracer.current_span() is None
+
+    assert [s.name for s in exporter.spans] == ["inner", "outer"]
+    assert inner.parent_id == outer.span_id and inner.trace_id == outer.trace_id
+    assert outer.parent_id is None
+    assert exporter.children(outer) == [inner]
+    assert outer.duration >= inner.duration >= 0
+    assert exporter.to_dicts()[1]["attributes"] == {"a": 1}
+    assert exporter.render().splitlines()[1].startswith("  inner ")
+    exporter.clear()
+    assert exporter.spans == []
+
+
+def test_tracer_span_records_error():
+    exporter = InMemorySpanExporter()
+    tracer = Tracer(exporter)
+    with pytest.raises(ValueError):
+        with tracer.span("failing"):
+            raise ValueError("boom")
+    span = exporter.find("failing")[0]
+    assert span.error == "ValueError: boom"
+    assert "ERROR ValueError: boom" in exporter.render()
+    assert "failing" in repr(span)
+
+
+def test_noop_tracer():
+    tracer = NoopTracer()
+    assert not tracer.enabled
+    with tracer.span("anything") as span:
+        assert span is NOOP_SPAN
+        span.set_attribute("a", 1)
+        span.set_attributes(b=2)
+    span = tracer.start_span("x")
+    tracer.deactivate(span)
+    tracer.activate(span)
+    tracer.end_span(span)
+    assert tracer.current_span() is None
+
+
+def test_api_tracer_default_is_noop(api):
+    assert api.tracer is NOOP_TRACER
+    assert api.request_hooks == []
+
+
+def test_api_tracer_setter_swaps_hook(api):
+    first = Tracer()
+    api.tracer = first
+    assert len(api.request_hooks) == 1 and isinstance(api.request_hooks[0], TracingHook)
+    api.tracer = Tracer()
+    assert len(api.request_hooks) == 1 and api.request_hooks[0].tracer is api.tracer
+    api.tracer = None
+    assert api.tracer is NOOP_TRACER and api.request_hooks == []
+
+
+@responses.activate
+def test_get_paged_spans(api, exporter):
+    add_pages("organisationUnits", 2, 3, 1)
+    data = api.get_paged("organisationUnits", page_size=2, merge=True)
+    assert len(data["organisationUnits"]) == 5
+
+    op = exporter.find("get_paged")[0]
+    assert op.attributes == {
+        "dhis2.endpoint": "organisationUnits",
+        "page_size": 2,
+        "pages": 3,
+        "items": 5,
+    }
+    pages = exporter.children(op)
+    assert [(p.name, p.attributes["page"], p.attributes["items"]) for p in pages] == [
+        ("page", 1, 2),
+        ("page", 2, 2),
+        ("page", 3, 1),
+    ]
+    http = exporter.children(pages[0])
+    assert len(http) == 1
+    assert http[0].name == "HTTP GET organisationUnits"
+    assert http[0].attributes["http.status_code"] == 200
+    assert http[0].attributes["http.response_bytes"] > 0
+    assert op.error is None
+
+
+@responses.activate
+def test_get_paged_spans_caller_work_not_nested(api, exporter):
+    add_pages("organisationUnits", 2, 2, 1)
+    for _ in api.get_paged("organisationUnits", page_size=2):
+        with api.tracer.span("caller"):
+            pass
+    op = exporter.find("get_paged")[0]
+    assert all(s.parent_id != op.span_id for s in exporter.find("caller"))
+    assert op.attributes["pages"] == 2
+
+
+@responses.activate
+def test_get_paged_spans_closed_early(api, exporter):
+    add_pages("organisationUnits", 2, 3, 1)
+    pages = api.get_paged("organisationUnits", page_size=2)
+    next(pages)
+    pages.close()
+    op = exporter.find("get_paged")[0]
+    assert op.attributes["pages"] == 1 and op.error is None
+    assert api.tracer.current_span() is None
+
+
+@responses.activate
+def test_get_paged_spans_error(api, exporter):
+    responses.add(
+        responses.GET,
+        "{}/organisationUnits.json?pageSize=2&page=1&totalPages=True".format(API_URL),
+        body="error",
+        status=500,
+    )
+    with pytest.raises(Exception):
+        api.get_paged("organisationUnits", page_size=2, merge=True)
+    op = exporter.find("get_paged")[0]
+    assert op.error.startswith("RequestException")
+    assert exporter.find("page")[0].error.startswith("RequestException")
+    assert exporter.find("HTTP GET organisationUnits")[0].attributes["http.status_code"] == 500
+
+
+@responses.activate
+def test_post_partitioned_spans(api, exporter):
+    responses.add(responses.POST, "{}/metadata".format(API_URL), json={}, status=200)
+    payload = {"dataElements": [{"id": str(i)} for i in range(5)]}
+    assert len(list(api.post_partitioned("metadata", json=payload, thresh=2))) == 3
+
+    op = exporter.find("post_partitioned")[0]
+    assert op.attributes == {
+        "dhis2.endpoint": "metadata",
+        "collection": "dataElements",
+        "thresh": 2,
+        "chunks": 3,
+        "items": 5,
+        "skipped": 0,
+    }
+    chunks = exporter.children(op)
+    assert [(c.attributes["chunk"], c.attributes["items"]) for c in chunks] == [(0, 2), (1, 2), (2, 1)]
+    assert all(c.attributes["payload_bytes"] > 0 for c in chunks)
+    http = exporter.children(chunks[0])[0]
+    assert http.name == "HTTP POST metadata"
+    assert http.attributes["http.request_bytes"] == chunks[0].attributes["payload_bytes"]
+
+
+@responses.activate
+def test_post_partitioned_spans_error(api, exporter):
+    responses.add(responses.POST, "{}/metadata".format(API_URL), body=requests.ConnectionError("down"))
+    payload = {"dataElements": [{"id": "a"}]}
+    with pytest.raises(requests.ConnectionError):
+        list(api.post_partitioned("metadata", json=payload))
+    op = exporter.find("post_partitioned")[0]
+    assert op.error == "ConnectionError: down"
+    assert op.attributes["chunks"] == 0
+    assert exporter.find("HTTP POST metadata")[0].attributes["http.status_code"] is None
+
+
+@responses.activate
+def test_get_sqlview_spans(api, exporter):
+    url = "{}/sqlViews/qMYMT0iUGkG".format(API_URL)
+    responses.add(responses.GET, "{}.json?fields=type".format(url), json={"type": "VIEW"}, status=200)
+    responses.add(responses.GET, "{}/data.csv".format(url), body="name\na\nb\n", status=200)
+    rows = api.get_sqlview("qMYMT0iUGkG", merge=True)
+    assert len(rows) == 2
+
+    setup = exporter.find("get_sqlview_setup")[0]
+    assert setup.attributes == {"uid": "qMYMT0iUGkG", "execute": False}
+    assert [c.name for c in exporter.children(setup)] == ["HTTP GET sqlViews/{uid}"]
+    op = exporter.find("get_sqlview")[0]
+    assert op.attributes == {"uid": "qMYMT0iUGkG", "execute": False, "rows": 2}
+    assert [c.name for c in exporter.children(op)] == ["HTTP GET sqlViews/{uid}/data"]
+    assert api.tracer.current_span() is None
+
+
+@responses.activate
+def test_get_sqlview_spans_not_iterated(api, exporter):
+    url = "{}/sqlViews/qMYMT0iUGkG".format(API_URL)
+    responses.add(responses.GET, "{}.json?fields=type".format(url), json={"type": "VIEW"}, status=200)
+    responses.add(responses.GET, "{}/data.csv".format(url), body="name\na\n", status=200)
+    rows = api.get_sqlview("qMYMT0iUGkG")
+    # the operation span starts with the download, nothing is left open before that
+    assert exporter.find("get_sqlview") == [] and exporter.find("get_sqlview_setup")
+    assert api.tracer.current_span() is None
+    assert list(rows) == [{"name": "a"}]
+    assert exporter.find("get_sqlview")[0].attributes["rows"] == 1
+
+
+@responses.activate
+def test_post_partitioned_spans_closed_early(api, exporter):
+    responses.add(responses.POST, "{}/metadata".format(API_URL), json={}, status=200)
+    chunks = api.post_partitioned("metadata", json={"dataElements": [{"id": str(i)} for i in range(5)]}, thresh=2)
+    next(chunks)
+    chunks.close()
+    op = exporter.find("post_partitioned")[0]
+    assert op.attributes["chunks"] == 1 and op.error is None
+    assert len(responses.calls) == 1 and api.tracer.current_span() is None
+
+
+@responses.activate
+def test_get_sqlview_spans_closed_early(api, exporter):
+    url = "{}/sqlViews/qMYMT0iUGkG".format(API_URL)
+    responses.add(responses.GET, "{}.json?fields=type".format(url), json={"type": "VIEW"}, status=200)
+    responses.add(responses.GET, "{}/data.csv".format(url), body="name\na\nb\n", status=200)
+    rows = api.get_sqlview("qMYMT0iUGkG")
+    assert next(rows) == {"name": "a"}
+    rows.close()
+    op = exporter.find("get_sqlview")[0]
+    assert op.attributes["rows"] == 1 and op.error is None
+    assert api.tracer.current_span() is None
+
+
+@responses.activate
+def test_get_sqlview_spans_setup_error(api, exporter):
+    url = "{}/sqlViews/qMYMT0iUGkG".format(API_URL)
+    responses.add(responses.GET, "{}.json?fields=type".format(url), json={"type": "QUERY"}, status=200)
+    with pytest.raises(Exception):
+        api.get_sqlview("qMYMT0iUGkG", var="not a dict")
+    assert exporter.find("get_sqlview_setup")[0].error.startswith("ClientException")
+    assert exporter.find("get_sqlview") == []
+    assert api.tracer.current_span() is None
+
+
+@responses.activate
+def test_get_sqlview_spans_download_error(api, exporter):
+    url = "{}/sqlViews/qMYMT0iUGkG".format(API_URL)
+    responses.add(responses.GET, "{}.json?fields=type".format(url), json={"type": "VIEW"}, status=200)
+    responses.add(responses.GET, "{}/data.csv".format(url), body="nope", status=404)
+    with pytest.raises(Exception):
+        api.get_sqlview("qMYMT0iUGkG", merge=True)
+    assert exporter.find("get_sqlview")[0].error.startswith("RequestException")
+
+
+def test_tracing_hook_without_span_is_noop():
+    from dhis2.metrics import RequestRecord
+
+    exporter = InMemorySpanExporter()
+    TracingHook(Tracer(exporter)).after_request(RequestRecord("get", "x", "http://x"))
+    assert exporter.spans == []
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 
 import csv
+import io
+import json
+import locale
 import os
 import re
 import sys
@@ -21,7 +24,11 @@ from dhis2.utils import (
     is_valid_uid,
     pretty_json,
     clean_obj,
-    import_response_ok
+    import_response_ok,
+    iter_json_file,
+    count_json_collections,
+    _rebatch_columns,
+    _JsonStream,
 )
 from .common import BASEURL
 
@@ -64,11 +71,363 @@ def test_load_csv_not_found():
             pass
 
 
+@pytest.fixture
+def csv_values_file():
+    tmp = tempfile.mkdtemp()
+    filename = os.path.join(tmp, "values.csv")
+    with open(filename, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f, delimiter=";")
+        w.writerow(["dataElement", "period", "value"])
+        for i in range(7):
+            w.writerow(["de{}".format(i), "2021010{}".format(i), str(i)])
+    yield filename
+    os.remove(filename)
+    os.rmdir(tmp)
+
+
+def test_load_csv_converters(csv_values_file):
+    loaded = list(
+        load_csv(csv_values_file, delimiter=";", encoding="utf-8", converters={"value": int})
+    )
+    assert [row["value"] for row in loaded] == list(range(7))
+    assert loaded[0] == {"dataElement": "de0", "period": "20210100", "value": 0}
+
+
+def test_load_csv_converters_unknown_column(csv_values_file):
+    with pytest.raises(exceptions.ClientException):
+        list(load_csv(csv_values_file, delimiter=";", converters={"nothere": int}))
+
+
+def test_load_csv_batched(csv_values_file):
+    batches = list(load_csv(csv_values_file, delimiter=";", batch_size=3))
+    assert [len(b) for b in batches] == [3, 3, 1]
+    assert batches[2] == [{"dataElement": "de6", "period": "20210106", "value": "6"}]
+
+
+@pytest.mark.parametrize("engine", ["python", "pandas", "pyarrow"])
+def test_load_csv_columnar(csv_values_file, engine):
+    if engine != "python":
+        pytest.importorskip(engine)
+    batches = list(
+        load_csv(
+            csv_values_file,
+            delimiter=";",
+            encoding="utf-8",
+            batch_size=3,
+            columnar=True,
+            converters={"value": float},
+            engine=engine,
+        )
+    )
+    assert [len(b["value"]) for b in batches] == [3, 3, 1]
+    assert batches[0] == {
+        "dataElement": ["de0", "de1", "de2"],
+        "period": ["20210100", "20210101", "20210102"],
+        "value": [0.0, 1.0, 2.0],
+    }
+
+
+@pytest.mark.parametrize("engine", ["pandas", "pyarrow"])
+def test_load_csv_fast_engine_rows(csv_file, engine):
+    pytest.importorskip(engine)
+    expected = list(load_csv(csv_file))
+    assert list(load_csv(csv_file, engine=engine)) == expected
+    assert list(load_csv(csv_file, engine=engine, batch_size=2)) == [
+        expected[:2],
+        expected[2:],
+    ]
+
+
+@pytest.mark.parametrize("engine", ["python", "pandas", "pyarrow"])
+def test_load_csv_empty_file(engine):
+    if engine != "python":
+        pytest.importorskip(engine)
+    filename = os.path.join(tempfile.mkdtemp(), "empty.csv")
+    open(filename, "w").close()
+    assert list(load_csv(filename, batch_size=2, columnar=True, engine=engine)) == []
+    assert list(load_csv(filename)) == []
+
+
+@pytest.mark.parametrize("engine", ["python", "pandas", "pyarrow"])
+def test_load_csv_fast_engine_not_found(engine):
+    if engine != "python":
+        pytest.importorskip(engine)
+    with pytest.raises(exceptions.ClientException):
+        list(load_csv("nothere.csv", batch_size=2, columnar=True, engine=engine))
+
+
+@pytest.mark.parametrize("engine", ["python", "pandas", "pyarrow"])
+def test_load_csv_ragged_rows(engine):
+    if engine != "python":
+        pytest.importorskip(engine)
+    filename = os.path.join(tempfile.mkdtemp(), "ragged.csv")
+    with open(filename, "w") as f:
+        f.write("a,b\n1,2\n3\n\n4,5,6\n7,8\n")
+    # columnar output pads short rows with "" and drops surplus values
+    assert list(load_csv(filename, batch_size=3, columnar=True, engine=engine)) == [
+        {"a": ["1", "3", "4"], "b": ["2", "", "5"]},
+        {"a": ["7"], "b": ["8"]},
+    ]
+    if engine == "python":  # rows as read by csv.DictReader
+        expected = [
+            {"a": "1", "b": "2"},
+            {"a": "3", "b": None},
+            {"a": "4", "b": "5", None: ["6"]},
+            {"a": "7", "b": "8"},
+        ]
+        with open(filename) as f:
+            assert list(csv.DictReader(f)) == expected
+    else:
+        expected = [
+            {"a": "1", "b": "2"},
+            {"a": "3", "b": ""},
+            {"a": "4", "b": "5"},
+            {"a": "7", "b": "8"},
+        ]
+    assert list(load_csv(filename, engine=engine)) == expected
+
+
+def test_load_csv_ragged_rows_converters():
+    filename = os.path.join(tempfile.mkdtemp(), "ragged.csv")
+    with open(filename, "w") as f:
+        f.write("a,b\n1,2\n3\n")
+    assert list(load_csv(filename, converters={"b": int})) == [
+        {"a": "1", "b": 2},
+        {"a": "3", "b": None},  # a missing value is not converted
+    ]
+
+
+def test_load_csv_pyarrow_ragged_rows_after_first_block():
+    pytest.importorskip("pyarrow")
+    filename = os.path.join(tempfile.mkdtemp(), "ragged.csv")
+    # more than a block of pyarrow before the ragged rows
+    rows = ["{},{}".format(i, i) for i in range(200000)] + ["x", "y,y,y"]
+    with open(filename, "w") as f:
+        f.write("a,b\n" + "\n".join(rows) + "\n")
+    expected = list(load_csv(filename, batch_size=1000, columnar=True))
+    assert list(load_csv(filename, batch_size=1000, columnar=True, engine="pyarrow")) == expected
+    assert expected[-1]["a"][-2:] == ["x", "y"] and expected[-1]["b"][-2:] == ["", "y"]
+
+
+@pytest.mark.parametrize("engine", ["python", "pandas", "pyarrow"])
+def test_load_csv_default_encoding(engine, monkeypatch):
+    if engine != "python":
+        pytest.importorskip(engine)
+    filename = os.path.join(tempfile.mkdtemp(), "latin1.csv")
+    with open(filename, "w", encoding="latin-1") as f:
+        f.write("abc,def\nñ,äü\n")
+    monkeypatch.setattr(locale, "getpreferredencoding", lambda do_setlocale=True: "latin-1")
+    assert list(load_csv(filename, engine=engine)) == [{"abc": "ñ", "def": "äü"}]
+    with pytest.raises(exceptions.ClientException, match="decode"):
+        list(load_csv(filename, engine=engine, encoding="utf-8"))
+
+
+@pytest.mark.parametrize("engine", ["pandas", "pyarrow"])
+def test_load_csv_fast_engine_decode_error_after_header(engine):
+    pytest.importorskip(engine)
+    filename = os.path.join(tempfile.mkdtemp(), "mixed.csv")
+    with open(filename, "wb") as f:
+        f.write(b"a,b\n" + b"1,2\n" * 50000 + b"\xf1,3\n")
+    with pytest.raises(exceptions.ClientException):
+        list(load_csv(filename, batch_size=1000, columnar=True, engine=engine, encoding="utf-8"))
+
+
+def test_load_csv_pandas_parse_error():
+    pytest.importorskip("pandas")
+    filename = os.path.join(tempfile.mkdtemp(), "quote.csv")
+    with open(filename, "w") as f:
+        f.write('a,b\n"1,2\n3,4\n')
+    with pytest.raises(exceptions.ClientException, match="Could not parse"):
+        list(load_csv(filename, batch_size=2, columnar=True, engine="pandas"))
+
+
+@pytest.mark.parametrize("engine", ["python", "pandas"])
+def test_load_csv_read_error(csv_file, engine, monkeypatch):
+    if engine != "python":
+        pd = pytest.importorskip(engine)
+        monkeypatch.setattr(pd, "read_csv", lambda *args, **kwargs: raise_(OSError("disk gone")))
+    else:
+        monkeypatch.setattr(csv, "reader", lambda *args, **kwargs: raise_(OSError("disk gone")))
+    with pytest.raises(exceptions.ClientException, match="Could not read file"):
+        list(load_csv(csv_file, engine=engine, batch_size=2, columnar=engine != "python"))
+
+
+def raise_(exc):
+    raise exc
+
+
+def test_rebatch_columns():
+    batches = [{"a": [1, 2]}, {"a": [3, 4, 5]}, {"a": [6]}, {"a": [7, 8]}, {"a": [9]}]
+    assert list(_rebatch_columns(iter(batches), 2)) == [
+        {"a": [1, 2]},
+        {"a": [3, 4]},
+        {"a": [5, 6]},
+        {"a": [7, 8]},
+        {"a": [9]},
+    ]
+
+
+def test_load_csv_decode_error():
+    filename = os.path.join(tempfile.mkdtemp(), "latin1.csv")
+    with open(filename, "w", encoding="latin-1") as f:
+        f.write("abc,def\nñ,äü\n")
+    with pytest.raises(exceptions.ClientException, match="decode"):
+        list(load_csv(filename, encoding="utf-8"))
+    assert list(load_csv(filename, encoding="latin-1")) == [{"abc": "ñ", "def": "äü"}]
+
+
+def test_load_csv_is_directory():
+    with pytest.raises(exceptions.ClientException, match="Could not open"):
+        list(load_csv(tempfile.gettempdir()))
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"engine": "excel"},
+        {"batch_size": 0},
+        {"batch_size": "10"},
+        {"batch_size": True},
+        {"columnar": True},
+    ],
+)
+def test_load_csv_invalid_arguments(csv_file, kwargs):
+    with pytest.raises(exceptions.ClientException):
+        load_csv(csv_file, **kwargs)
+
+
+def test_load_csv_optional_engine_missing(csv_file, monkeypatch):
+    monkeypatch.setitem(sys.modules, "pandas", None)  # makes `import pandas` fail
+    with pytest.raises(exceptions.ClientException, match="pip install pandas"):
+        list(load_csv(csv_file, engine="pandas"))
+
+
 def test_load_json_not_found():
     with pytest.raises(exceptions.ClientException):
         load_json("nothere.json")
 
 
+METADATA = {
+    "system": {"id": "abc", "nested": {"dataElements": [1, 2]}},
+    "date": "2021-01-01T00:00:00.000",
+    "version": 35,
+    "flag": True,
+    "dataElements": [
+        {"id": "fbfJHSPpUQD", "name": "ANC 1st visit [quoted \"brackets\" ]} \\", "aggregationLevels": []},
+        {"id": "cYeuwXTCPkU", "name": "ANC 2nd visit", "translations": [{"locale": "fr", "value": "CPN 2"}]},
+    ],
+    "organisationUnits": [{"id": "ImspTQPwCqd", "path": "/ImspTQPwCqd"}],
+    "emptyList": [],
+    "numbers": [1, -2.5e3, None, "x"],
+}
+
+
+@pytest.fixture
+def json_file():
+    filename = os.path.join(tempfile.mkdtemp(), "metadata.json")
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(METADATA, f, indent=2, ensure_ascii=False)
+    yield filename
+    os.remove(filename)
+
+
+@pytest.mark.parametrize(
+    "collection", ["dataElements", "organisationUnits", "emptyList", "numbers"]
+)
+def test_iter_json_file(json_file, collection):
+    it = iter_json_file(json_file, collection)
+    assert isinstance(it, GeneratorType)
+    assert list(it) == METADATA[collection]
+
+
+def test_iter_json_file_compact_and_unicode():
+    filename = os.path.join(tempfile.mkdtemp(), "compact.json")
+    data = {"a": "ñ", "dataElements": [{"name": "äü"}, {"name": "\u2603"}]}
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"), ensure_ascii=False)
+    assert list(iter_json_file(filename, "dataElements")) == data["dataElements"]
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 7, 64])
+def test_json_stream_small_blocks(json_file, block_size):
+    with open(json_file, encoding="utf-8") as f:
+        stream = _JsonStream(f, json_file, block_size=block_size)
+        values = {}
+        for key in stream.items():
+            values[key] = stream.value()
+    assert values == METADATA
+
+
+SCALARS = ["x", 1.5e10, True, -0.25, None, 12345678, False, 0, -1e-07, "", 3.0]
+
+
+@pytest.mark.parametrize("block_size", range(1, 40))
+def test_json_stream_scalars_split_by_blocks(block_size):
+    # a block may end within a number, e.g. after "1.5e"
+    text = json.dumps({"a": SCALARS, "b": 42}, separators=(",", ":"))
+    stream = _JsonStream(io.StringIO(text), "scalars.json", block_size=block_size)
+    values = {}
+    for key in stream.items():
+        values[key] = list(stream.array()) if key == "a" else stream.value()
+    assert values == {"a": SCALARS, "b": 42}
+
+
+def test_iter_json_file_collection_not_an_array(json_file):
+    with pytest.raises(exceptions.ClientException):
+        list(iter_json_file(json_file, "system"))
+
+
+def test_iter_json_file_collection_not_found(json_file):
+    with pytest.raises(exceptions.ClientException):
+        list(iter_json_file(json_file, "indicators"))
+
+
+def test_count_json_collections(json_file):
+    assert count_json_collections(json_file) == {
+        "dataElements": 2,
+        "organisationUnits": 1,
+        "emptyList": 0,
+        "numbers": 4,
+    }
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        "",
+        "[1, 2]",
+        '{"dataElements": [1, 2}',
+        '{"dataElements": [{"a": 1}',
+        '{"dataElements": [1 2]}',
+        '{dataElements: []}',
+        '{"a": 1 "dataElements": []}',
+        '{"a" 1}',
+        '{"a": ?, "dataElements": []}',
+    ],
+)
+def test_iter_json_file_invalid(content):
+    filename = os.path.join(tempfile.mkdtemp(), "invalid.json")
+    with open(filename, "w") as f:
+        f.write(content)
+    with pytest.raises(exceptions.ClientException):
+        list(iter_json_file(filename, "dataElements"))
+    with pytest.raises(exceptions.ClientException):
+        count_json_collections(filename)
+
+
+def test_iter_json_file_empty_object():
+    filename = os.path.join(tempfile.mkdtemp(), "empty.json")
+    with open(filename, "w") as f:
+        f.write(" { } ")
+    assert count_json_collections(filename) == {}
+
+
+@pytest.mark.parametrize("path", ["nothere.json", tempfile.gettempdir()])
+def test_iter_json_file_not_readable(path):
+    with pytest.raises(exceptions.ClientException):
+        list(iter_json_file(path, "dataElements"))
+
+
 @pytest.mark.parametrize(
     "payload,threshold,expected",
     [
@@ -437,6 +796,15 @@ def test_import_response_ok_tracked_entity_instances():
     assert import_response_ok(response) is False
 
 
+@pytest.mark.parametrize("response,expected", [
+    ({"status": "OK", "response": {"status": "SUCCESS", "importCount": {"imported": 1, "updated": 0, "ignored": 0, "deleted": 0}}}, True),
+    ({"status": "WARNING", "response": {"status": "WARNING", "importCount": {"imported": 1, "updated": 0, "ignored": 2, "deleted": 0}}}, False),
+    ({"status": "OK", "response": {"stats": {"created": 0, "updated": 3, "ignored": 0, "deleted": 0, "total": 3}}}, True),
+])
+def test_import_response_ok_web_message(response, expected):
+    assert import_response_ok(response) is expected
+
+
 @pytest.mark.parametrize("response", [
     {"no status": "hello"},
     False,
@@ -0,0 +1,178 @@
+import json
+import time
+
+import pytest
+import responses
+
+from dhis2 import Api, MetadataValidator
+from dhis2.query import SchemaCache, Schemas
+from dhis2.validation import compile_schema
+from .common import BASEURL, API_URL
+
+
+@pytest.fixture  # BASE FIXTURE
+def api():
+    return Api(BASEURL, "admin", "district")
+
+
+DATA_ELEMENT = {
+    "plural": "dataElements",
+    "klass": "org.hisp.dhis.dataelement.DataElement",
+    "properties": [
+        {"name": "id", "fieldName": "uid", "propertyType": "IDENTIFIER", "min": 11, "max": 11},
+        {"name": "name", "propertyType": "TEXT", "required": True, "min": 1, "max": 230},
+        {"name": "shortName", "propertyType": "TEXT", "required": True, "min": 1, "max": 50},
+        {"name": "url", "propertyType": "URL"},
+        {"name": "style", "propertyType": "COLOR"},
+        {"name": "email", "propertyType": "EMAIL"},
+        {"name": "zeroIsSignificant", "propertyType": "BOOLEAN"},
+        {"name": "created", "propertyType": "DATE"},
+        {"name": "decimals", "propertyType": "INTEGER", "min": 0, "max": 5},
+        {"name": "weight", "propertyType": "NUMBER"},
+        {"name": "geometry", "propertyType": "COMPLEX"},
+        {"name": "optional", "propertyType": "COMPLEX", "required": True, "collection": True},
+        {"name": "displayName", "propertyType": "TEXT", "required": True, "persisted": False},
+        {
+            "name": "valueType",
+            "propertyType": "CONSTANT",
+            "required": True,
+            "constants": ["NUMBER", "TEXT", "INTEGER"],
+        },
+        {
+            "name": "categoryCombo",
+            "propertyType": "REFERENCE",
+            "required": True,
+            "klass": "org.hisp.dhis.category.CategoryCombo",
+        },
+        {
+            "name": "optionSet",
+            "propertyType": "REFERENCE",
+            "required": True,
+            "klass": "org.hisp.dhis.option.OptionSet",
+        },
+        {
+            "name": "legendSet",
+            "collectionName": "legendSets",
+            "collection": True,
+            "propertyType": "COLLECTION",
+            "itemPropertyType": "REFERENCE",
+        },
+        {
+            "name": "dataSetElement",
+            "collectionName": "dataSetElements",
+            "collection": True,
+            "propertyType": "COLLECTION",
+            "itemPropertyType": "REFERENCE",
+            "embeddedObject": True,
+        },
+    ],
+}
+SCHEMAS = [DATA_ELEMENT, {"plural": "indicators", "properties": [{"name": "name", "required": True}]}]
+
+VALID = {
+    "id": "fbfJHSPpUQD",
+    "name": "ANC 1st visit",
+    "shortName": "ANC 1",
+    "valueType": "NUMBER",
+    "optionSet": {"code": "YES_NO"},
+    "url": "https://example.org/anc",
+    "style": "#A0c",
+    "email": "anc@example.org",
+    "zeroIsSignificant": False,
+    "created": "2021-03-04T00:00:00.000",
+    "decimals": 2,
+    "weight": 0.5,
+    "geometry": {"type": "Point"},
+    "legendSets": [{"id": "Yf6UHoPkdS6"}],
+    "dataSetElements": [{"dataSet": {"id": "lyLU2wR22tC"}}],
+}
+
+
+@pytest.mark.parametrize(
+    "change,expected",
+    [
+        ({}, []),
+        ({"name": None, "shortName": ""}, [
+            "Missing required property `name`",
+            "Length of property `shortName` must be between 1 and 50 but was 0",
+        ]),
+        ({"id": "not-a-uid-x"}, ["Property `id` is not a valid UID: not-a-uid-x"]),
+        ({"name": 5}, ["Property `name` must be a string"]),
+        ({"url": "example.org"}, ["Property `url` is not a valid url: example.org"]),
+        ({"style": "red"}, ["Property `style` is not a valid color: red"]),
+        ({"email": "anc"}, ["Property `email` is not a valid email: anc"]),
+        ({"zeroIsSignificant": "false"}, ["Property `zeroIsSignificant` must be a boolean"]),
+        ({"created": "yesterday"}, ["Property `created` must be a date"]),
+        ({"decimals": 1.5}, ["Property `decimals` must be an integer"]),
+        ({"decimals": 7}, ["Property `decimals` must be between 0 and 5 but was 7"]),
+        ({"decimals": True}, ["Property `decimals` must be an integer"]),
+        ({"weight": "1"}, ["Property `weight` must be a number"]),
+        ({"valueType": "NUMBERS"}, ["Property `valueType` must be one of ['INTEGER', 'NUMBER', 'TEXT']: NUMBERS"]),
+        ({"valueType": ["NUMBER"]}, ["Property `valueType` must be one of ['INTEGER', 'NUMBER', 'TEXT']: ['NUMBER']"]),
+        ({"optionSet": "YES_NO"}, ["Property `optionSet` must be an object reference"]),
+        ({"optionSet": {}}, ["Reference `optionSet` has no id"]),
+        ({"optionSet": None}, ["Missing required property `optionSet`"]),
+        ({"categoryCombo": {"id": "bjDvmb4bfuf1"}}, ["Reference `categoryCombo` has an invalid UID: bjDvmb4bfuf1"]),
+        ({"legendSets": {"id": "Yf6UHoPkdS6"}}, ["Property `legendSets` must be a list"]),
+        ({"legendSets": [{"id": "Yf6UHoPkdS6"}, {"id": 1}]}, ["Reference `legendSets` has an invalid UID: 1"]),
+        ({"dataSetElements": [{"dataSet": {"id": "x"}}]}, []),  # embedded, not a reference
+    ],
+)
+def test_validator_errors(change, expected):
+    validator = MetadataValidator(Schemas(SCHEMAS))
+    obj = dict(VALID, **change)
+    assert validator.errors("dataElements", obj) == expected
+
+
+def test_validator_without_schema():
+    validator = MetadataValidator(Schemas(SCHEMAS))
+    assert validator.errors("events", {"anything": 1}) == []
+    assert validator.errors("dataElements", "fbfJHSPpUQD") == ["Not an object: 'fbfJHSPpUQD'"]
+    assert validator.errors("indicators", {}) == ["Missing required property `name`"]
+
+
+def test_validator_split():
+    validator = MetadataValidator(Schemas(SCHEMAS))
+    payload = {
+        "system": {"version": "2.36"},
+        "dataElements": [VALID, dict(VALID, id="lhd8nlIHcGz", name=None), "x", dict(VALID, id="Cd3pYD4dITH")],
+        "events": [{"event": "a"}],
+        "indicators": [],
+    }
+    valid, invalid = validator.split(payload)
+    assert valid == {
+        "system": {"version": "2.36"},
+        "dataElements": [VALID, dict(VALID, id="Cd3pYD4dITH")],
+        "events": [{"event": "a"}],
+        "indicators": [],
+    }
+    assert invalid == [
+        {"collection": "dataElements", "index": 1, "id": "lhd8nlIHcGz", "errors": ["Missing required property `name`"]},
+        {"collection": "dataElements", "index": 2, "id": None, "errors": ["Not an object: 'x'"]},
+    ]
+
+
+def test_compile_schema_skips_unchecked_properties():
+    checks = compile_schema(DATA_ELEMENT)
+    # geometry (COMPLEX), displayName (not persisted) and optional (a collection without a type) have no check
+    assert len(checks) == len(DATA_ELEMENT["properties"]) - 3
+    assert compile_schema({"properties": [{"propertyType": "TEXT"}]}) == []  # no name
+
+
+def test_validator_is_fast():
+    validator = MetadataValidator(Schemas(SCHEMAS))
+    payload = {"dataElements": [dict(VALID, name="DE {}".format(i)) for i in range(20000)]}
+    start = time.perf_counter()
+    valid, invalid = validator.split(payload)
+    assert len(valid["dataElements"]) == 20000 and not invalid
+    assert time.perf_counter() - start < 2.0
+
+
+@responses.activate
+def test_validator_from_api(api):
+    responses.add(responses.GET, API_URL + "/schemas.json", body=json.dumps({"schemas": SCHEMAS}))
+    validator = MetadataValidator.from_api(api, cache=SchemaCache())
+    assert validator.errors("dataElements", dict(VALID, decimals=9)) == [
+        "Property `decimals` must be between 0 and 5 but was 9"
+    ]
+    assert "propertyType" in responses.calls[0].request.url